@@ -0,0 +1,112 @@
+"""Time building light maps on the shared pool against building them serially.
+
+Lights the dungeon (level1.png, shadows from the CPU caster) with point lights
+around the player, then times two kinds of frame, each with the maps built
+serially and on pools of several sizes -- every pool size in a process of its
+own, since the pool is made once per process:
+
+- ``flicker``: every light changes brightness, so each map is rescaled and
+  swapped into the composite (what torches do every tick);
+- ``move``: every light steps to a neighbouring cell whose shadow is cached,
+  so each map is rebuilt from its shadow and the falloff kernel.
+
+Prints the ms per frame of each, to choose ``world.LIGHT_MAP_WORKERS``.
+
+Usage: python agent_helpers/benchmark_light_maps.py [--frames N] [--lights a,b,...] [--workers a,b,...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(workers, n_lights, frames):
+    """ms per frame of each scenario with maps built on *workers* threads."""
+    sys.path.insert(0, project_root)
+    os.chdir(project_root)  # level1.png is loaded from cwd
+    import numpy as np
+    import carriage_return.world as world_module
+    from carriage_return.light import PointLight
+    from carriage_return.maze import Maze
+    from carriage_return.player import Player
+    from carriage_return.scene import Scene
+    from carriage_return.shadowcast import CpuShadowCaster
+    from carriage_return.world import Level, World
+
+    world_module.LIGHT_MAP_WORKERS = workers
+    world = World()
+    maze = Maze.load_image('level1.png')
+    world.add_level(Level('dungeon', maze))
+    scene = Scene()
+    scene.set_world(world)
+    level = world.levels['dungeon']
+    level.visibility = CpuShadowCaster(maze, supersample=level.supersample)
+
+    rng = np.random.default_rng(0)
+    open_cells = [(int(x), int(y)) for y, x in zip(*np.nonzero(maze.opacity == 0))]
+    viewer = open_cells[len(open_cells) // 2]
+    player = Player(scene)
+    player.location.update(maze, viewer)
+    near = sorted(open_cells, key=lambda c: (c[0] - viewer[0]) ** 2 + (c[1] - viewer[1]) ** 2)
+    cells = [near[int(i)] for i in rng.choice(min(len(near), 4 * n_lights), n_lights, replace=False)]
+    lights = [maze.add_light(PointLight(maze, color=(1, 0.6, 0.3)), pos=cell) for cell in cells]
+    is_open = set(open_cells)
+    steps = [(x + 1, y) if (x + 1, y) in is_open else (x, y) for x, y in cells]
+    for cell in steps:
+        level.shadow_map(cell)          # cached: the move below casts nothing
+    scene.update_sight(1 / 60.)
+
+    def flicker(i):
+        for light in lights:
+            light.brightness = 1.0 + 0.1 * (i % 2)
+
+    def move(i):
+        for light, cell in zip(lights, steps if i % 2 == 0 else cells):
+            light.pin(maze, cell)
+
+    times = {}
+    for name, change in (('flicker', flicker), ('move', move)):
+        change(1)
+        scene.update_sight(1 / 60.)
+        total = 0.0
+        for i in range(frames):
+            change(i)
+            start = time.perf_counter()
+            scene.update_sight(1 / 60.)
+            total += time.perf_counter() - start
+        times[name] = total * 1000 / frames
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, default=40, help="frames timed per scenario")
+    parser.add_argument('--lights', default='4,16', help="numbers of lights to try")
+    parser.add_argument('--workers', default='1,2,%d' % (os.cpu_count() or 1),
+                        help="pool sizes to compare (1 builds serially)")
+    parser.add_argument('--child', nargs=2, type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child[0], args.child[1], args.frames)))
+        return
+
+    print("cores: %d; ms per frame:" % (os.cpu_count() or 1))
+    print("%7s %8s %9s %9s" % ("lights", "workers", "flicker", "move"))
+    for n_lights in map(int, args.lights.split(',')):
+        for workers in sorted(set(map(int, args.workers.split(',')))):
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--frames', str(args.frames),
+                                   '--child', str(workers), str(n_lights)], capture_output=True, text=True)
+            if proc.returncode != 0:
+                print("%7d %8d  failed:\n%s" % (n_lights, workers, proc.stderr.strip()[-2000:]))
+                continue
+            times = json.loads(proc.stdout.strip().splitlines()[-1])
+            print("%7d %8d %9.2f %9.2f" % (n_lights, workers, times['flicker'], times['move']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Time each SpritesVisual drawing method on this machine and name the fastest.
+
+Builds the screenshot scene (see render_screenshot.py: the dungeon's scenery
+plus its actors) and renders it offscreen at several zoom levels around the
+player, once per method, each method in a process of its own so that one the
+driver cannot run fails alone. Prints the ms per frame of every method at
+every zoom, and the fastest overall. With --save, that method is recorded
+for this GL renderer in graphics.SPRITE_METHODS_FILE, and sprite visuals
+made without a method use it from then on.
+
+Usage: python agent_helpers/benchmark_sprites.py [--frames N] [--methods a,b,...] [--save]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+METHODS = ('point_sprite', 'geometry', 'instanced')
+
+#: camera widths rendered, in maze cells (the window opens at 120)
+ZOOMS = (30, 60, 120, 240)
+
+
+def measure(method, frames):
+    """Render the scene with *method* at each zoom; return the GL renderer's
+    name and {width: ms per frame}."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from render_screenshot import build_game
+    from carriage_return.backends.vispy.graphics import SpritesVisual, gl_renderer_name
+
+    SpritesVisual.default_method = method
+    ui, scene, renderer, player = build_game()
+    ui.canvas.set_current()
+    x, y = player.location.slot
+    camera = ui.view.camera
+
+    times = {}
+    for width in ZOOMS:
+        height = width * 0.5
+        camera.rect = (x - width / 2, y - height / 2, width, height)
+        # bring the sight up to date for this view, then leave it be: only
+        # the draw is timed. render() reads the frame back, so each call
+        # waits for the GPU to finish it.
+        renderer.update(dt=1/60.)
+        ui.canvas.render()
+        start = time.perf_counter()
+        for _ in range(frames):
+            ui.canvas.render()
+        times[width] = (time.perf_counter() - start) * 1000 / frames
+    return gl_renderer_name(), times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, default=30, help="frames timed per zoom")
+    parser.add_argument('--methods', default=','.join(METHODS), help="methods to compare")
+    parser.add_argument('--save', action='store_true',
+                        help="record the fastest as this GL renderer's sprite method")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.frames)))
+        return
+
+    results = {}
+    renderer = None
+    for method in args.methods.split(','):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', method,
+                               '--frames', str(args.frames)], capture_output=True, text=True)
+        if proc.returncode != 0:
+            print("%-12s  failed:\n%s" % (method, proc.stderr.strip()[-2000:]))
+            continue
+        renderer, times = json.loads(proc.stdout.strip().splitlines()[-1])
+        results[method] = {int(w): ms for w, ms in times.items()}
+
+    print("%s; ms per frame at camera width (cells):" % renderer)
+    print("%-12s" % "method" + "".join("%9d" % w for w in ZOOMS) + "%9s" % "mean")
+    for method, times in results.items():
+        mean = sum(times.values()) / len(times)
+        print("%-12s" % method + "".join("%9.2f" % times[w] for w in ZOOMS) + "%9.2f" % mean)
+    if results:
+        best = min(results, key=lambda m: sum(results[m].values()))
+        print("fastest: %s" % best)
+        if args.save:
+            save(renderer, best)
+
+
+def save(renderer, method):
+    """Record *method* as the sprite method of GL *renderer*."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from carriage_return.backends.vispy.graphics import SPRITE_METHODS_FILE
+    try:
+        with open(SPRITE_METHODS_FILE) as fh:
+            methods = json.load(fh)
+    except (OSError, ValueError):
+        methods = {}
+    methods[renderer] = method
+    os.makedirs(os.path.dirname(SPRITE_METHODS_FILE), exist_ok=True)
+    with open(SPRITE_METHODS_FILE, 'w') as fh:
+        json.dump(methods, fh, indent=1, sort_keys=True)
+    print("saved to %s for %s" % (SPRITE_METHODS_FILE, renderer))
+
+
+if __name__ == '__main__':
+    main()
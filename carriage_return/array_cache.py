@@ -1,74 +1,102 @@
+import threading
+from collections import OrderedDict
 
 
-class ArraySumCache:
-    """For efficiently adding multiple arrays together, in cases where the same set of arrays will be added
-    repeatedly plus a smaller number of arrays that change each time.
+class LRUArrayCache:
+    """Arrays by key, within a byte budget, least recently used evicted first.
 
+    For results that are expensive to compute and likely to be asked for
+    again -- a shadow map for a cell the viewer has stood on before. Cached
+    arrays are made read-only, since every caller that gets one shares it.
+    ``hits`` and ``misses`` count lookups, for tuning the budget.
 
+    Safe to use from several threads; the lock is held only for bookkeeping,
+    never while a missing array is computed.
     """
 
-    def __init__(self):
-        self._last_arrays = set()  # all arrays requested for summation on the previous round
-        self._last_cache_arrays = set()  # arrays used for cache sum 
-        self._last_cache = None  # last cache sum result
-        self._last_array_ids = None  # temporarily store ref to arrays to prevent ID reuse
-
-        # test metrics
-        self._n_used_from_cache = None
-        self._n_summed = None
-        self._n_stored_in_cache = None
-
-    def sum_arrays(self, array_list):
-        assert len(array_list) > 0
-
-        array_ids = {id(a):a for a in array_list}
-        self._last_array_ids = array_ids
-
-        arrays = set(array_ids.keys())
-
-        # if all arrays from previous cache are being summed again, then
-        # reuse the previously cached result
-        repeated_from_cache = arrays & self._last_cache_arrays
-        if repeated_from_cache == self._last_cache_arrays:
-            # previous cache is still valid, start there
-            self._n_used_from_cache = len(repeated_from_cache)
-            total = self._last_cache
-            summed_arrays = repeated_from_cache
-        else:
-            self._n_used_from_cache = 0
-            total = None
-            summed_arrays = set()
-
-        # Of the remaining data to be summed, anything that was repeated since last call
-        # can be added in to the new cache
-        remaining_arrays = arrays - summed_arrays
-        repeated = remaining_arrays & self._last_arrays
-
-        for arr in repeated:
-            # add remaining data that was repeated from last time, cache new result
-            if total is None:
-                total = array_ids[arr].copy()
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._arrays)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._arrays
+
+    def find(self, key):
+        """The array cached under *key*, or None; counted as a hit or a miss."""
+        with self._lock:
+            arr = self._arrays.get(key)
+            if arr is None:
+                self.misses += 1
             else:
-                total += array_ids[arr]
-        summed_arrays = summed_arrays | repeated
-        remaining_arrays = remaining_arrays - repeated
-
-        self._last_cache = None if total is None else total.copy()
-        self._last_cache_arrays = summed_arrays.copy()
-        self._n_stored_in_cache = len(summed_arrays)
-
-        # add in any remaining new data
-        for arr in remaining_arrays:
-            if total is None:
-                total = array_ids[arr].copy()
-            else:
-                total += array_ids[arr]
-        
-        self._n_summed = len(repeated) + len(remaining_arrays)
-
-        self._last_arrays = arrays
-
-        return total
-
-
-
+                self._arrays.move_to_end(key)
+                self.hits += 1
+            return arr
+
+    def get(self, key, compute):
+        """The array cached under *key*, calling ``compute()`` to make it on a miss."""
+        arr = self.find(key)
+        if arr is None:
+            arr = compute()
+            self.put(key, arr)
+        return arr
+
+    def get_many(self, keys, compute_many):
+        """The arrays cached under *keys*, in order.
+
+        The keys that miss are computed together, by one call of
+        ``compute_many(missing_keys)`` returning their arrays in the same
+        order -- for work that is cheaper done in one batch than key by key.
+        """
+        keys = list(keys)
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in found or key in missing:
+                    continue
+                arr = self._arrays.get(key)
+                if arr is None:
+                    missing.append(key)
+                    self.misses += 1
+                else:
+                    self._arrays.move_to_end(key)
+                    found[key] = arr
+                    self.hits += 1
+        if missing:
+            for key, arr in zip(missing, compute_many(missing)):
+                self.put(key, arr)
+                found[key] = arr
+        return [found[key] for key in keys]
+
+    def put(self, key, arr):
+        """Store *arr* under *key*, evicting old entries to stay within budget.
+
+        *arr* is made read-only. An array bigger than the whole budget is not
+        kept.
+        """
+        arr.setflags(write=False)
+        with self._lock:
+            old = self._arrays.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            if arr.nbytes > self.max_bytes:
+                return
+            self._arrays[key] = arr
+            self.nbytes += arr.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._arrays.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._arrays.clear()
+            self.nbytes = 0
@@ -1,3 +1,7 @@
+import json
+import os
+from collections import OrderedDict
+
 import numpy as np
 from PyQt5 import QtGui
 import vispy.visuals, vispy.scene, vispy.gloo
@@ -7,11 +11,39 @@ from vispy.visuals.transforms import STTransform, NullTransform
 # adaptation.py is pure game-side (no rendering imports); safe to import here to
 # keep the default exposure tied to the same outdoor-light reference the eye uses.
 from ...adaptation import OUTDOOR_ADAPT_LUMINANCE
+from ...world import Level, MEMORY_REF_LUMINANCE, MEMORY_STRENGTH
 
 
 # load support for opengl 3 features
 vispy.gloo.gl.use_gl('gl+')
 
+#: where ``agent_helpers/benchmark_sprites.py --save`` records the fastest
+#: SpritesVisual method of each GL renderer it has measured
+SPRITE_METHODS_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'return-to-carriage',
+                                   'sprite_methods.json')
+
+
+def gl_renderer_name():
+    """``'vendor / renderer'`` of the current GL context: the GPU and driver."""
+    gl = vispy.gloo.gl
+    return '%s / %s' % (gl.glGetParameter(gl.GL_VENDOR), gl.glGetParameter(gl.GL_RENDERER))
+
+
+def measured_sprite_method(path=None):
+    """The sprite method the benchmark found fastest on the current GL
+    renderer, or None if it has not been measured there (or no context is
+    current to ask)."""
+    try:
+        with open(SPRITE_METHODS_FILE if path is None else path) as fh:
+            methods = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    try:
+        name = gl_renderer_name()
+    except Exception:
+        return None
+    return methods.get(name)
+
 
 class SpritesVisual(vispy.visuals.Visual):
     """
@@ -20,13 +52,25 @@ class SpritesVisual(vispy.visuals.Visual):
         - Size / anchor offset measured in visual coordinates
         - Size / anchor offset measured in canvas coordinates
     
-    And 2 methods:
+    And 3 methods:
     
         - GLSL 120 drawing point_sprites
             map to sprite cs, set corners -> map to canvas, set point size -> map to render
         - GLSL 150+ with geometry shader converting points into quads
+        - GLSL 330 drawing one shared quad per sprite as an instance, the
+          sprite attributes advancing once per instance; the same corners as
+          the geometry shader, without a geometry stage (which many drivers,
+          llvmpipe among them, run slowly)
     
+    With no method given, ``default_method`` is used; failing that, the one
+    agent_helpers/benchmark_sprites.py --save measured fastest on this GL
+    renderer (see :func:`measured_sprite_method`); failing that, the
+    geometry shader where the GL has one.
     """
+    #: the method of sprite visuals created without one (None: by GL features)
+    default_method = None
+
+
     vertex_shader_2 = """
         #version 120
 
@@ -39,7 +83,6 @@ class SpritesVisual(vispy.visuals.Visual):
         varying vec4 v_fgcolor;
         varying vec4 v_bgcolor;
         varying vec2 v_point_coord_scale;
-        varying vec2 v_point_size;
 
         void main (void) {
             v_fgcolor = fgcolor;
@@ -65,7 +108,6 @@ class SpritesVisual(vispy.visuals.Visual):
             // points must be square; give scale factors to the fragment shader
             // to allow rectangular clipping.
             v_point_coord_scale = ps / size;
-            v_point_size = size;
             
             // Map center of sprite to render coordinates
             vec4 center = (bl + tr) / 2.0;
@@ -79,7 +121,6 @@ class SpritesVisual(vispy.visuals.Visual):
         varying vec4 v_bgcolor;
         varying float v_sprite;
         varying vec2 v_point_coord_scale;
-        varying vec2 v_point_size;
         
         uniform sampler2D atlas;
         uniform sampler1D atlas_map;
@@ -94,17 +135,12 @@ class SpritesVisual(vispy.visuals.Visual):
                 discard;
             }
             
-            // supersample sprite value
-            const float ss = 4;
-            float alpha = 0;
-            for (int i=0; i<ss; i++) {
-                for (int j=0; j<ss; j++) {
-                    vec2 dx = vec2(i/ss, j/ss) / v_point_size;
-                    vec2 tex_coords = atlas_coords.yx + (pt + dx) * atlas_coords.wz;
-                    vec4 tex = texture2D(atlas, tex_coords);
-                    alpha += tex.g / (ss*ss);
-                }
-            }
+            // one sample of the glyph's distance field (0.5 on its edge),
+            // antialiased across the screen pixel it crosses the edge in
+            vec2 tex_coords = atlas_coords.yx + pt * atlas_coords.wz;
+            float dist = texture2D(atlas, tex_coords).r;
+            float w = max(0.5 * fwidth(dist), 1e-5);
+            float alpha = smoothstep(0.5 - w, 0.5 + w, dist);
             
             gl_FragColor = v_fgcolor * alpha + v_bgcolor * (1-alpha);
         }
@@ -148,7 +184,6 @@ class SpritesVisual(vispy.visuals.Visual):
         out vec4 f_fgcolor;
         out vec4 f_bgcolor;
         out vec2 point_coord;
-        out vec2 point_size;
         
         uniform vec2 scale;
 
@@ -174,10 +209,6 @@ class SpritesVisual(vispy.visuals.Visual):
             br /= br.w;
             tl /= tl.w;
             
-            // Measure pixel size of sprite; fragment shader uses this to
-            // supersample the sprite texture
-            point_size = vec2(length(tr - tl), length(tr - br));
-            
             // Map corners of sprite to render coordinates
             gl_Position = $px_to_render(bl);
             point_coord = vec2(0, 1);
@@ -195,6 +226,49 @@ class SpritesVisual(vispy.visuals.Visual):
         }
     """
 
+    vertex_shader_instanced = """
+        #version 330 compatibility
+
+        in vec2 corner;       // of the shared quad: (0,0) bottom left .. (1,1) top right
+        in vec3 position;     // the rest once per sprite
+        in float sprite;
+        in vec4 fgcolor;
+        in vec4 bgcolor;
+
+        out float f_sprite;
+        out vec4 f_fgcolor;
+        out vec4 f_bgcolor;
+        out vec2 point_coord;
+
+        void main (void) {
+            f_sprite = sprite;
+            f_fgcolor = fgcolor;
+            f_bgcolor = bgcolor;
+
+            // Map sprite location to the coordinate system where the size of
+            // the sprite is specified
+            vec4 anchor_pos = $visual_to_sprite(vec4(position, 1));
+            anchor_pos /= anchor_pos.w;
+
+            // Find corners of sprite and map to pixel coordinates
+            vec4 ss_half = vec4($sprite_size, 0, 0) / 2.;
+            vec4 bl = $sprite_to_px(anchor_pos - ss_half);
+            vec4 tr = $sprite_to_px(anchor_pos + ss_half);
+            ss_half.x *= -1;
+            vec4 br = $sprite_to_px(anchor_pos - ss_half);
+            vec4 tl = $sprite_to_px(anchor_pos + ss_half);
+            bl /= bl.w;
+            tr /= tr.w;
+            br /= br.w;
+            tl /= tl.w;
+
+            // Map this corner of the sprite to render coordinates
+            vec4 px = mix(mix(bl, br, corner.x), mix(tl, tr, corner.x), corner.y);
+            gl_Position = $px_to_render(px);
+            point_coord = vec2(corner.x, 1.0 - corner.y);
+        }
+    """
+
     fragment_shader_3 = """
         #version 330 compatibility
         
@@ -203,7 +277,6 @@ class SpritesVisual(vispy.visuals.Visual):
         in vec4 f_bgcolor;
         in float f_sprite;
         in vec2 point_coord;
-        in vec2 point_size;
         
         uniform sampler2D atlas;
         uniform sampler1D atlas_map;
@@ -213,26 +286,23 @@ class SpritesVisual(vispy.visuals.Visual):
         {
             gl_FragColor = vec4(0, 0, 0, 0);
             vec4 atlas_coords = texture1D(atlas_map, (f_sprite + 0.5) / n_sprites);
-            vec2 pt = point_coord;
-            vec2 tex_coords;
+            vec2 tex_coords = vec2(0.00001, 0.00001) + atlas_coords.yx + point_coord * atlas_coords.wz;
             
-            // supersample sprite value
-            const int ss = 3;
-            float alpha = 0;
-            for (int i=0; i<ss; i++) {
-                for (int j=0; j<ss; j++) {
-                    vec2 dx = vec2(i, j) / (point_size*ss);
-                    tex_coords = vec2(0.00001, 0.00001) + atlas_coords.yx + (pt + dx) * atlas_coords.wz;
-                    vec4 tex = texture2D(atlas, tex_coords);
-                    alpha += tex.g / (ss*ss);
-                }
-            }
+            // one sample of the glyph's distance field (0.5 on its edge),
+            // antialiased across the screen pixel it crosses the edge in
+            float dist = texture2D(atlas, tex_coords).r;
+            float w = max(0.5 * fwidth(dist), 1e-5);
+            float alpha = smoothstep(0.5 - w, 0.5 + w, dist);
             
             gl_FragColor = f_fgcolor * alpha + f_bgcolor * (1-alpha);
         }
     """
     
     def __init__(self, atlas, sprite_size=(16, 16), point_cs='pixel', method=None):
+        if method is None:
+            method = self.default_method
+        if method is None:
+            method = measured_sprite_method()
         if method is None:
             if 'GL_GEOMETRY_SHADER' in vispy.gloo.gl.__dict__:
                 method = 'geometry'
@@ -252,7 +322,7 @@ class SpritesVisual(vispy.visuals.Visual):
         self.fgcolor = np.empty((0, 4), dtype='float32')
         self.bgcolor = np.empty((0, 4), dtype='float32')
         
-        self._atlas_tex = vispy.gloo.Texture2D(shape=(1,1,4), format='rgba', interpolation='nearest')
+        self._atlas_tex = vispy.gloo.Texture2D(shape=(1,1,1), format='luminance', interpolation='linear')
         self._atlas_map_tex = vispy.gloo.Texture1D(shape=(1,4), format='rgba', internalformat='rgba32f', interpolation='nearest')
         self._need_data_upload = False
         self._need_atlas_upload = True
@@ -263,15 +333,24 @@ class SpritesVisual(vispy.visuals.Visual):
             shaders = self.vertex_shader_2, self.fragment_shader_2
         elif method == 'geometry':
             shaders = self.vertex_shader_3, self.fragment_shader_3, self.geometry_shader_3
+        elif method == 'instanced':
+            shaders = self.vertex_shader_instanced, self.fragment_shader_3
         else:
-            raise ValueError('method must be "point_sprite" or "geometry"')
+            raise ValueError('method must be "point_sprite", "geometry" or "instanced"')
         vispy.visuals.Visual.__init__(self, *shaders)
 
-        self._draw_mode = 'points'
-        self.shared_program['position'] = vispy.gloo.VertexBuffer()
-        self.shared_program['sprite'] = vispy.gloo.VertexBuffer()
-        self.shared_program['fgcolor'] = vispy.gloo.VertexBuffer()
-        self.shared_program['bgcolor'] = vispy.gloo.VertexBuffer()
+        if method == 'instanced':
+            self._draw_mode = 'triangle_strip'
+            self.shared_program['corner'] = vispy.gloo.VertexBuffer(
+                np.array([[0, 0], [1, 0], [0, 1], [1, 1]], dtype='float32'))
+            divisor = 1
+        else:
+            self._draw_mode = 'points'
+            divisor = None
+        self.shared_program['position'] = vispy.gloo.VertexBuffer(divisor=divisor)
+        self.shared_program['sprite'] = vispy.gloo.VertexBuffer(divisor=divisor)
+        self.shared_program['fgcolor'] = vispy.gloo.VertexBuffer(divisor=divisor)
+        self.shared_program['bgcolor'] = vispy.gloo.VertexBuffer(divisor=divisor)
         
         # blending must be declared here: vispy applies gl_state incrementally
         # per visual, so relying on another visual having enabled blend leaves
@@ -318,12 +397,26 @@ class SpritesVisual(vispy.visuals.Visual):
             
         self._need_data_upload = False
 
+    def buffer_field(self, buffer, field):
+        """Return a view of *field* in vertex *buffer* to bind as a sprite
+        attribute: read once per sprite, i.e. per instance when instanced.
+        """
+        view = buffer[field]
+        if self.method == 'instanced':
+            view.divisor = 1
+        return view
+
     def _atlas_changed(self, ev):
         self._need_atlas_upload = True
         self.update()
 
     def _upload_atlas(self):
         self._atlas_tex.set_data(self.atlas.atlas)
+        # vispy has no mipmaps: filter with them and have GL build them, the
+        # texture being bound by the INTERPOLATION command
+        glir = self._atlas_tex.glir
+        glir.command('INTERPOLATION', self._atlas_tex.id, 'linear_mipmap_linear', 'linear')
+        glir.command('FUNC', 'glGenerateMipmap', 'texture_2d')
         self.shared_program['atlas'] = self._atlas_tex
         self._atlas_map_tex.set_data(self.atlas.sprite_coords)
         self.shared_program['atlas_map'] = self._atlas_map_tex
@@ -347,6 +440,10 @@ class SpritesVisual(vispy.visuals.Visual):
             view.view_program.vert['visual_to_sprite'] = vis_to_sprite
             view.view_program.vert['sprite_to_px'] = sprite_to_px
             view.view_program.vert['px_to_render'] = px_to_render
+        elif self.method == 'instanced':
+            view.view_program.vert['visual_to_sprite'] = vis_to_sprite
+            view.view_program.vert['sprite_to_px'] = sprite_to_px
+            view.view_program.vert['px_to_render'] = px_to_render
         elif self.method == 'geometry':
             view.view_program.geom['visual_to_sprite'] = vis_to_sprite
             view.view_program.geom['sprite_to_px'] = sprite_to_px
@@ -360,6 +457,10 @@ class SpritesVisual(vispy.visuals.Visual):
             
         if self._need_atlas_upload:
             self._upload_atlas()
+
+        if self.method == 'instanced' and self._sprite_count() == 0:
+            # no instances: GL would draw the quad once, from empty buffers
+            return False
         
         # set point size to match zoom
         #tr = view.transforms.get_transform('visual', 'canvas')
@@ -368,6 +469,9 @@ class SpritesVisual(vispy.visuals.Visual):
         #l = ((x-o)[:2]**2).sum()**0.5
         view.view_program.vert['sprite_size'] = tuple(self.sprite_size)
 
+    def _sprite_count(self):
+        return len(self.position)
+
     def _compute_bounds(self, axis, view):
         p = self.position[:, axis]
         return p.min(), p.max()
@@ -463,17 +567,31 @@ import pyqtgraph as pg
 
 
 class CharAtlas(object):
-    """Texture atlas containing rendered text characters.    
+    """Texture atlas of the signed distance fields of text characters.
+
+    Each character is rasterized by Qt at DOWNSAMPLE times *size* points,
+    and the distance from its edge (see _signed_distance) averaged down into
+    atlas cells of *size* points: 0.5 lies on the edge, 1 is SPREAD texels
+    inside the glyph or more, 0 as far outside. Sprites sample it once per
+    fragment, mipmapped, and antialias the edge at any zoom, so a few dozen
+    texels per glyph are plenty.
     """
-    def __init__(self, size=128):
+    #: the raster's resolution over the atlas's
+    DOWNSAMPLE = 4
+    #: the distance, in atlas texels, between the edge and either end of the field
+    SPREAD = 4
+
+    def __init__(self, size=32):
         self.atlas_changed = vispy.util.event.EventEmitter(type='atlas_changed')
         self.size = size
         self.columns = 8000 // size
-        self.font = QtGui.QFont('monospace', self.size)
+        self.font = QtGui.QFont('monospace', self.size * self.DOWNSAMPLE)
         self.chars = {}
         self._fm = QtGui.QFontMetrics(self.font)
-        char_shape = (int(self._fm.height()), int(self._fm.width('x')))
-        self.glyphs = np.empty((0,) + char_shape + (3,), dtype='ubyte')
+        ds = self.DOWNSAMPLE
+        char_shape = (-(-int(self._fm.height()) // ds), -(-int(self._fm.width('x')) // ds))
+        self._raster_shape = (char_shape[0] * ds, char_shape[1] * ds)
+        self.glyphs = np.empty((0,) + char_shape, dtype='ubyte')
         self._rebuild_atlas()
 
     def __getitem__(self, char):
@@ -490,22 +608,32 @@ class CharAtlas(object):
         newglyphs[:oldn] = self.glyphs
         self.glyphs = newglyphs
         
-        char_shape = self.glyphs.shape[1:3]
+        raster_shape = self._raster_shape
+        ds = self.DOWNSAMPLE
+        coverage = np.empty((len(chars),) + raster_shape, dtype='ubyte')
         
         for i,char in enumerate(chars):
             self.chars[char] = oldn + i
             
-            img = QtGui.QImage(char_shape[1], char_shape[0], QtGui.QImage.Format_RGB32)
+            img = QtGui.QImage(raster_shape[1], raster_shape[0], QtGui.QImage.Format_RGB32)
             p = QtGui.QPainter()
             p.begin(img)
             brush = QtGui.QBrush(QtGui.QColor(255, 0, 0))
-            p.fillRect(0, 0, char_shape[1], char_shape[0], brush)
+            p.fillRect(0, 0, raster_shape[1], raster_shape[0], brush)
             pen = QtGui.QPen(QtGui.QColor(0, 255, 0))
             p.setPen(pen)
             p.setFont(self.font)
             p.drawText(0, self._fm.ascent(), char)
             p.end()
-            self.glyphs[oldn+i] = pg.imageToArray(img)[..., :3].transpose(1, 0, 2)
+            coverage[i] = pg.imageToArray(img)[..., 1].T
+        
+        # raster pixels -> atlas texels -> 0..1 with the edge at 0.5; texels
+        # average the raster's distances, so those up to a texel past the
+        # field's ends count
+        dist = _signed_distance(coverage >= 128, (self.SPREAD + 1) * ds)
+        dist = dist.reshape(len(chars), raster_shape[0] // ds, ds, raster_shape[1] // ds, ds)
+        dist = dist.mean(axis=(2, 4)) / ds
+        self.glyphs[oldn:] = np.round(np.clip(0.5 + dist / (2 * self.SPREAD), 0, 1) * 255)
         
         self._rebuild_atlas()
         self.atlas_changed()
@@ -520,7 +648,7 @@ class CharAtlas(object):
         else:
             columns = self.columns
             
-        self.atlas = np.empty((atlas_rows * gs[1], columns*gs[2], 3), dtype=self.glyphs.dtype)
+        self.atlas = np.empty((atlas_rows * gs[1], columns*gs[2]), dtype=self.glyphs.dtype)
         
         self.sprite_coords = np.empty((n_glyphs, 4), dtype='float32')
         self.sprite_coords[:,2] = gs[1]
@@ -537,7 +665,42 @@ class CharAtlas(object):
         
         self.sprite_coords[:,::2] /= self.atlas.shape[0]
         self.sprite_coords[:,1::2] /= self.atlas.shape[1]
-        
+
+
+def _signed_distance(inside, limit):
+    """Distance in pixels from each pixel of the boolean images *inside* (on
+    the last two axes) to the edge of the shape each marks: positive within
+    the shape, negative without, and clipped to +-*limit* (an integer).
+
+    The edge runs midway between inside and outside pixels, and everything
+    beyond an image is outside.
+    """
+    pad = [(0, 0)] * (inside.ndim - 2) + [(1, 1), (1, 1)]
+    padded = np.pad(inside, pad)
+    dist = np.where(padded, _distance_to(~padded, limit + 1) - 0.5,
+                    0.5 - _distance_to(padded, limit + 1))
+    return np.clip(dist[..., 1:-1, 1:-1], -limit, limit)
+
+
+def _distance_to(features, limit):
+    """Euclidean distance from each pixel to the nearest True pixel of
+    *features* (images on the last two axes), exact up to the integer *limit*
+    and clipped there: the nearest in each column first, then the nearest of
+    those within *limit* columns.
+    """
+    h = features.shape[-2]
+    rows = np.arange(h, dtype='int16')[:, None]
+    above = np.maximum.accumulate(np.where(features, rows, -2 * h), axis=-2)
+    below = np.flip(np.minimum.accumulate(np.flip(np.where(features, rows, 3 * h), -2), axis=-2), -2)
+    # squared distances, in int16 while they are at most 2*limit**2: this
+    # loop is the whole cost of building an atlas, and bound by memory
+    column = np.minimum(np.minimum(rows - above, below - rows), limit).astype('int16') ** 2
+    d2 = column.copy()
+    for dx in range(1, limit + 1):
+        np.minimum(d2[..., dx:], column[..., :-dx] + dx**2, out=d2[..., dx:])
+        np.minimum(d2[..., :-dx], column[..., dx:] + dx**2, out=d2[..., :-dx])
+    return np.minimum(np.sqrt(d2, dtype='float32'), limit)
+
 
 class TextureMaskFilter(object):
     """Tone-maps the sprites against the level's sight field.
@@ -545,27 +708,67 @@ class TextureMaskFilter(object):
     Tone mapping lives here, per fragment, after the sprite's albedo color has
     been composited: gl_FragColor.rgb is the material color fg*alpha+bg*(1-alpha)
     (treated as linear reflectance) and gl_FragColor.a is coverage. The sight
-    texture supplies linear HDR light in rgb and a display-space memory overlay
-    in a. We expose the reflected luminance (albedo*light*exposure) and run it
-    through a Reinhard curve + display gamma, so bright light physically blows a
-    surface toward white rather than capping at its albedo. Exposure is driven by
-    the player's eye adaptation (set_exposure, once per frame).
+    texture supplies linear HDR light in rgb and, in a, how much of the cell is
+    out of sight. We expose the reflected luminance (albedo*light*exposure) and
+    run it through a Reinhard curve + display gamma, so bright light physically
+    blows a surface toward white rather than capping at its albedo. Exposure is
+    driven by the player's eye adaptation (set_exposure, once per frame).
+
+    Memory fades here too. The memory texture (set_memory) holds each cell's
+    remembered luminance and the level clock time it was seen at; the fade
+    since then is evaluated against the ``now`` uniform (set_now, once per
+    frame), so the memory overlay dims smoothly with no texture upload at all.
+    The curve is ``world.memory_display``'s. The overlay is a product of the
+    two textures, so it is evaluated at the four nearest texels and those are
+    interpolated -- as the overlay itself would be -- rather than the
+    textures, which along the edge of sight would blend the memory of the lit
+    side with the darkness of the other.
+
+    A second texture of the same shape, set with set_lights, is added to the
+    sight texture's light before tone mapping: the point lights a
+    LightAccumulator summed on the GPU. Until one is set it is black.
     """
     def __init__(self, texture, transform, scale):
         self.fshader = Function("""
             void apply_texture_mask() {
                 vec4 tex_pos = $transform(gl_FragCoord);
                 tex_pos /= tex_pos.w;
-                vec4 tex = texture2D($texture, tex_pos.xy);   // rgb = linear HDR light, a = display-space memory
+                vec4 tex = texture2D($texture, tex_pos.xy);   // rgb = linear HDR light, a = out of sight
+                vec3 light = tex.rgb + texture2D($lights, tex_pos.xy).rgb;
+                vec2 t = tex_pos.xy * $size - 0.5;            // texel space, centres on integers
+                vec2 d = 1.0 / $size;
+                vec2 c = (floor(t) + 0.5) * d;                // the nearest texel below-left
+                vec2 f = t - floor(t);
+                float recall = mix(mix($recall(c), $recall(c + vec2(d.x, 0.0)), f.x),
+                                   mix($recall(c + vec2(0.0, d.y)), $recall(c + d), f.x), f.y);
                 vec3 albedo = gl_FragColor.rgb;
-                vec3 refl = albedo * tex.rgb * $exposure;     // reflected luminance, exposed (Reinhard input)
+                vec3 refl = albedo * light * $exposure;       // reflected luminance, exposed (Reinhard input)
                 vec3 lit = refl / (1.0 + refl);               // Reinhard tone curve
                 lit = pow(lit, vec3(1.0/2.2));                // display gamma / OETF
-                vec3 mem = vec3(0.0, 0.0, tex.a);             // dim blue memory overlay (already display-encoded)
+                vec3 mem = vec3(0.0, 0.0, recall);            // dim blue memory overlay
                 gl_FragColor = vec4(lit + mem, gl_FragColor.a);
             }
         """)
+        # the memory overlay at the texel centred on pos
+        self.recall = Function("""
+            float recall_at(vec2 pos) {
+                vec2 seen = texture2D($memory, pos).rg;      // remembered luminance, when seen
+                float m = seen.r * exp($log_decay * ($now - seen.g)) * $memory_exposure;
+                return pow(m / (1.0 + m), 1.0/2.2) * $memory_strength * texture2D($texture, pos).a;
+            }
+        """)
         self.fshader['texture'] = texture
+        self.fshader['size'] = (float(texture.shape[1]), float(texture.shape[0]))
+        self.fshader['lights'] = vispy.gloo.Texture2D(np.zeros((1, 1, 4), dtype='float32'),
+                                                      internalformat='rgba32f')
+        self.fshader['recall'] = self.recall
+        self.recall['texture'] = texture
+        self.recall['memory'] = vispy.gloo.Texture2D(np.zeros((1, 1, 2), dtype='float32'),
+                                                     format='rg', internalformat='rg32f')
+        self.recall['now'] = 0.0
+        self.recall['log_decay'] = float(np.log(Level.MEMORY_DECAY_RATE))
+        self.recall['memory_exposure'] = 0.18 / MEMORY_REF_LUMINANCE
+        self.recall['memory_strength'] = float(MEMORY_STRENGTH)
         # sane default exposure so the first frame (before any update pushes the
         # player's adaptation) is valid: key / OUTDOOR_ADAPT_LUMINANCE, i.e. an
         # eye fully adapted to outdoor light.
@@ -583,6 +786,18 @@ class TextureMaskFilter(object):
         """Set the Reinhard exposure scalar (key / adaptation_luminance)."""
         self.fshader['exposure'] = float(value)
 
+    def set_lights(self, texture):
+        """Add *texture*'s linear HDR light to the sight texture's."""
+        self.fshader['lights'] = texture
+
+    def set_memory(self, texture):
+        """Draw the memory overlay from *texture* (the level's memory_field)."""
+        self.recall['memory'] = texture
+
+    def set_now(self, clock):
+        """Set the level clock time the memory fade is evaluated at."""
+        self.recall['now'] = float(clock)
+
     def _attach(self, visual):
         self._visual = visual
         self._fshader_expr = self.fshader()
@@ -601,18 +816,145 @@ class TextureMaskFilter(object):
         self._visual = None
 
 
+class LightAccumulator(object):
+    """Sums a level's point lights on the GPU, for TextureMaskFilter.set_lights.
+
+    The GPU counterpart of the level's CPU composite of its point lights. For
+    each light the ShadowRenderer casts its shadow into a texture kept for
+    the light's cell (nothing is read back; walls never move, so a torch
+    that only flickers is not recast), and one full-field pass adds
+    ``color * 255 * shadow / (d2 + 0.5)`` -- the same map a PointLight builds
+    on the CPU, including its square footprint -- into a float framebuffer
+    with additive blending. A last pass multiplies the sum by the viewer's
+    own shadow, its line of sight. The texture then holds what
+    ``line_of_sight * illuminance`` would for those lights, never having
+    touched the CPU.
+
+    *params* come from ``Level.point_light_params()``.
+    """
+    #: most per-cell shadow textures kept, least recently used recast
+    MAX_SHADOW_TEXTURES = 32
+
+    def __init__(self, shadows, supersample):
+        self.shadows = shadows
+        self.canvas = shadows.canvas
+        self.size = shadows.size
+        h, w = self.size
+        self.texture = vispy.gloo.Texture2D(shape=(h, w, 4), format='rgba', internalformat='rgba32f',
+                                            interpolation='linear', wrapping='clamp_to_edge')
+        self.fbo = vispy.gloo.FrameBuffer(color=self.texture)
+        # maze cell -> (shadow texture, its framebuffer), most recent last
+        self._shadow_textures = OrderedDict()
+
+        quad = np.array([[-1, -1], [1, -1], [-1, 1], [1, 1]], dtype='float32')
+        vert = """
+            attribute vec2 pos;
+            void main (void) {
+                gl_Position = vec4(pos, 0, 1);
+            }
+        """
+        light_frag = """
+            uniform sampler2D shadow;
+            uniform vec2 size;      // field (w, h) in pixels
+            uniform vec2 cell;      // the light's maze cell (x, y)
+            uniform float radius;   // footprint half-width, maze cells
+            uniform float ss;       // field pixels per maze cell
+            uniform vec3 color;     // scaled colour
+            void main (void) {
+                vec2 px = gl_FragCoord.xy - 0.5;           // field pixel index
+                vec2 off = floor(px / ss) - cell;
+                if( abs(off.x) > radius || abs(off.y) > radius ) {
+                    discard;
+                }
+                vec2 d = px - (cell + 0.5) * ss;
+                float falloff = 1.0 / (dot(d, d) + 0.5);   // 0.5 enforces height
+                float s = texture2D(shadow, gl_FragCoord.xy / size).r;
+                gl_FragColor = vec4(color * (255.0 * s * falloff), 1.0);
+            }
+        """
+        los_frag = """
+            uniform sampler2D shadow;
+            uniform vec2 size;
+            void main (void) {
+                gl_FragColor = vec4(texture2D(shadow, gl_FragCoord.xy / size).rrr, 1.0);
+            }
+        """
+        self.light_program = vispy.gloo.Program(vert, light_frag)
+        self.light_program['pos'] = quad
+        self.light_program['size'] = (w, h)
+        self.light_program['ss'] = float(supersample)
+        self.los_program = vispy.gloo.Program(vert, los_frag)
+        self.los_program['pos'] = quad
+        self.los_program['size'] = (w, h)
+
+    def render(self, viewer_pos, params):
+        """Sum the lights in *params* as seen from *viewer_pos*, or clear the
+        texture when *viewer_pos* is None (nothing in sight)."""
+        h, w = self.size
+        with self.fbo:
+            vispy.gloo.set_viewport(0, 0, w, h)
+            vispy.gloo.clear(color=(0, 0, 0, 0))
+            vispy.gloo.set_viewport(0, 0, *self.canvas.size)
+        if viewer_pos is None:
+            return
+
+        for x, y, radius, r, g, b in params:
+            cell = (float(x), float(y))
+            self._pass(self.light_program, ('one', 'one'), shadow=self._shadow(cell),
+                       cell=cell, radius=float(radius), color=(r, g, b))
+        viewer = tuple(float(v) for v in viewer_pos)
+        self._pass(self.los_program, ('zero', 'src_color'), shadow=self._shadow(viewer))
+
+    def _shadow(self, cell):
+        """The shadow texture for maze cell *cell*, cast on first use."""
+        entry = self._shadow_textures.pop(cell, None)
+        if entry is None:
+            if len(self._shadow_textures) >= self.MAX_SHADOW_TEXTURES:
+                _, entry = self._shadow_textures.popitem(last=False)
+            else:
+                texture = vispy.gloo.Texture2D(shape=self.size + (1,), format='red', internalformat='r8',
+                                               interpolation='linear', wrapping='repeat')
+                entry = (texture, vispy.gloo.FrameBuffer(color=texture))
+            with entry[1]:
+                self.shadows._cast(cell)
+        self._shadow_textures[cell] = entry
+        return entry[0]
+
+    def _pass(self, program, blend_func, **uniforms):
+        for name, value in uniforms.items():
+            program[name] = value
+        h, w = self.size
+        with self.fbo:
+            vispy.gloo.set_viewport(0, 0, w, h)
+            vispy.gloo.set_state(blend=True, blend_func=blend_func, depth_test=False)
+            program.draw('triangle_strip')
+            vispy.gloo.set_state(blend=False)
+            vispy.gloo.set_viewport(0, 0, *self.canvas.size)
+
+
 class ShadowRenderer(object):
     """For computing 2D shadows
     """
+    #: most shadow maps render_many draws side by side into one framebuffer
+    MAX_BATCH = 16
+
     def __init__(self, maze, canvas, supersample=1):
         self.maze = maze
         self.canvas = canvas
         self.size = (maze.shape[0] * supersample, maze.shape[1] * supersample)
         
-        # for render to texture
-        self.texture = vispy.gloo.Texture2D(shape=self.size+(4,), format='rgba', interpolation='linear', wrapping='repeat')
+        # for render to texture. Shadows are gray, so one 8-bit channel holds
+        # them: a quarter of the readback of RGBA, and what Level caches as is.
+        self.texture = vispy.gloo.Texture2D(shape=self.size+(1,), format='red', internalformat='r8',
+                                            interpolation='linear', wrapping='repeat')
         self.fbo = vispy.gloo.FrameBuffer(color=self.texture, 
                                           depth=vispy.gloo.RenderBuffer(self.size))
+
+        # render_many's framebuffers, each a row of field-sized tiles. Sized on
+        # first use (that needs a current context to query the GL limit) and
+        # pooled: a deferred batch holds its framebuffer until it is read.
+        self._free_fbos = []
+        self._tiles = 0
         
         vert = """
             #version 330 compatibility
@@ -715,20 +1057,131 @@ class ShadowRenderer(object):
         self.program['ij'] = corner_coords.copy()  # copy to prevent warning about discontiguous data
         
     def render(self, pos, read=False):
+        """Cast the shadow map seen from *pos*; with *read*, return it as an
+        (h, w) uint8 array (255 lit, 0 shadowed).
         """
-        """
-        self.program['center'] = pos
         img = None
         with self.fbo:
-            vispy.gloo.clear(color=(1, 1, 1))
-            vispy.gloo.set_viewport(0, 0, *self.size[::-1])
-            #vispy.gloo.set_state(cull_face=True)
-            self.program.draw(mode='points', check_error=True)
-
-            vispy.gloo.set_viewport(0, 0, *self.canvas.size)
+            self._cast(pos)
             if read:
-                img = self.fbo.read()[::-1]
+                img = _read_red(0, 0, *self.size[::-1])
         
         return img
 
+    def _cast(self, pos):
+        """Draw the shadow map seen from *pos* into the bound framebuffer."""
+        self.program['center'] = pos
+        vispy.gloo.clear(color=(1, 1, 1))
+        vispy.gloo.set_viewport(0, 0, *self.size[::-1])
+        #vispy.gloo.set_state(cull_face=True)
+        self.program.draw(mode='points', check_error=True)
+        vispy.gloo.set_viewport(0, 0, *self.canvas.size)
+
+    def render_many(self, positions, read=True):
+        """Shadow maps for several positions, as a list in the same order.
+
+        Each map is what ``render(pos, read)`` returns, but the maps are drawn
+        side by side into the tiles of one framebuffer and read back with a
+        single transfer, so a batch pays one pipeline stall instead of one per
+        light. Batches larger than the framebuffer holds are split.
+        """
+        imgs = []
+        for batch in self._batches(positions):
+            fbo = self._draw_tiles(batch)
+            imgs.extend(self._read_tiles(fbo, len(batch)) if read else [None] * len(batch))
+            self._free_fbos.append(fbo)
+        return imgs
+
+    def render_deferred(self, positions):
+        """Start casting shadow maps for *positions*; read them back later.
+
+        Draws the batch exactly as :meth:`render_many` does but returns at
+        once, with a :class:`DeferredShadows` whose ``result()`` does the
+        readback. Called a frame later, that read finds the GPU long finished
+        with the draw, so the latency of the cast is hidden behind the frame
+        in between instead of stalling this one.
+        """
+        return DeferredShadows(self, [(self._draw_tiles(batch), batch)
+                                      for batch in self._batches(positions)])
+
+    def _batches(self, positions):
+        positions = list(positions)
+        if self._tiles == 0:
+            max_width = vispy.gloo.gl.glGetParameter(vispy.gloo.gl.GL_MAX_TEXTURE_SIZE)
+            self._tiles = max(1, min(self.MAX_BATCH, max_width // self.size[1]))
+        return [positions[i:i + self._tiles] for i in range(0, len(positions), self._tiles)]
+
+    def _draw_tiles(self, positions):
+        """Draw one batch into a free tile framebuffer, and return it."""
+        h, w = self.size
+        if self._free_fbos:
+            fbo = self._free_fbos.pop()
+        else:
+            shape = (h, w * self._tiles)
+            fbo = vispy.gloo.FrameBuffer(
+                color=vispy.gloo.Texture2D(shape=shape + (1,), format='red', internalformat='r8'),
+                depth=vispy.gloo.RenderBuffer(shape))
+        with fbo:
+            vispy.gloo.clear(color=(1, 1, 1))
+            for i, pos in enumerate(positions):
+                # the shader maps the maze onto the whole viewport, so
+                # moving the viewport is all it takes to draw into tile i
+                self.program['center'] = pos
+                vispy.gloo.set_viewport(i * w, 0, w, h)
+                self.program.draw(mode='points', check_error=True)
+            vispy.gloo.set_viewport(0, 0, *self.canvas.size)
+        return fbo
+
+    def _read_tiles(self, fbo, n):
+        h, w = self.size
+        with fbo:
+            row = _read_red(0, 0, n * w, h)
+        return [row[:, i * w:(i + 1) * w] for i in range(n)]
+
+
+def _read_red(x, y, w, h):
+    """Read the red channel of a region of the bound framebuffer as an
+    (h, w) uint8 array, rows in GL order (row 0 at the bottom, i.e. row = y).
+    """
+    # vispy.gloo.gl follows GL ES 2.0, whose glReadPixels has no GL_RED
+    # format; 'gl+' (above) means PyOpenGL is there to call it directly
+    from OpenGL import GL
+    vispy.gloo.finish()  # flushes the queued GLIR draws, as read_pixels does
+    GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+    buf = GL.glReadPixels(x, y, w, h, GL.GL_RED, GL.GL_UNSIGNED_BYTE)
+    GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 4)
+    if not isinstance(buf, np.ndarray):
+        buf = np.frombuffer(buf, dtype=np.ubyte)
+    return buf.reshape(h, w)
+
+
+class DeferredShadows(object):
+    """Shadow maps :meth:`ShadowRenderer.render_deferred` has drawn but not
+    yet read back.
+
+    ``result()`` reads them (once; later calls return the same list) and hands
+    the framebuffers back to the renderer. Call it with the renderer's GL
+    context current -- in practice, from a later draw. ``release()`` hands
+    them back unread, for maps no longer wanted.
+    """
+    def __init__(self, renderer, batches):
+        self._renderer = renderer
+        self._batches = batches
+        self._result = None
+
+    def result(self):
+        if self._result is None:
+            imgs = []
+            for fbo, batch in self._batches:
+                imgs.extend(self._renderer._read_tiles(fbo, len(batch)))
+                self._renderer._free_fbos.append(fbo)
+            self._batches = []
+            self._result = imgs
+        return self._result
+
+    def release(self):
+        for fbo, batch in self._batches:
+            self._renderer._free_fbos.append(fbo)
+        self._batches = []
+
 
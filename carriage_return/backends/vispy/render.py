@@ -3,7 +3,9 @@
 The game writes sprite data into layers (see layers.py); this module draws
 them. Layer changes are detected by comparing integer version counters once
 per draw, so an unchanged layer costs two comparisons per frame and a changed
-layer costs whole-array numpy copies plus ranged VBO uploads.
+layer costs ranged VBO uploads of just the sprites written (see
+``SpriteLayer.dirty_ranges``), straight from the layer's own records; a
+reallocated layer is uploaded whole.
 
 Synchronization runs inside the visual's _prepare_draw so it covers both
 on-screen draws and offscreen SceneCanvas.render() calls (which do not emit
@@ -13,18 +15,56 @@ import time
 
 import vispy.scene, vispy.gloo
 
-from .graphics import CharAtlas, SpritesVisual, TextureMaskFilter, ShadowRenderer
+import numpy as np
+
+from .graphics import CharAtlas, LightAccumulator, SpritesVisual, TextureMaskFilter, ShadowRenderer
 
 
 class LayerSpritesVisual(SpritesVisual):
-    """SpritesVisual that pulls pending game-layer data just before drawing."""
+    """SpritesVisual that draws game SpriteLayers straight from their memory.
+
+    It keeps no sprite arrays of its own: ``buffers`` holds, per layer to
+    draw, the fields of a vertex buffer over that layer's records (see
+    ``layers.SPRITE_DTYPE``), and the visual draws once per layer with those
+    bound as its attributes. Pending game-layer data is pulled just before
+    drawing.
+    """
     _layer_sync = None
 
+    def __init__(self, *args, **kwargs):
+        SpritesVisual.__init__(self, *args, **kwargs)
+        self.buffers = []   # (layer records, {attribute: buffer field}) per layer
+
     def _prepare_draw(self, view):
         if self._layer_sync is not None:
             self._layer_sync()
         return SpritesVisual._prepare_draw(self, view)
 
+    def _sprite_count(self):
+        return sum(len(data) for data, fields in self.buffers)
+
+    def draw(self):
+        if not self.visible:
+            return
+        if self._prepare_draw(view=self) is False:
+            return
+        self._configure_gl_state()
+        try:
+            for data, fields in self.buffers:
+                for name, field in fields.items():
+                    self.shared_program[name] = field
+                self._program.draw(self._vshare.draw_mode, self._vshare.index_buffer)
+        except Exception:
+            vispy.util.logger.warning("Error drawing visual %r" % self)
+            raise
+
+    def _compute_bounds(self, axis, view):
+        p = np.concatenate([data['position'][:, axis] for data, fields in self.buffers] or [[]])
+        p = p[~np.isnan(p)]
+        if len(p) == 0:
+            return None
+        return p.min(), p.max()
+
 
 LayerSprites = vispy.scene.visuals.create_visual_node(LayerSpritesVisual)
 
@@ -32,12 +72,17 @@ LayerSprites = vispy.scene.visuals.create_visual_node(LayerSpritesVisual)
 class VispyLayerRenderer(object):
     """Draws a GlyphRegistry + SpriteLayers using a single Sprites visual.
 
-    Each layer maps to one SpriteData region in the visual; regions are
-    created lazily (a layer that never gains sprites is never uploaded) and
-    resized when the layer's sprite count changes. Depth ordering between
+    Each layer maps to one vertex buffer, uploaded from the layer's own
+    ``data`` records with no intermediate copy; buffers are created lazily (a
+    layer that never gains sprites is never uploaded) and re-uploaded whole
+    only when the layer reallocates its records. Depth ordering between
     layers comes from the z coordinate of sprite positions, exactly as it did
     when entities wrote into the visual directly.
     """
+    #: each shader attribute and the SpriteLayer field it is drawn from
+    _FIELDS = (('position', 'position'), ('sprite', 'glyph'),
+               ('fgcolor', 'fgcolor'), ('bgcolor', 'bgcolor'))
+
     def __init__(self, ui, glyphs, layers):
         self.glyphs = glyphs
         self.layers = list(layers)
@@ -50,7 +95,10 @@ class VispyLayerRenderer(object):
                                 parent=ui.view.scene)
         self.txt._layer_sync = self.sync
 
-        self._regions = {layer.name: None for layer in self.layers}
+        # per layer: its vertex buffer with the fields bound to each
+        # attribute, and the records it was last uploaded from
+        self._buffers = {layer.name: None for layer in self.layers}
+        self._uploaded = {layer.name: None for layer in self.layers}
         self._synced_versions = {layer.name: None for layer in self.layers}
 
         # schedule a redraw whenever the game writes to a layer. Layer writes
@@ -79,26 +127,42 @@ class VispyLayerRenderer(object):
                 self.atlas.add_chars(new_chars)
                 self._n_chars_synced += len(new_chars)
 
+        changed = False
         for layer in self.layers:
             versions = (layer.version, layer.structure_version)
-            if versions == self._synced_versions[layer.name]:
+            synced = self._synced_versions[layer.name]
+            if versions == synced:
                 continue
-
-            region = self._regions[layer.name]
-            if region is None:
-                if len(layer) == 0:
-                    continue
-                region = self.txt.add_sprites((len(layer),))
-                self._regions[layer.name] = region
-            elif len(region) != len(layer):
-                region.set_shape((len(layer),))
-
-            region.position = layer.position
-            region.sprite = layer.glyph
-            region.fgcolor = layer.fgcolor
-            region.bgcolor = layer.bgcolor
+            # read after the versions: records newer than them are simply
+            # uploaded again at the next sync
+            data = layer.data
+
+            if data is not self._uploaded[layer.name]:
+                if len(data):
+                    buf = self._buffers[layer.name]
+                    if buf is None:
+                        buf = vispy.gloo.VertexBuffer(data)
+                    else:
+                        buf = buf[0]
+                        buf.set_data(data)
+                    # a field view keeps the size of the buffer it was taken
+                    # from, which is the count of sprites drawn: take new ones
+                    fields = {name: self.txt.buffer_field(buf, field) for name, field in self._FIELDS}
+                    self._buffers[layer.name] = buf, fields
+                self._uploaded[layer.name] = data
+                changed = True
+            elif len(data):
+                # the same records as last time: upload only the rows written
+                buf = self._buffers[layer.name][0]
+                for start, stop in layer.dirty_ranges(None, synced[0]):
+                    buf.set_subdata(data[start:stop], offset=start)
             self._synced_versions[layer.name] = versions
 
+        if changed:
+            self.txt.buffers = [(self._uploaded[layer.name], self._buffers[layer.name][1])
+                                for layer in self.layers
+                                if self._uploaded[layer.name] is not None and len(self._uploaded[layer.name])]
+
 
 class VispySceneRenderer(object):
     """Complete vispy/OpenGL renderer for a Scene.
@@ -110,18 +174,44 @@ class VispySceneRenderer(object):
       ``visibility``
     - drives ``level.update_sight(dt, player)`` once per canvas draw, on the
       level it has captured (never "whatever level is current")
-    - uploads the level's ``sight`` FieldLayer to a texture (only when its
-      version changed) and applies it to the sprites as a mask filter
+    - uploads the level's ``sight`` and ``memory_field`` FieldLayers to
+      textures (only the region written since the last upload, see
+      ``FieldLayer.dirty_region``) and applies them to the sprites as a mask
+      filter, which fades memory against the level's clock
 
     As in the pre-split design, the sight update runs as a canvas draw-event
     callback, i.e. after the scene has been drawn; the updated field is
     rendered on the next frame. Offscreen SceneCanvas.render() calls do not
     emit draw events, so batch/screenshot code must call update() explicitly
     (with an explicit dt for determinism).
+
+    *deferred_shadows* turns on each level's deferred shadow casting (see
+    ``Level.deferred_shadows``): shadow maps are read back a frame after they
+    are drawn, so moving never stalls a draw on the GPU, at the cost of
+    shadows that trail the light by a frame. Interactive play wants it; a
+    screenshot, which must be exact on the first frame, does not.
+
+    *gpu_lighting* sums the point lights on the GPU instead (a
+    LightAccumulator feeding the mask filter), with the level set to leave
+    them out of its own composite (``Level.gpu_point_lights``). No point
+    light's shadow is then read back or composited in numpy; eye adaptation
+    and memory see an unshadowed estimate of them.
+
+    *threaded_sight* composites the displayed level's lighting and sight on a
+    thread of its own (see ``Level.threaded_sight``), so the draw only swaps
+    in and uploads the last finished frame. The compositor thread never
+    casts; every shadow map is cast on the draw thread and reaches it through
+    the level's cache.
     """
-    def __init__(self, ui, scene):
+    def __init__(self, ui, scene, deferred_shadows=False, gpu_lighting=False, threaded_sight=False):
         self.ui = ui
         self.scene = scene
+        self.deferred_shadows = deferred_shadows
+        self.threaded_sight = threaded_sight
+        self.gpu_lighting = gpu_lighting
+        self.light_accumulator = None
+        # what the accumulator last summed: (viewer cell, point light params)
+        self._accumulated = None
 
         self.layer_renderer = VispyLayerRenderer(ui, scene.glyphs, list(scene.sprite_layers.values()))
         self.txt = self.layer_renderer.txt
@@ -135,6 +225,8 @@ class VispySceneRenderer(object):
         self.sight_texture = None
         self.sight_filter = None
         self._sight_version = None
+        self.memory_texture = None
+        self._memory_version = None
         self._last_update_time = None
 
         # both the shadow renderer and the sight texture are sized from the
@@ -156,13 +248,20 @@ class VispySceneRenderer(object):
         here, and everything below is sized from that captured level -- not
         from the scene, whose current level can change under a concurrent draw.
         """
-        level = self._level = self.scene.level
+        old, level = self._level, self.scene.level
+        if old is not None and old is not level:
+            # nothing composites a level that is not displayed
+            old.threaded_sight = False
+        self._level = level
 
         # GPU shadow-map provider for LOS/lighting computations, injected onto
         # the level so the player and its lights reach the provider sized to
         # their own maze -- never a provider left over from another level.
         level.visibility = ShadowRenderer(level.maze, self.ui.canvas,
                                           supersample=level.supersample)
+        level.deferred_shadows = self.deferred_shadows
+        level.gpu_point_lights = self.gpu_lighting
+        level.threaded_sight = self.threaded_sight
 
         # sight field -> texture, masking the sprites visual
         if self.sight_filter is not None:
@@ -170,17 +269,42 @@ class VispySceneRenderer(object):
 
         ms = level.maze.shape
         # RGBA float: rgb carry linear HDR light (los*illuminance, may exceed 1),
-        # a carries the display-space memory overlay. The tone map that turns
-        # this into displayable color lives in TextureMaskFilter (per fragment).
+        # a how far out of sight each texel is, which scales the memory overlay.
+        # The tone map that turns this into displayable color lives in
+        # TextureMaskFilter (per fragment).
         self.sight_texture = vispy.gloo.Texture2D(shape=(*level.field_shape[:2], 4), format='rgba',
                                                   internalformat='rgba32f',
                                                   interpolation='linear', wrapping='repeat')
         tr = self.txt.transforms.get_transform('framebuffer', 'visual')
         self.sight_filter = TextureMaskFilter(self.sight_texture, tr, scale=(1./ms[1], 1./ms[0]))
+        # remembered luminance and when it was seen; faded in the shader
+        self.memory_texture = vispy.gloo.Texture2D(shape=(*level.field_shape[:2], 2), format='rg',
+                                                   internalformat='rg32f',
+                                                   interpolation='linear', wrapping='repeat')
+        self.sight_filter.set_memory(self.memory_texture)
         self.txt.attach(self.sight_filter)
+        if self.gpu_lighting:
+            self.light_accumulator = LightAccumulator(level.visibility, level.supersample)
+            self.sight_filter.set_lights(self.light_accumulator.texture)
+            self._accumulated = None
 
-        # force the next update() to upload into the new texture
+        # force the next update() to upload into the new textures
         self._sight_version = None
+        self._memory_version = None
+
+    def _accumulate_lights(self, level):
+        """Re-sum the level's point lights on the GPU if any of them, or the
+        viewer, changed since the last sum."""
+        player = self.scene.player
+        viewer = None
+        if player is not None and player.level is level:
+            viewer = tuple(player.location.global_location.slot)
+        params = level.point_light_params()
+        last = self._accumulated
+        if last is not None and last[0] == viewer and np.array_equal(last[1], params):
+            return
+        self.light_accumulator.render(viewer, params)
+        self._accumulated = (viewer, params)
 
     def _on_draw(self, event):
         now = time.perf_counter()
@@ -200,7 +324,8 @@ class VispySceneRenderer(object):
         what shows.
         """
         level = self._level
-        level.update_sight(dt, self.scene.player)
+        # only the part of the level the camera shows is composited
+        level.update_sight(dt, self.scene.player, view=self.scene.viewport.rect)
 
         # exposure tracks the player's eye adaptation and changes every frame,
         # so push it to the tone-mapping filter each draw (cheap uniform set).
@@ -220,7 +345,23 @@ class VispySceneRenderer(object):
             if player.adaptation.settling:
                 self.ui.mark_dirty()
 
-        sight = level.sight
-        if sight.version != self._sight_version:
-            self.sight_texture.set_data(sight.data)
-            self._sight_version = sight.version
+        if self.light_accumulator is not None:
+            self._accumulate_lights(level)
+
+        # memory fades in the shader against the level clock: a still frame
+        # sets this uniform and uploads nothing
+        self.sight_filter.set_now(level.clock)
+        self._sight_version = self._upload(level.sight, self.sight_texture, self._sight_version)
+        self._memory_version = self._upload(level.memory_field, self.memory_texture,
+                                            self._memory_version)
+
+    @staticmethod
+    def _upload(field, texture, version):
+        """Upload the box of *field* written since *version* into *texture*;
+        return the version now uploaded."""
+        region = field.dirty_region(version)
+        if region is not None:
+            rows, cols = region
+            texture.set_data(np.ascontiguousarray(field.data[rows, cols]),
+                             offset=(rows.start, cols.start))
+        return field.version
@@ -92,6 +92,7 @@ class MainWindow:
         one coalesced repaint whenever game state changed, and the
         game-requested quit."""
         self._scroll_camera(ev)
+        self._publish_viewport()
         if self.grid_renderer is not None:
             self.grid_renderer.sync()
         if self._dirty:
@@ -126,6 +127,20 @@ class MainWindow:
         cr.size = nrv[2:]
         self.view.camera.rect = cr
 
+    def _publish_viewport(self):
+        """Tell the game which maze cells the camera shows (``scene.viewport``).
+
+        Read from the view's transform rather than the camera rect, which a
+        fixed aspect can leave smaller than what is actually on screen.
+        """
+        if self.game_scene is None:
+            return
+        w, h = self.view.size
+        corners = self.view.scene.transform.imap(np.array([[0, 0], [w, h]], dtype='float32'))[:, :2]
+        x0, y0 = np.floor(corners.min(axis=0))
+        x1, y1 = np.ceil(corners.max(axis=0))
+        self.game_scene.viewport.set_rect((x0, y0, x1, y1))
+
     def _update_camera_target(self, event=None):
         location = self._follow_entity.location
         pp = np.array(location.global_location.slot)
@@ -18,15 +18,18 @@ update(), which coalesces).
 
 - ``version`` is bumped on any data write.
 - ``structure_version`` is additionally bumped when the underlying arrays are
-  reallocated (new sprites added or a slot reshaped), meaning any references a
-  backend holds into the old arrays are stale.
+  reallocated (a layer outgrowing its capacity or a slot reshaped), meaning
+  any references a backend holds into the old arrays are stale.
 
 Conventions:
 - Sprite positions are float32 (x, y, z); a NaN position hides the sprite.
 - ``glyph`` values are ids from a GlyphRegistry; backends map ids to their own
-  representation (texture atlas index, terminal character, ...).
+  representation (texture atlas index, terminal character, ...). A
+  SpriteLayer holds them as float32 (see SPRITE_DTYPE).
 """
 
+import bisect
+
 import numpy as np
 
 from .events import Observable
@@ -100,23 +103,56 @@ class GlyphRegistry(object):
         return lut
 
 
+#: one SpriteLayer row: all of a sprite's attributes, interleaved so that a
+#: backend can hand the layer's memory to the GPU as one vertex buffer. Glyph
+#: ids are float32 because that is what a vertex attribute reads; ids are
+#: exact up to 2**24, far beyond any registry.
+SPRITE_DTYPE = np.dtype([('position', 'float32', 3), ('glyph', 'float32'),
+                         ('fgcolor', 'float32', 4), ('bgcolor', 'float32', 4)])
+
+
 class SpriteLayer(GlyphLayer):
     """A collection of positioned character sprites owned by the game.
 
     The sparse layer kind: every sprite has its own free (x, y, z) position.
     Regions are allocated with add_sprites(), which returns a SpriteSlot
-    handle used to write position/glyph/color data. All slots share one set
-    of contiguous arrays so a backend can upload the layer in one call.
+    handle used to write position/glyph/color data. All slots share one
+    array of :data:`SPRITE_DTYPE` records, ``data``, so a backend can upload
+    the layer in one call; ``position``, ``glyph``, ``fgcolor`` and
+    ``bgcolor`` are views of its fields.
+
+    The arrays are a slab: rows freed by remove_sprites() are hidden and kept
+    on a free list, and the next allocation that fits takes them, so adding
+    and removing sprites costs the size of the slot and leaves the arrays
+    where they were. Only when nothing free fits do the arrays grow, doubling
+    their capacity; when the rows in use shrink to a quarter of it, the
+    free rows at the end are given back.
+
+    Like a FieldLayer, the layer remembers where its last writes landed --
+    which attribute, which rows -- so a backend can upload just those: see
+    :meth:`dirty_ranges`.
     """
+    #: the attributes a slot writes, as dirty_ranges() names them
+    ATTRIBUTES = ('position', 'glyph', 'fgcolor', 'bgcolor')
+
+    #: writes whose rows are remembered; a reader further behind than this is
+    #: told the whole layer changed
+    DIRTY_HISTORY = 256
+
     def __init__(self, name=None):
         GlyphLayer.__init__(self, name=name)
-        self.position = np.empty((0, 3), dtype='float32')
-        self.glyph = np.empty((0,), dtype='uint32')
-        self.fgcolor = np.empty((0, 4), dtype='float32')
-        self.bgcolor = np.empty((0, 4), dtype='float32')
+        self._set_data(np.empty((0,), dtype=SPRITE_DTYPE))
         self.slots = []
+        self._free = []    # sorted, disjoint (start, stop) ranges of hidden rows
+        self._dirty = []   # (version, attribute or None for all, start, stop)
 
     def __len__(self):
+        """The number of sprites in the layer's slots; see also :attr:`capacity`."""
+        return self.capacity - sum(stop - start for start, stop in self._free)
+
+    @property
+    def capacity(self):
+        """The rows the arrays hold, free rows included."""
         return self.position.shape[0]
 
     def add_sprites(self, shape):
@@ -127,21 +163,20 @@ class SpriteLayer(GlyphLayer):
         if not isinstance(shape, tuple):
             raise TypeError("shape must be a tuple (got %r)" % (shape,))
         n = int(np.prod(shape))
-        old_size = self._resize(len(self) + n)
-        slot = SpriteSlot(self, start=old_size, shape=shape)
+        slot = SpriteSlot(self, start=self._allocate(n), shape=shape)
         self.slots.append(slot)
         return slot
 
     def remove_sprites(self, slot):
-        """Free *slot*, repacking the remaining slots into contiguous arrays.
+        """Free *slot*: hide its sprites and put its rows on the free list.
 
-        Bumps ``structure_version``, so a backend holding references into the
-        old arrays re-reads them at its next sync. The freed slot must not be
-        written to afterwards.
+        The other slots stay where they are; only if the layer then gives
+        back its free tail is ``structure_version`` bumped. The freed slot
+        must not be written to afterwards.
         """
         self.slots.remove(slot)
         slot.layer = None
-        self._slot_shape_changed()
+        self._release(*slot.indices)
 
     def clear(self):
         """Free every slot, leaving the layer empty.
@@ -154,38 +189,123 @@ class SpriteLayer(GlyphLayer):
         self.slots = []
         self._slot_shape_changed()
 
+    def _allocate(self, n):
+        """Take *n* rows for a new slot -- the first free range they fit in,
+        else the end of the arrays, grown to fit -- and return the first."""
+        if n == 0:
+            return 0
+        for i, (start, stop) in enumerate(self._free):
+            if stop - start >= n:
+                if stop - start == n:
+                    del self._free[i]
+                else:
+                    self._free[i] = (start + n, stop)
+                return start
+
+        size = self.capacity
+        start = size
+        if self._free and self._free[-1][1] == size:
+            start = self._free.pop()[0]
+        self._resize(max(start + n, 2 * size))
+        if start + n < self.capacity:
+            self._free.append((start + n, self.capacity))
+        return start
+
+    def _release(self, start, stop):
+        """Hide rows start:stop and return them to the free list, merged with
+        the free ranges either side."""
+        if stop <= start:
+            return
+        self.position[start:stop] = np.nan
+        hidden = (start, stop)
+        free = self._free
+        i = bisect.bisect(free, (start, stop))
+        if i > 0 and free[i - 1][1] == start:
+            i -= 1
+            start = free.pop(i)[0]
+        if i < len(free) and free[i][0] == stop:
+            stop = free.pop(i)[1]
+        free.insert(i, (start, stop))
+
+        if stop == self.capacity and start <= self.capacity // 4:
+            # mostly empty: give back the free tail
+            free.pop()
+            self._resize(start)
+        else:
+            self._data_changed('position', *hidden)
+
     def _resize(self, n):
         """Resize the shared arrays to n sprites, return the old size.
 
         Data in the common prefix is preserved; rows beyond it start hidden.
         """
-        n1 = len(self)
+        n1 = self.capacity
         keep = min(n, n1)
 
-        position = np.full((n, 3), np.nan, dtype='float32')
-        glyph = np.zeros((n,), dtype='uint32')
-        fgcolor = np.zeros((n, 4), dtype='float32')
-        bgcolor = np.zeros((n, 4), dtype='float32')
-        position[:keep] = self.position[:keep]
-        glyph[:keep] = self.glyph[:keep]
-        fgcolor[:keep] = self.fgcolor[:keep]
-        bgcolor[:keep] = self.bgcolor[:keep]
-        self.position, self.glyph, self.fgcolor, self.bgcolor = position, glyph, fgcolor, bgcolor
+        data = np.zeros((n,), dtype=SPRITE_DTYPE)
+        data['position'] = np.nan
+        data[:keep] = self.data[:keep]
+        self._set_data(data)
 
-        self._changed(structure=True)
+        self._data_changed(structure=True)
         return n1
 
+    def _set_data(self, data):
+        self.data = data
+        self.position = data['position']
+        self.glyph = data['glyph']
+        self.fgcolor = data['fgcolor']
+        self.bgcolor = data['bgcolor']
+
     def _slot_shape_changed(self):
-        """Repack slot regions after a slot changed shape (cf. SpritesVisual.data_changed_shape)."""
+        """Repack slot regions after a slot changed shape (cf. SpritesVisual.data_changed_shape).
+
+        Compacts the layer: the slots end up back to back, with no free rows.
+        """
         size = sum(len(slot) for slot in self.slots)
+        self._free = []
         self._resize(size)
         start = 0
         for slot in self.slots:
             slot.set_start(start)
             start += len(slot)
 
-    def _data_changed(self):
-        self._changed()
+    def dirty_ranges(self, attribute, since):
+        """The rows of *attribute* (one of :data:`ATTRIBUTES`, or None for any
+        of them) written after version *since*.
+
+        A sorted list of disjoint ``(start, stop)`` ranges, overlapping and
+        adjacent writes merged; empty when nothing was written. A reader with
+        no version yet (*since* None), more than :data:`DIRTY_HISTORY` writes
+        behind, or from before the arrays were reallocated gets the whole
+        layer.
+        """
+        if since == self.version:
+            return []
+        whole = [(0, self.capacity)] if self.capacity else []
+        dirty = list(self._dirty)    # a snapshot: writers may append meanwhile
+        if since is None or since > self.version or not dirty or dirty[0][0] > since + 1:
+            return whole
+        spans = sorted((start, stop) for version, attr, start, stop in dirty
+                       if version > since and stop > start
+                       and (attribute is None or attr in (None, attribute)))
+        ranges = []
+        for start, stop in spans:
+            if ranges and start <= ranges[-1][1]:
+                if stop > ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((start, stop))
+        return ranges
+
+    def _data_changed(self, attribute=None, start=0, stop=None, structure=False):
+        """Bump the version, recording that rows start:stop (to the end when
+        None) of *attribute* (every one when None) were written."""
+        # recorded before the bump, so a reader that sees the new version also
+        # sees where it wrote
+        self._dirty.append((self.version + 1, attribute, start, self.capacity if stop is None else stop))
+        del self._dirty[:-self.DIRTY_HISTORY]
+        self._changed(structure=structure)
 
 
 class SpriteSlot(object):
@@ -213,7 +333,7 @@ class SpriteSlot(object):
     def position(self, p):
         self._position = p
         self.position[:] = p
-        self.layer._data_changed()
+        self.layer._data_changed('position', *self.indices)
 
     @property
     def glyph(self):
@@ -224,7 +344,7 @@ class SpriteSlot(object):
     def glyph(self, p):
         self._glyph = p
         self.glyph[:] = p
-        self.layer._data_changed()
+        self.layer._data_changed('glyph', *self.indices)
 
     @property
     def fgcolor(self):
@@ -235,7 +355,7 @@ class SpriteSlot(object):
     def fgcolor(self, p):
         self._fgcolor = p
         self.fgcolor[:] = p
-        self.layer._data_changed()
+        self.layer._data_changed('fgcolor', *self.indices)
 
     @property
     def bgcolor(self):
@@ -246,7 +366,7 @@ class SpriteSlot(object):
     def bgcolor(self, p):
         self._bgcolor = p
         self.bgcolor[:] = p
-        self.layer._data_changed()
+        self.layer._data_changed('bgcolor', *self.indices)
 
     def set_start(self, start):
         self.indices = (start, start + len(self))
@@ -385,7 +505,17 @@ class LayerList(object):
 
 
 class FieldLayer(object):
-    """A named float32 scalar/vector field covering the maze (light, LOS, memory, ...)."""
+    """A named float32 scalar/vector field covering the maze (light, LOS, memory, ...).
+
+    Besides ``version``, a field remembers *where* each of its last few writes
+    landed, as a bounding box of rows and columns, so a backend can re-upload
+    just that part: see :meth:`dirty_region`. A write that does not say where
+    it landed dirties the whole field.
+    """
+    #: writes whose regions are remembered; a reader further behind than this
+    #: is told the whole field changed
+    DIRTY_HISTORY = 8
+
     def __init__(self, name, shape=None, data=None):
         self.name = name
         if data is not None:
@@ -394,18 +524,81 @@ class FieldLayer(object):
             self.data = np.zeros(shape, dtype='float32')
         self.version = 0
         self.changed = Observable()
+        # (version, (rows, cols)) of the most recent writes, oldest first
+        self._dirty = []
+
+    def set_data(self, data, region=None):
+        """Copy *data* into the field (in place when shapes match) and bump version.
 
-    def set_data(self, data):
-        """Copy *data* into the field (in place when shapes match) and bump version."""
+        *region*, a ``(rows, cols)`` pair of slices, declares that *data*
+        differs from the field only there: only that window is copied, and
+        only it is reported dirty. Ignored when the shape changes, which
+        replaces the array.
+        """
         data = np.asarray(data)
-        if data.shape == self.data.shape:
+        if data.shape != self.data.shape:
+            self.data = np.ascontiguousarray(data, dtype='float32')
+            region = None
+        elif region is None:
             self.data[...] = data
         else:
-            self.data = np.ascontiguousarray(data, dtype='float32')
-        self.version += 1
-        self.changed()
+            self.data[region] = data[region]
+        self._bump(region)
+
+    def swap(self, data, region=None):
+        """Make *data*, an array of the field's shape, the field's data, and
+        return the array it replaces.
 
-    def bump(self):
-        """Declare that self.data was mutated in place."""
+        For a writer that double-buffers: *data* differs from the old array
+        only within *region* (a ``(rows, cols)`` pair of slices, the whole
+        field when None), which is reported dirty. Rebinding ``data`` is
+        atomic, so a reader sees one array or the other, never a mixture.
+        """
+        if data.shape != self.data.shape:
+            raise ValueError("swap needs an array of shape %r, not %r" % (self.data.shape, data.shape))
+        old, self.data = self.data, data
+        self._bump(region)
+        return old
+
+    def bump(self, region=None):
+        """Declare that self.data was mutated in place (only within *region*,
+        a ``(rows, cols)`` pair of slices, when given)."""
+        self._bump(region)
+
+    def dirty_region(self, since):
+        """The part of the field written after version *since*.
+
+        A ``(rows, cols)`` pair of slices bounding every write since then;
+        None when nothing was written. A reader with no version yet (*since*
+        None) or more than :data:`DIRTY_HISTORY` writes behind gets the whole
+        field.
+        """
+        if since == self.version:
+            return None
+        whole = (slice(0, self.data.shape[0]), slice(0, self.data.shape[1]))
+        if (since is None or since > self.version or not self._dirty
+                or self._dirty[0][0] > since + 1):
+            return whole
+        r0 = c0 = None
+        for version, region in self._dirty:
+            if version <= since:
+                continue
+            if region is None:
+                return whole
+            rows, cols = region
+            if r0 is None:
+                r0, r1, c0, c1 = rows.start, rows.stop, cols.start, cols.stop
+            else:
+                r0, r1 = min(r0, rows.start), max(r1, rows.stop)
+                c0, c1 = min(c0, cols.start), max(c1, cols.stop)
+        return (slice(r0, r1), slice(c0, c1))
+
+    def _bump(self, region):
         self.version += 1
+        if region is not None:
+            rows, cols = region
+            region = (slice(*rows.indices(self.data.shape[0])[:2]),
+                      slice(*cols.indices(self.data.shape[1])[:2]))
+        self._dirty.append((self.version, region))
+        del self._dirty[:-self.DIRTY_HISTORY]
         self.changed()
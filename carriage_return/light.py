@@ -17,8 +17,9 @@ class Light(Component):
     coloured map the scene composites each frame.
 
     What the base does *not* decide is the *shape* of the light -- the pattern
-    of brightness it paints over the map. That is the one thing subclasses
-    provide, by implementing :meth:`_render_light_map`:
+    of brightness it paints over the map, and the window of the map it paints
+    at all. That is the one thing subclasses provide, by implementing
+    :meth:`_render_unscaled_map`:
 
     - :class:`PointLight` -- an omnidirectional source that casts shadows and
       falls off as 1/r^2 from its cell (a torch, a glowing mob).
@@ -42,17 +43,19 @@ class Light(Component):
 
         # Fired whenever this light's appearance changes (colour, brightness).
         # The level this light stands on subscribes (see Level.add_light) and
-        # decides what to do with it -- drop its composited lighting and ask
-        # the display to repaint. Announcing the change this way is what frees a
-        # light from needing any reference to the scene.
-        self.changed = Observable()
+        # decides what to do with it -- swap this light's share of its
+        # composited lighting and ask the display to repaint. Announcing the
+        # change this way is what frees a light from needing any reference to
+        # the scene. Subscribers receive ``light=self``, so one level callback
+        # can tell which of its lights changed.
+        self.changed = Observable(light=self)
 
         # (maze, slot) when this light is pinned to a fixed cell rather than
         # following its host's location; set by pin()/Maze.add_light.
         self._fixed_place = None
 
-        # The final coloured map the scene composites, sized to the level. It
-        # is the one cache the base owns. A subclass with an expensive
+        # The final coloured map the scene composites, as a ``(window, map)``
+        # footprint (see light_footprint). It is the one cache the base owns. A subclass with an expensive
         # position-dependent intermediate (a shadow map, an upsampled pattern)
         # holds that separately, so a mere colour or brightness change -- which
         # happens every frame for a flickering flame -- rescales this cheap
@@ -208,12 +211,13 @@ class Light(Component):
         return level.line_of_sight[y * ss, x * ss].max() > 0
 
     def lightmap(self, supersample=1):
-        """This light's contribution, sized to the maze it is standing on.
+        """This light's contribution over the whole field of its maze.
 
-        The shape comes from the light's own maze, so the map it returns always
-        matches the level that light is on. Level.update_sight only sums that
-        level's own lights, so those maps are all the same shape. Returns
-        None when the light is nowhere (its host is outside any maze).
+        A ``(h, w, 3)`` float32 array sized to the maze the light is standing
+        on, zero outside the light's footprint. This is the convenient view of
+        one light; the level composites :meth:`light_footprint` instead and
+        never builds it. Returns None when the light is nowhere (its host is
+        outside any maze).
         """
         place = self.global_place()
         if place is None:
@@ -221,26 +225,130 @@ class Light(Component):
         maze, slot = place        # one read; see in_player_sight
         if maze is None:
             return None
+        window, light_map = self._footprint(maze, slot, supersample)
+        field = np.zeros(_field_shape(maze, supersample) + (3,), dtype='float32')
+        field[window] = light_map
+        return field
+
+    def light_footprint(self, supersample=1):
+        """This light's contribution and the window of the field it covers.
+
+        Returns ``(window, light_map)``. *window* is a ``(rows, cols)`` pair of
+        slices into the field of the maze the light is standing on
+        (``maze.shape * supersample``), and *light_map* is the light over that
+        window: float32, with a shape that broadcasts to ``(rows, cols, 3)``,
+        so a uniform light needs no field-sized map at all. The light is zero
+        outside its window, which is what lets a level add each light into
+        only the part of the field it reaches. Cached until the light moves or
+        changes colour or brightness; the same tuple back means nothing
+        changed. Returns None when the light is nowhere.
+        """
+        place = self.global_place()
+        if place is None:
+            return None
+        maze, slot = place        # one read; see in_player_sight
+        if maze is None:
+            return None
+        return self._footprint(maze, slot, supersample)
+
+    def reach(self, supersample=1):
+        """The window of the field this light can light: the *window* of
+        :meth:`light_footprint`, or None when the light is nowhere.
+
+        For deciding whether a light matters before paying for its map; a
+        subclass that can say without building it does.
+        """
+        footprint = self.light_footprint(supersample)
+        return None if footprint is None else footprint[0]
+
+    def unscaled_footprint(self, supersample=1):
+        """This light's footprint before its colour and brightness.
+
+        ``(window, unscaled)`` as for :meth:`light_footprint`, where the light
+        map is *unscaled* times the scaled colour, so a compositor that applies
+        colour itself (see ``Level.light_basis``) can keep the
+        position-dependent part and redo only the scaling. *unscaled* has one
+        channel or three. Subclasses cache it, and a new tuple means the
+        light's shape changed. Returns None when the light is nowhere.
+        """
+        place = self.global_place()
+        if place is None:
+            return None
+        maze, slot = place        # one read; see in_player_sight
+        if maze is None:
+            return None
+        return self._render_unscaled_map(maze, slot, supersample)
 
+    def pending_shadow(self):
+        """The cell whose shadow map this light is about to need, or None.
+
+        A light that casts shadows and has moved or arrived since its map was
+        made reports its cell, so the level can cast every such map in one
+        batch (see ``Level._cast_pending_shadows``). Most lights cast none.
+        """
+        return None
+
+    def _footprint(self, maze, slot, supersample):
         # Held in a local because an animator thread may null the cache at any
         # moment -- the worst that costs is one frame at the previous colour.
-        light_map = self._light_map
-        if light_map is None:
-            light_map = self._render_light_map(maze, slot, supersample)
-            self._light_map = light_map
-        return light_map
+        footprint = self._light_map
+        if footprint is None:
+            footprint = self._render_light_map(maze, slot, supersample)
+            self._light_map = footprint
+        return footprint
 
     def _render_light_map(self, maze, slot, supersample):
-        """Build this light's coloured map on *maze* at *slot*.
+        """Build this light's coloured footprint on *maze* at *slot*.
+
+        The unscaled footprint tinted by the scaled colour. Called by
+        :meth:`light_footprint` only when the cached one is stale.
+        """
+        window, unscaled = self._render_unscaled_map(maze, slot, supersample)
+        return window, unscaled * self._scaled_color()[None, None, :]
 
-        Subclass hook. Returns a ``(h, w, 3)`` float32 array the size of the
-        level's field (``maze.shape * supersample``). Called by
-        :meth:`lightmap` only when the cached map is stale.
+    def _render_unscaled_map(self, maze, slot, supersample):
+        """Subclass hook: this light's uncoloured footprint on *maze* at *slot*.
+
+        Returns ``(window, unscaled)``; see :meth:`unscaled_footprint`. Called
+        whenever a map is needed; cache anything expensive and drop it in
+        :meth:`_invalidate_position`.
         """
         raise NotImplementedError("Light is abstract; use a PointLight, "
                                   "ArrayLight, or AmbientLight")
 
 
+def falloff_kernel(radius, supersample):
+    """The 1/r^2 falloff of a point light, centred in a square window.
+
+    ``(n, n)`` float32 with ``n = (2 * radius + 1) * supersample``: the light
+    stands in the middle maze cell of the square, and each field cell holds
+    ``1 / (d2 + 0.5)`` for its squared distance *d2* (field units) from the
+    light -- the 0.5 enforces the flame's height above the floor. Every point
+    light of the same radius casts the same falloff, so a level builds this
+    once (see ``Level.falloff_kernel``) and each light slices it at its offset.
+    """
+    n = (2 * radius + 1) * supersample
+    centre = (radius + 0.5) * supersample
+    d = np.arange(n, dtype='float32') - centre
+    d2 = d[:, None] ** 2 + d[None, :] ** 2
+    return (1.0 / (d2 + 0.5)).astype('float32')
+
+
+def _field_shape(maze, supersample):
+    """``(h, w)`` of the field over *maze* at *supersample*."""
+    return (maze.shape[0] * supersample, maze.shape[1] * supersample)
+
+
+def _field_window(maze, supersample, rows, cols):
+    """The field window over maze cells ``rows`` x ``cols`` (half-open
+    ``(start, stop)`` pairs), clipped to the maze."""
+    h, w = maze.shape[:2]
+    y0, y1 = max(rows[0], 0), min(rows[1], h)
+    x0, x1 = max(cols[0], 0), min(cols[1], w)
+    return (slice(y0 * supersample, max(y1, y0) * supersample),
+            slice(x0 * supersample, max(x1, x0) * supersample))
+
+
 class PointLight(Light):
     """An omnidirectional point source: casts shadows, falls off as 1/r^2.
 
@@ -249,16 +357,34 @@ class PointLight(Light):
     provider) and a 1/r^2 distance falloff, tinted by the light's colour.
     Moving the light throws both away; a colour or brightness change keeps them
     and only rescales the cheap final map, which is what lets a flame flicker
-    without recasting shadows every frame.
+    without recasting shadows every frame. The falloff itself is never
+    recomputed: it is a slice of the level's shared kernel (see
+    :func:`falloff_kernel`), which is what keeps a moving light -- a fireball
+    in flight, a carried torch -- cheap to re-place.
+
+    The map covers only the square of cells within *radius* (maze cells) of
+    the light's own, and is zero beyond it. 1/r^2 has no edge of its own, but
+    a torch contributes next to nothing a few dozen cells out, and bounding it
+    keeps both the memory a light holds and the cost of compositing it in
+    proportion to what it actually lights rather than to the whole level.
     """
 
-    def __init__(self, entity, color=(1, 1, 1), brightness=1.0):
+    #: default radius of influence, in maze cells. At this distance the
+    #: unscaled falloff is ~0.03 (255 / (RADIUS * supersample)^2), so even the
+    #: brightest torch adds well under 1% of the light it casts a cell away.
+    RADIUS = 24
+
+    def __init__(self, entity, color=(1, 1, 1), brightness=1.0, radius=None):
+        self.radius = self.RADIUS if radius is None else radius
         # Position-dependent caches, dropped together whenever the light moves
         # (see _invalidate_position). The shadow map and the unscaled
-        # (shadow * falloff) map survive a colour or brightness change; only
-        # the base's final map is rebuilt for those.
+        # (shadow * falloff) footprint survive a colour or brightness change;
+        # only the base's final map is rebuilt for those.
         self._shadow_map = None
         self._unscaled_light_map = None
+        # the last shadow map this light had, kept across moves: it stands in
+        # while a deferred cast for the new cell is in flight (see shadow_map)
+        self._last_shadow_map = None
         Light.__init__(self, entity, color=color, brightness=brightness)
 
     def _invalidate_position(self):
@@ -268,30 +394,69 @@ class PointLight(Light):
 
     def set_shadow_map(self, smap):
         self._shadow_map = smap
+        self._last_shadow_map = smap
         self._unscaled_light_map = None
         self._light_map = None
 
+    def reach(self, supersample=1):
+        place = self.global_place()
+        if place is None or place[0] is None:
+            return None
+        maze, (x, y) = place
+        r = int(np.ceil(self.radius))
+        return _field_window(maze, supersample, (y - r, y + r + 1), (x - r, x + r + 1))
+
+    def pending_shadow(self):
+        if self._shadow_map is not None:
+            return None
+        place = self.global_place()
+        if place is None or place[0] is None:
+            return None
+        return place[1]
+
     def shadow_map(self, slot):
+        """The shadow map cast from *slot*, or a stand-in while it is cast.
+
+        With the level's ``deferred_shadows`` on, a map not cast yet comes a
+        frame later (the level hands it over through :meth:`set_shadow_map`);
+        until then this returns the last map the light had, or None if it
+        never had one.
+        """
         if self._shadow_map is None:
-            smap = self.level.visibility.render(slot, read=True)[..., :3]
+            smap = self.level.shadow_map(slot, wait=False)
+            if smap is None:
+                return self._last_shadow_map
             self.set_shadow_map(smap)
-            assert self._shadow_map is not None
         return self._shadow_map
 
-    def _render_light_map(self, maze, slot, supersample):
+    def _render_unscaled_map(self, maze, slot, supersample):
         # Held in a local because an animator thread may null the cache at any
         # moment -- the worst that costs is one frame at the previous brightness.
         unscaled = self._unscaled_light_map
         if unscaled is None:
             (x, y) = slot
-            maze_shape = maze.shape
-            maze_pos = np.mgrid[0:maze_shape[0]*supersample, 0:maze_shape[1]*supersample].transpose(1, 2, 0)
-            light_pos = np.array([[[y * supersample, x * supersample]]]) + (0.5 * supersample)
-            dist2 = ((maze_pos - light_pos) ** 2).sum(axis=2) + 0.5  # 0.5 enforces height
-            dist2 = dist2.astype('float32')
-            unscaled = self.shadow_map(slot) / dist2[:, :, None]
-            self._unscaled_light_map = unscaled
-        return unscaled * self._scaled_color()[None, None, :]
+            r = int(np.ceil(self.radius))
+            window = _field_window(maze, supersample, (y - r, y + r + 1), (x - r, x + r + 1))
+            rows, cols = window
+            # the kernel's top-left field cell sits at maze cell (x - r, y - r)
+            ky, kx = (y - r) * supersample, (x - r) * supersample
+            level = maze.level
+            if level is not None and level.supersample == supersample:
+                kernel = level.falloff_kernel(r)
+            else:
+                kernel = falloff_kernel(r, supersample)
+            falloff = kernel[rows.start - ky:rows.stop - ky, cols.start - kx:cols.stop - kx]
+            shadow = self.shadow_map(slot)
+            if shadow is None or shadow.shape[:2] != _field_shape(maze, supersample):
+                # a first cast still in flight, with no map of this level to
+                # stand in: dark for a frame
+                return window, np.zeros((1, 1, 1), dtype='float32')
+            # one channel, like the map: it broadcasts against the colour
+            unscaled = (window, (shadow[window] * falloff)[:, :, None])
+            if shadow is self._shadow_map:
+                # a stand-in is never kept; the real map replaces it
+                self._unscaled_light_map = unscaled
+        return unscaled
 
 
 class ArrayLight(Light):
@@ -304,9 +469,10 @@ class ArrayLight(Light):
     fall off with distance; the array *is* the shape of the light.
 
     *array* has shape ``(maze_h, maze_w)`` for one intensity per cell, or
-    ``(maze_h, maze_w, 3)`` to scale each colour channel independently. It is
-    upsampled to the level's field resolution once and cached; a colour or
-    brightness change only rescales the result.
+    ``(maze_h, maze_w, 3)`` to scale each colour channel independently. Its
+    footprint is the bounding box of the cells it lights, upsampled to the
+    level's field resolution once and cached; a colour or brightness change
+    only rescales the result.
     """
 
     def __init__(self, entity, array, color=(10, 10, 10), brightness=1.0):
@@ -320,20 +486,30 @@ class ArrayLight(Light):
         self._base_map = None
         Light._invalidate_position(self)
 
-    def _render_light_map(self, maze, slot, supersample):
+    def _render_unscaled_map(self, maze, slot, supersample):
         base = self._base_map
         if base is None:
             arr = self._array
             assert arr.shape[:2] == tuple(maze.shape[:2]), (
                 "ArrayLight array shape %r does not match maze %r"
                 % (arr.shape[:2], tuple(maze.shape[:2])))
+            lit = arr if arr.ndim == 2 else arr.any(axis=2)
+            ys, xs = np.nonzero(lit)
+            if len(ys) == 0:
+                window = _field_window(maze, supersample, (0, 0), (0, 0))
+                arr = arr[:0, :0]
+            else:
+                window = _field_window(maze, supersample, (ys.min(), ys.max() + 1),
+                                       (xs.min(), xs.max() + 1))
+                arr = arr[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
             # nearest-neighbour upsample from maze cells to field cells, the
             # same maze->field scaling the point light's mgrid produces
-            base = np.repeat(np.repeat(arr, supersample, axis=0), supersample, axis=1)
-            if base.ndim == 2:
-                base = base[:, :, None]
+            up = np.repeat(np.repeat(arr, supersample, axis=0), supersample, axis=1)
+            if up.ndim == 2:
+                up = up[:, :, None]
+            base = (window, up)
             self._base_map = base
-        return base * self._scaled_color()[None, None, :]
+        return base
 
 
 class AmbientLight(Light):
@@ -346,8 +522,8 @@ class AmbientLight(Light):
     but the cell it is pinned to makes no difference to what it paints.
     """
 
-    def _render_light_map(self, maze, slot, supersample):
-        shape = (maze.shape[0] * supersample, maze.shape[1] * supersample, 3)
-        light_map = np.empty(shape, dtype='float32')
-        light_map[:] = self._scaled_color()
-        return light_map
+    def _render_unscaled_map(self, maze, slot, supersample):
+        # the whole field, as one value that broadcasts over it
+        h, w = maze.shape[:2]
+        window = _field_window(maze, supersample, (0, h), (0, w))
+        return window, np.ones((1, 1, 1), dtype='float32')
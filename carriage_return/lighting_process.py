@@ -0,0 +1,185 @@
+"""Point lights composited in a process of their own, over shared memory.
+
+A :class:`LightingProcess` serves one level (see ``Level.lighting_process``).
+Three blocks of :mod:`multiprocessing.shared_memory` join it to its worker
+process:
+
+- the maze's ``opacity``, written once, from which the worker builds its own
+  :class:`~.shadowcast.CpuShadowCaster`;
+- the light table, one ``Level.point_light_params`` row per point light;
+- the output: two illuminance fields, ``(h, w, 3)`` float32 at the level's
+  field resolution, which the worker fills in turn.
+
+The worker casts each light's shadow (keeping the maps of cells it has cast
+from), multiplies in the 1/r^2 falloff and the colour exactly as
+``PointLight`` does, and sums the lot into the field the level is not
+reading. The level adds that field into its illuminance where it lies, with
+no copy, and swaps in the next one when it arrives. No Python work of the
+worker's competes with the game's threads for the GIL, so several levels --
+or several games on one machine -- can light at once.
+
+Game-side module: no rendering library may be imported here.
+"""
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .array_cache import LRUArrayCache
+from .light import falloff_kernel
+from .shadowcast import CpuShadowCaster
+
+
+#: rows of the shared light table: the most point lights one level may hold
+MAX_LIGHTS = 4096
+
+#: memory the worker's cache of shadow maps may hold
+SHADOW_CACHE_BYTES = 64 * 2**20
+
+
+class LightingProcess:
+    """A worker process summing the point lights of one maze.
+
+    :meth:`update` is called once per frame with the level's light table; it
+    starts a composite whenever the table changed and none is running, and
+    returns the last one finished. Only one composite is ever in flight, and
+    never one in the same call that hands back the last, so the field
+    returned stays untouched until the call after the next one is returned.
+    :meth:`close` ends the process and frees the shared memory; it is also
+    done when the object is collected.
+    """
+
+    def __init__(self, maze, supersample):
+        ms = tuple(maze.shape[:2])
+        field = (2, ms[0] * supersample, ms[1] * supersample, 3)
+        self._blocks = []
+        self._shared(ms, maze.opacity)
+        self._params = self._shared((MAX_LIGHTS, 6))
+        out = self._shared(field)
+        self._slots = [out[0], out[1]]
+
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child = ctx.Pipe()
+        names = [block.name for block in self._blocks]
+        self._process = ctx.Process(target=_serve, name='lighting %dx%d' % ms, daemon=True,
+                                    args=(child, names, ms, field, supersample))
+        self._process.start()
+        child.close()
+        self._finalizer = weakref.finalize(self, _shut_down, self._conn, self._process, self._blocks)
+
+        self._asked = None        # the table of the composite last started
+        self._in_flight = None    # the slot it is being written into
+        self._latest = None       # the slot last finished
+
+    def _shared(self, shape, data=None):
+        block = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        self._blocks.append(block)
+        arr = np.ndarray(shape, dtype='float32', buffer=block.buf)
+        arr[...] = 0 if data is None else data
+        return arr
+
+    def update(self, params):
+        """Composite *params*, a ``point_light_params`` table, when it is new.
+
+        Returns the illuminance of the point lights as last composited -- a
+        view of shared memory, ``(h, w, 3)`` float32 -- or None until the
+        first composite arrives. Raises RuntimeError if the worker has died,
+        rather than hand back its last field for ever.
+        """
+        if not self._process.is_alive():
+            raise RuntimeError("the lighting process has exited (exit code %s)"
+                               % self._process.exitcode)
+        if self._in_flight is not None:
+            if self._conn.poll():
+                # the caller may still hold the other field; ask next time
+                try:
+                    self._latest = self._conn.recv()
+                except EOFError:
+                    raise RuntimeError("the lighting process has exited")
+                self._in_flight = None
+        elif self._asked is None or not np.array_equal(params, self._asked):
+            n = len(params)
+            if n > MAX_LIGHTS:
+                raise ValueError("%d point lights; the lighting process takes at most %d"
+                                 % (n, MAX_LIGHTS))
+            self._params[:n] = params
+            slot = 0 if self._latest == 1 else 1
+            self._conn.send((n, slot))
+            self._in_flight = slot
+            self._asked = params.copy()
+        return None if self._latest is None else self._slots[self._latest]
+
+    def wait(self):
+        """Block until the composite in flight, if any, has finished."""
+        if self._in_flight is not None:
+            self._conn.poll(None)
+
+    def close(self):
+        """Stop the worker and release the shared memory."""
+        self._finalizer()
+
+
+def _shut_down(conn, process, blocks):
+    try:
+        conn.send(None)
+    except OSError:
+        pass
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
+    conn.close()
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class _Occluders:
+    """What a :class:`CpuShadowCaster` reads of a maze, from shared memory."""
+    def __init__(self, opacity):
+        self.shape = opacity.shape
+        self.opacity = opacity
+
+
+def _serve(conn, names, maze_shape, field, supersample):
+    """The worker: composite the light table into the slot asked, until told
+    to stop."""
+    # (attaching registers each block again with the resource tracker this
+    # process shares with its parent, which unlinks them; that is harmless)
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    opacity = np.ndarray(maze_shape, dtype='float32', buffer=blocks[0].buf)
+    params = np.ndarray((MAX_LIGHTS, 6), dtype='float32', buffer=blocks[1].buf)
+    out = np.ndarray(field, dtype='float32', buffer=blocks[2].buf)
+
+    caster = CpuShadowCaster(_Occluders(opacity), supersample=supersample)
+    shadows = LRUArrayCache(SHADOW_CACHE_BYTES)
+    kernels = {}
+    h, w = maze_shape
+    ss = supersample
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        n, slot = request
+        field_out = out[slot]
+        field_out[...] = 0
+        for x, y, radius, r, g, b in params[:n].tolist():
+            x, y, rad = int(x), int(y), int(radius)
+            shadow = shadows.get((x, y), lambda: caster.render((x, y)))
+            kernel = kernels.get(rad)
+            if kernel is None:
+                kernel = kernels[rad] = falloff_kernel(rad, ss)
+            # the window and the kernel's offset in it, as PointLight has them
+            y0, y1 = max(y - rad, 0), min(y + rad + 1, h)
+            x0, x1 = max(x - rad, 0), min(x + rad + 1, w)
+            if y1 <= y0 or x1 <= x0:
+                continue
+            rows, cols = slice(y0 * ss, y1 * ss), slice(x0 * ss, x1 * ss)
+            ky, kx = (y - rad) * ss, (x - rad) * ss
+            falloff = kernel[rows.start - ky:rows.stop - ky, cols.start - kx:cols.stop - kx]
+            color = np.array((r, g, b), dtype='float32')
+            region = field_out[rows, cols]
+            region += (shadow[rows, cols] * falloff)[:, :, None] * color
+        conn.send(slot)
+    for block in blocks:
+        block.close()
@@ -1,8 +1,9 @@
+import numpy as np
+
 from .adaptation import EyeAdaptation
 from .entity import Entity
 from .errors import ActionError
 from .inventory import Inventory
-from .light import PointLight
 from .location import Location
 from .sprite import SingleCharSprite
 
@@ -76,14 +77,9 @@ class Player(Entity):
         return None if maze is None else maze.level
 
     def line_of_sight(self):
+        # A carried torch stands on the player's cell, so it finds this same
+        # map in the level's shadow cache rather than casting its own.
+        # The cached map is one channel; sight is per colour channel.
         pos = self.location.global_location.slot
-        smap = self.level.visibility.render(pos, read=True)[:, :, :3]
-        # carried point lights share the player's shadow map; they expect it in
-        # the same 0-255 scale that PointLight.shadow_map() renders for itself.
-        # Only point sources cast shadows -- an ambient or array light carried
-        # in a pocket has no shadow map to share.
-        for item in self.inventory.all_entities():
-            light = getattr(item, 'light', None)
-            if isinstance(light, PointLight):
-                light.set_shadow_map(smap)
-        return smap / 255.0
+        smap = self.level.shadow_map(pos)
+        return np.repeat(smap[:, :, None], 3, axis=2) / np.float32(255)
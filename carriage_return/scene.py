@@ -62,6 +62,31 @@ class Screen(object):
         self.changed()
 
 
+class Viewport(object):
+    """The part of the maze on screen, in maze cells, held as game state.
+
+    ``rect`` is ``(x0, y0, x1, y1)``: columns ``x0:x1`` and rows ``y0:y1`` of
+    the current level, or None when the whole level may be on screen (the
+    default, and what headless code sees). The display backend writes it as
+    its camera moves; ``Level.update_sight`` composites only that part (see
+    its *view*). Follows the layer change-tracking contract (``version`` +
+    ``changed`` Observable).
+    """
+    def __init__(self):
+        self.rect = None
+        self.version = 0
+        self.changed = Observable()
+
+    def set_rect(self, rect):
+        """Record a new rect (None for everything); no-op when unchanged."""
+        rect = None if rect is None else tuple(int(v) for v in rect)
+        if rect == self.rect:
+            return
+        self.rect = rect
+        self.version += 1
+        self.changed()
+
+
 class Scene(Entity):
     """Game state: the landscape, player, items, and mobs.
 
@@ -81,7 +106,7 @@ class Scene(Entity):
     shape from it, so a maze and a field of the wrong size are never observed
     together. A rendering backend (e.g. backends.vispy.VispySceneRenderer)
     injects each level's ``visibility``: an object with
-    ``render(pos, read=True) -> (h, w, >=3) array`` that computes a shadow map
+    ``render(pos, read=True) -> (h, w) or (h, w, >=3) array`` that computes a shadow map
     for a light/viewer at a maze position.
     """
 
@@ -106,6 +131,9 @@ class Scene(Entity):
 
         # canvas size in cells, backend-written; the HUD lays out against it
         self.screen = Screen()
+        # the part of the level the camera shows, backend-written; sight is
+        # composited only there
+        self.viewport = Viewport()
 
         # subscribed to by the display backend; see request_redraw()
         self.redraw_requested = Observable()
@@ -287,4 +315,4 @@ class Scene(Entity):
         on the level it has captured, so a level switch on another thread
         cannot change which level a frame draws (see the vispy renderer).
         """
-        self._level.update_sight(dt, self._player)
+        self._level.update_sight(dt, self._player, view=self.viewport.rect)
@@ -0,0 +1,159 @@
+"""A numpy-only visibility provider: shadows cast on the CPU.
+
+:class:`CpuShadowCaster` implements the same duck-typed contract as the GL
+``ShadowRenderer`` in the vispy backend::
+
+    provider.render(pos, read=True) -> ndarray (h, w) uint8, 0..255
+
+so a level can be lit and seen with no OpenGL context at all -- on a headless
+server, in CI, or under a terminal backend. ``Player.line_of_sight()`` and
+``PointLight.shadow_map()`` cannot tell the two apart.
+
+The occluders are the GL renderer's, cell for cell: every fully opaque block
+contributes one axis-aligned rectangle, a third of a cell thick and stretched
+to the cell edge on each side that touches another opaque block (see the
+geometry shader in ``backends/vispy/graphics.py``). The GL pass extrudes each
+rectangle away from the viewer into a shadow volume; here the same volumes are
+rasterised into a one-dimensional angular depth buffer instead -- for every
+ray direction around the viewer, the distance to the nearest occluder it
+meets. That is the vectorised form of shadowcasting: occluders are gathered at
+maze resolution (one rectangle per opaque cell, a handful of rays each), and a
+field cell is lit when it lies no further away than the nearest occluder along
+its own ray. Evaluating that test per field cell costs one gather, so the map
+is produced directly at ``field_shape`` without an upsampling step to blur its
+edges.
+
+Game-side module: no rendering library may be imported here.
+"""
+import numpy as np
+
+
+class CpuShadowCaster:
+    """Shadow/visibility maps for one maze, computed with numpy.
+
+    *supersample* is the field resolution relative to maze cells (the level's
+    ``supersample``), exactly as for the GL renderer. *n_rays* is the angular
+    resolution of the depth buffer; the default resolves a shadow edge to well
+    under one field cell across any maze this game ships.
+
+    Like the GL renderer, the occluders are read from ``maze.opacity`` once, at
+    construction: a provider is built per level, and the maze's walls do not
+    move.
+    """
+
+    #: angular resolution of the depth buffer (rays around the viewer)
+    N_RAYS = 8192
+
+    def __init__(self, maze, supersample=1, n_rays=None):
+        self.maze = maze
+        self.supersample = supersample
+        self.size = (maze.shape[0] * supersample, maze.shape[1] * supersample)
+        self.n_rays = self.N_RAYS if n_rays is None else int(n_rays)
+
+        # (n, 4) occluder rectangles x0, y0, x1, y1 in maze units
+        self._rects = self._occluder_rects(maze.opacity)
+
+        # field cell centres in maze units; row i is y, column j is x, matching
+        # the GL renderer's read-back orientation
+        h, w = self.size
+        self._ys = ((np.arange(h, dtype='float32') + 0.5) / supersample)[:, None]
+        self._xs = ((np.arange(w, dtype='float32') + 0.5) / supersample)[None, :]
+
+        # the direction of each ray: through the centre of its angular bin
+        step = 2 * np.pi / self.n_rays
+        theta = -np.pi + (np.arange(self.n_rays) + 0.5) * step
+        self._ray_dir = np.stack([np.cos(theta), np.sin(theta)], axis=1)
+
+    @staticmethod
+    def _occluder_rects(opacity):
+        """One rectangle per fully opaque cell, as the GL geometry shader builds it.
+
+        A lone opaque cell occludes its middle third. Each side that touches
+        another opaque cell moves the rectangle's corresponding edge out to the
+        cell boundary, so runs of wall join up into solid strips. Cells beyond
+        the maze edge read as the edge cell itself (the shader's clamped
+        texture lookup).
+        """
+        opaque = opacity > 0.5
+        padded = np.pad(opaque, 1, mode='edge')
+        rows, cols = np.nonzero(opacity >= 1)
+        left = padded[rows + 1, cols]
+        right = padded[rows + 1, cols + 2]
+        down = padded[rows, cols + 1]
+        up = padded[rows + 2, cols + 1]
+
+        third = 1.0 / 3.0
+        xa = np.where(left, 0.0, 2 * third)
+        xb = np.where(right, 1.0, third)
+        ya = np.where(down, 0.0, 2 * third)
+        yb = np.where(up, 1.0, third)
+
+        rects = np.empty((len(rows), 4), dtype='float64')
+        rects[:, 0] = cols + np.minimum(xa, xb)
+        rects[:, 1] = rows + np.minimum(ya, yb)
+        rects[:, 2] = cols + np.maximum(xa, xb)
+        rects[:, 3] = rows + np.maximum(ya, yb)
+        return rects
+
+    def depth(self, pos):
+        """Distance (maze units) to the nearest occluder along every ray from *pos*.
+
+        Returns an ``(n_rays,)`` array, ``inf`` where a ray escapes. The viewer
+        stands at the centre of maze cell *pos* ``(x, y)``.
+        """
+        lx, ly = pos[0] + 0.5, pos[1] + 0.5
+        n = self.n_rays
+        step = 2 * np.pi / n
+        depth = np.full(n, np.inf)
+        rects = self._rects
+        if len(rects) == 0:
+            return depth
+
+        # the angular interval each rectangle subtends, measured about the
+        # angle of its centre so that no interval straddles the +/-pi seam
+        x0, y0, x1, y1 = (rects[:, 0] - lx, rects[:, 1] - ly,
+                          rects[:, 2] - lx, rects[:, 3] - ly)
+        centre = np.arctan2((y0 + y1) / 2, (x0 + x1) / 2)
+        corners = np.arctan2(np.stack([y0, y0, y1, y1]), np.stack([x0, x1, x0, x1]))
+        offset = (corners - centre + np.pi) % (2 * np.pi) - np.pi
+        lo = centre + offset.min(axis=0)
+        hi = centre + offset.max(axis=0)
+
+        # the rays (bin centres) falling inside each interval
+        first = np.ceil((lo + np.pi) / step - 0.5).astype(int)
+        last = np.floor((hi + np.pi) / step - 0.5).astype(int)
+        count = np.maximum(last - first + 1, 0)
+        which = np.repeat(np.arange(len(rects)), count)
+        ray = np.repeat(first, count) + (np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count))
+        ray %= n
+
+        # slab-method entry distance of each ray into its rectangle
+        d = self._ray_dir[ray]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tx0 = x0[which] / d[:, 0]
+            tx1 = x1[which] / d[:, 0]
+            ty0 = y0[which] / d[:, 1]
+            ty1 = y1[which] / d[:, 1]
+        t_enter = np.maximum(np.fmin(tx0, tx1), np.fmin(ty0, ty1))
+        t_enter = np.nan_to_num(t_enter, nan=0.0, posinf=np.inf, neginf=0.0)
+        np.minimum.at(depth, ray, np.maximum(t_enter, 0.0))
+        return depth
+
+    def render(self, pos, read=True):
+        """Shadow map for a viewer at maze cell *pos* ``(x, y)``.
+
+        ``(h, w)`` uint8 at field resolution: 255 where the field cell is in
+        the open, 0 where it lies inside an occluder's shadow -- the same
+        values the GL renderer reads back. *read* follows the GL renderer's
+        contract: with ``read=False`` nothing is returned.
+        """
+        if not read:
+            return None
+        lx, ly = pos[0] + 0.5, pos[1] + 0.5
+        dx = self._xs - lx
+        dy = self._ys - ly
+        dist = np.sqrt(dx * dx + dy * dy)
+        step = 2 * np.pi / self.n_rays
+        ray = ((np.arctan2(dy, dx) + np.pi) / step).astype(int) % self.n_rays
+        lit = dist <= self.depth(pos)[ray]
+        return np.where(lit, 255, 0).astype('ubyte')
@@ -12,12 +12,17 @@ and the opposite of numpy's ``maze.blocks[y, x]`` indexing.
 
 Game-side module: no rendering library may be imported here.
 """
+import concurrent.futures
+import threading
+import warnings
+
 import numpy as np
 
-from .array_cache import ArraySumCache
+from .array_cache import LRUArrayCache
 from .blocktypes import BlockTypes
 from .events import Observable
 from .layers import FieldLayer
+from .light import PointLight, falloff_kernel
 
 
 #: Resolution of the sight fields relative to maze cells. One number, shared by
@@ -39,6 +44,26 @@ LUMINANCE_WEIGHTS = np.array([0.2126, 0.7152, 0.0722], dtype='float32')
 MEMORY_REF_LUMINANCE = 2.0
 MEMORY_STRENGTH = 1.0
 
+#: Threads the light maps of a composite are built on, side by side (see
+#: Level._light_footprints). 1 builds them serially, which is the default
+#: until agent_helpers/benchmark_light_maps.py shows a pool is faster on the
+#: machine at hand: each map is a small piece of numpy work, and handing it
+#: to a thread can cost what it saves.
+LIGHT_MAP_WORKERS = 1
+
+
+class _Compositing(threading.local):
+    """Marks the threads that composite but may not cast shadows (see
+    Level.shadow_map): ``active`` is true on those alone."""
+    active = False
+
+
+def _mark_compositing():
+    _compositing.active = True
+
+
+_compositing = _Compositing()
+
 
 class Level:
     """One maze, under a name, plus everything sized against that maze.
@@ -61,14 +86,38 @@ class Level:
 
     ``memory`` is per level for the same reason it is useful: what you saw of
     a level is a fact about that level, and survives going elsewhere and
-    coming back.
+    coming back. It is stored undecayed -- the luminance a cell had when it
+    was last seen, next to the level :attr:`clock` time it was seen at (see
+    :meth:`remembered`) -- so nothing has to be rewritten for it to fade.
     """
 
     #: sight memory fades to this fraction of itself per second (equivalent to
     #: the historical 0.999-per-frame decay at 60 fps)
     MEMORY_DECAY_RATE = 0.999 ** 60
 
-    def __init__(self, name, maze, supersample=SIGHT_SUPERSAMPLE):
+    #: side, in field cells, of the tiles the sight field is composited in
+    #: (see _composite_sight)
+    SIGHT_TILE = 32
+
+    #: maze cells around the view (see update_sight) composited along with
+    #: it, so a camera easing toward the player never reveals a stale edge
+    VIEW_MARGIN = 8
+
+    #: memory the cache of shadow maps may hold (see shadow_map); one map of
+    #: the dungeon is ~170 kB, so this keeps the last few hundred cells cast
+    SHADOW_CACHE_BYTES = 64 * 2**20
+
+    #: in-place light swaps allowed before the illuminance is rebuilt from
+    #: scratch, so float32 rounding from repeated subtract/add cannot build up
+    #: (a few seconds of a torch-lit room flickering at 10 Hz)
+    MAX_LIGHT_DELTAS = 600
+
+    # the threads every level builds light maps on (see _light_footprints),
+    # started with the first composite that has several to build
+    _light_pool = None
+    _light_pool_lock = threading.Lock()
+
+    def __init__(self, name, maze, supersample=SIGHT_SUPERSAMPLE, light_basis=False):
         self.name = name
         self.maze = maze
         self.world = None
@@ -83,9 +132,45 @@ class Level:
         # Line of sight and lighting are still three-channel (an RGB shadow map
         # times RGB light); memory is a single linear luminance per cell.
         self.field_shape = (h, w, 3)
-        self.memory = np.zeros((h, w), dtype='float32')
         self.line_of_sight = np.zeros(self.field_shape, dtype='float32')
 
+        # Memory, as the renderer uploads it: channel [0] the reflected
+        # luminance each cell had when last seen, channel [1] the clock time
+        # it was seen at. The fade is evaluated from those where it is drawn
+        # (the GPU's fragment shader, or remembered()), so a frame where
+        # nothing new is seen writes nothing here. ``memory`` and
+        # ``memory_time`` are views of the two channels; a caller writing
+        # through them bumps memory_field.
+        self.clock = 0.0
+        self.memory_field = FieldLayer('memory', shape=(h, w, 2))
+
+        # The tiles of the sight field whose inputs changed since they were
+        # last composited (see _composite_sight), and whether the view was
+        # open then. Everything starts out dirty.
+        T = self.SIGHT_TILE
+        self._dirty_tiles = np.ones((-(-h // T), -(-w // T)), dtype=bool)
+        self._sight_watched = None
+        # (illuminance, point-light estimate) the last composite used, for
+        # remembering the view as it leaves (see _remember_view)
+        self._sight_inputs = None
+
+        # Versions of the inputs to sight: the line of sight (bumped when it
+        # is recast or cleared) and the light (bumped when the illuminance or
+        # the point-light estimate changes). Values derived from them are
+        # cached under the versions they were computed from and reused until
+        # one moves (see _derived), so a frame where nobody moved and nothing
+        # flickered recomputes none of them.
+        self._los_version = 0
+        self._light_version = 0
+        self._derived_values = {}
+
+        # Scratch fields the compositor works in, so a frame allocates no
+        # field-sized temporaries: each block of tiles computes into its own
+        # window of these with out= arguments (see _composite_block).
+        self._lum_scratch = np.empty((h, w), dtype='float32')
+        self._decay_scratch = np.empty((h, w), dtype='float32')
+        self._mask_scratch = np.empty((h, w), dtype=bool)
+
         # Light components whose global location is on this level; each Light
         # adds and removes itself as its host moves (see Light._register).
         self.lights = []
@@ -112,8 +197,50 @@ class Level:
         # per-level log-normalisation from pinning the brightest cell to 1.0
         # and cancelling the flicker; with the tone map moved to the GPU it is
         # gone.)
+        #
+        # Each light is added over its own footprint only (see
+        # Light.light_footprint), so the cost of a composite follows how much
+        # of the level its lights reach, not how many field-sized maps there are.
         self.illuminance = None
-        self.light_cache = ArraySumCache()
+        # Bumped by every invalidation, from any thread; ``illuminance`` holds
+        # the composite of generation ``_illuminance_generation``, and is only
+        # current while the two agree (see _composite_frame).
+        self._lighting_generation = 0
+        self._illuminance_generation = 0
+
+        # What each light contributed to ``illuminance``, by light: the exact
+        # ``(window, map)`` footprint that was added, so it can be subtracted
+        # again. A light whose
+        # colour or brightness changes is queued in _stale_lights (from any
+        # thread, hence the lock) and the next update swaps its old map for its
+        # new one in place -- one light's worth of work, not a rebuild of the
+        # whole sum. Nulling ``illuminance`` still means "rebuild everything",
+        # and is reserved for structural changes: a light arriving or leaving,
+        # or the viewer moving.
+        self._light_maps = {}
+        self._stale_lights = set()
+        self._stale_lock = threading.Lock()
+        # deltas applied since the last full composite; see _relight
+        self._n_light_deltas = 0
+        # Lights left out of ``illuminance`` because nothing they reach is in
+        # sight, and the line-of-sight version that was judged against (see
+        # _uncull). They keep their maps; they only are not summed.
+        self._culled_lights = set()
+        self._cull_version = None
+
+        # The opt-in stacked compositor (see the light_basis property). The
+        # basis holds every light's *unscaled* map, one dense row per light,
+        # laid out channel-planar -- (n_lights, 3, h*w) -- so each colour channel
+        # of the illuminance is one BLAS matrix-vector product against the
+        # lights' scaled colours. Rows are rebuilt when a light's shape of light
+        # changes (it arrived, left or moved); a colour or brightness change
+        # costs one contraction and touches no row.
+        self._light_basis = bool(light_basis)
+        self._basis = None
+        self._basis_lights = []
+        self._basis_rows = {}       # light -> row index into _basis
+        self._basis_sources = []    # the unscaled map copied into each row
+        self._basis_out = None      # (3, h*w) contraction result
 
         # Per-cell material reflectance luminance at field resolution, (h, w, 1).
         # Built once from the fixed maze -- each block id maps to the luminance
@@ -122,23 +249,380 @@ class Level:
         # eye-adaptation target and the memory field.
         self._albedo_lum = None
 
+        # The point lights' shared 1/r^2 falloff, one kernel per radius (see
+        # falloff_kernel), and the same averaged over each maze cell (see
+        # _point_light_luminance). Independent of the maze's contents, so built
+        # on first use and kept.
+        self._falloff_kernels = {}
+        self._cell_falloffs = {}
+        # (params, luminance) of the last _point_light_luminance
+        self._point_light_lum = None
+
+        # Point lights summed on the GPU instead (see gpu_point_lights).
+        self._gpu_point_lights = False
+        # ... or by a worker process (see lighting_process), and the field of
+        # its that ``illuminance`` holds
+        self._lighting_process = None
+        self._process_added = None
+
         # The composited sight field the renderer uploads: RGBA float32. Owned
         # by the level so its identity is stable for a backend that captured it,
         # and always the right shape for this maze. Channels [0:3] are the
         # linear HDR visible illuminance ``los * E`` (tone-mapped on the GPU);
-        # channel [3] is a display-space memory overlay, already gamma-encoded.
+        # channel [3] is the fraction of each cell out of sight, where the
+        # memory overlay shows (see memory_overlay).
         self.sight = FieldLayer('sight', shape=(h, w, 4))
 
+        # The arrays the compositor writes sight and memory into: the fields'
+        # own, or with threaded_sight on, the back buffers of the worker that
+        # owns compositing (see SightCompositor).
+        self._sight_out = self.sight.data
+        self._memory_out = self.memory_field.data
+        self._compositor = None
+
         # Shadow-map provider sized to this maze, injected by the display
         # backend when it builds this level's GL resources (see the vispy
         # renderer's _rebuild_for_level). Duck-typed render(pos, read=True) ->
-        # (h, w, >=3) array; no rendering library is imported here to hold it.
-        self.visibility = None
+        # (h, w) or (h, w, >=3) uint8 array; no rendering library is imported
+        # here to hold it. Reached through shadow_map(), which caches what it
+        # casts by cell, one channel per map.
+        self.shadow_cache = LRUArrayCache(self.SHADOW_CACHE_BYTES)
+        self._visibility = None
+
+        # Deferred shadow casting, for a provider that can start a cast and
+        # read it back later (render_deferred; the GL renderer). Off by
+        # default, which keeps every frame exact -- what the screenshot
+        # harness relies on. When on, a map that is not cached is asked for
+        # rather than waited for: the cells wanted this frame are cast as one
+        # batch when it ends and collected when the next begins, and
+        # meanwhile the line of sight and each light keep the last map they
+        # had. See shadow_map(wait=False).
+        self.deferred_shadows = False
+        self._shadow_requests = set()
+        self._shadows_in_flight = []    # (positions, handle) per deferred batch
+        self._cells_in_flight = set()
 
         # recompute line of sight on the next update (the viewer just arrived
         # or moved); set true so the first frame casts sight from scratch
         self._need_los_update = True
 
+    @property
+    def visibility(self):
+        """The shadow-map provider for this level; see :meth:`shadow_map`."""
+        return self._visibility
+
+    @visibility.setter
+    def visibility(self, provider):
+        # maps cast by another provider may be at another resolution; casts
+        # still in flight hold the old provider's buffers, so give those back
+        for _, handle in self._shadows_in_flight:
+            handle.release()
+        self._visibility = provider
+        self.shadow_cache.clear()
+        self._shadow_requests = set()
+        self._shadows_in_flight = []
+        self._cells_in_flight = set()
+
+    def shadow_map(self, pos, wait=True):
+        """The ``(h, w)`` uint8 shadow map cast from maze cell *pos* ``(x, y)``.
+
+        255 where the cell's centre has an unobstructed view. Shadows are gray,
+        so one channel is kept; consumers broadcast it against their colour
+        channels when they multiply (``smap[..., None]``). This is
+        what the viewer's line of sight and every point light's shadow are
+        made of, and the maze's walls never move, so the map for a cell is the
+        same every time it is cast: maps are kept in :attr:`shadow_cache`
+        (least recently used evicted past :data:`SHADOW_CACHE_BYTES`) and
+        shared read-only by everything on the level -- a torch and the player
+        carrying it, two lights on one cell, a fireball retracing a corridor.
+
+        With *wait* false and :attr:`deferred_shadows` on, a map that is not
+        cached yet is not cast here: the cell is queued for this frame's
+        deferred batch and None is returned, for the caller to make do with
+        what it had until the map arrives. Asked with *wait* false on a
+        compositing thread (the :class:`SightCompositor`'s, or the light-map
+        pool's), a map is never cast either: the provider may only be called
+        from the thread that updates the level, and
+        :meth:`_cast_pending_shadows` casts the map there at the start of the
+        next update.
+        """
+        pos = (int(pos[0]), int(pos[1]))
+        if not wait and (self._deferring() or _compositing.active):
+            smap = self.shadow_cache.find(pos)
+            if smap is None and self._deferring() and pos not in self._cells_in_flight:
+                self._shadow_requests.add(pos)
+            return smap
+        return self.shadow_cache.get(pos, lambda: _mono(self._visibility.render(pos, read=True)))
+
+    def shadow_maps(self, positions):
+        """:meth:`shadow_map` for several cells, cast together.
+
+        The cells not already cached are handed to the provider in one
+        ``render_many(positions, read=True)`` call when it has one -- the GL
+        renderer then reads every map back in a single transfer instead of
+        stalling once per map. A provider without it casts them one by one.
+        """
+        positions = [(int(x), int(y)) for x, y in positions]
+        provider = self._visibility
+
+        def cast(missing):
+            render_many = getattr(provider, 'render_many', None)
+            if render_many is not None:
+                imgs = render_many(missing, read=True)
+            else:
+                imgs = [provider.render(pos, read=True) for pos in missing]
+            return [_mono(img) for img in imgs]
+
+        return self.shadow_cache.get_many(positions, cast)
+
+    def _cast_pending_shadows(self, viewer_pos=None):
+        """Cast, in one batch, every shadow map this frame is about to need.
+
+        That is the viewer's, when sight must be recast, plus one for each
+        light that has moved or arrived since its map was made (see
+        :meth:`~.light.Light.pending_shadow`). Entering a torch-lit level then
+        costs one batched cast rather than a stall per torch. Each light is
+        handed its map here, so it holds the map through the frame even if
+        :attr:`shadow_cache` evicts it before the light is composited, and is
+        relit in case it was last composited without it.
+        """
+        cells = [] if viewer_pos is None else [viewer_pos]
+        pending = []
+        for light in self._cpu_lights():
+            cell = light.pending_shadow()
+            if cell is not None:
+                cells.append(cell)
+                pending.append(light)
+        if self._deferring():
+            smaps = [self.shadow_map(cell, wait=False) for cell in cells]
+        elif cells:
+            # (even one: light maps are built off this thread, which is the
+            # only one that may cast; see _light_footprints)
+            smaps = self.shadow_maps(cells)
+        else:
+            return
+        for light, smap in zip(pending, smaps[len(cells) - len(pending):]):
+            if smap is not None:
+                light.set_shadow_map(smap)
+                self._light_changed(light)
+
+    def _deferring(self):
+        return self.deferred_shadows and hasattr(self._visibility, 'render_deferred')
+
+    def _issue_shadow_requests(self):
+        """Start casting the maps asked for this frame, as one deferred batch."""
+        if not self._shadow_requests:
+            return
+        positions = sorted(self._shadow_requests)
+        self._shadow_requests = set()
+        self._shadows_in_flight.append((positions, self._visibility.render_deferred(positions)))
+        self._cells_in_flight.update(positions)
+        # nothing else may ask for the frame that collects them
+        self.lighting_changed()
+
+    def _collect_shadows(self):
+        """Read back last frame's deferred casts and hand them out.
+
+        Each map goes into the cache, and every light still waiting on one of
+        those cells takes its map and is relit. The line of sight picks its map
+        up from the cache.
+        """
+        in_flight, self._shadows_in_flight = self._shadows_in_flight, []
+        if not in_flight:
+            return
+        resolved = {}
+        for positions, handle in in_flight:
+            for pos, img in zip(positions, handle.result()):
+                smap = _mono(img)
+                self.shadow_cache.put(pos, smap)
+                resolved[pos] = smap
+        self._cells_in_flight.clear()
+        for light in list(self.lights):
+            cell = light.pending_shadow()
+            if cell is not None and tuple(cell) in resolved:
+                light.set_shadow_map(resolved[tuple(cell)])
+                self._light_changed(light)
+
+    @property
+    def light_basis(self):
+        """Composite with the stacked light basis instead of a sum of maps.
+
+        Off by default. With it on, the level keeps every light's unscaled map
+        stacked in one float32 array and computes the illuminance as a single
+        contraction of that stack with the vector of the lights' scaled
+        colours. A torch flicker then costs one pass over the stack and no
+        per-light map at all -- the right trade on a level where many lights
+        change together (``Torch._flicker_all`` retunes every visible flame at
+        once), at the price of holding ``n_lights`` unscaled maps in memory.
+        Switching modes rebuilds the composite.
+        """
+        return self._light_basis
+
+    @light_basis.setter
+    def light_basis(self, enabled):
+        self._light_basis = bool(enabled)
+        self._basis = None
+        self.invalidate_lighting()
+
+    @property
+    def gpu_point_lights(self):
+        """Leave the point lights to the display backend to sum on the GPU.
+
+        Off by default. A backend that accumulates point lights itself (see
+        the vispy ``LightAccumulator``) turns this on, and reads what it needs
+        each frame from :meth:`point_light_params`. The level then composites
+        only its other lights: no point light's shadow is read back and no
+        point light's map is built, and ``sight`` carries just the rest of the
+        light -- the backend adds its own sum on top.
+
+        Eye adaptation and memory still need the point lights' brightness on
+        the CPU. They get an estimate at maze resolution instead (see
+        :meth:`_point_light_luminance`): each light's 1/r^2 falloff averaged
+        over every cell, unshadowed except by the viewer's own line of sight.
+        """
+        return self._gpu_point_lights
+
+    @gpu_point_lights.setter
+    def gpu_point_lights(self, enabled):
+        self._gpu_point_lights = bool(enabled)
+        self._basis = None
+        self._point_light_lum = None
+        self.invalidate_lighting()
+
+    @property
+    def threaded_sight(self):
+        """Composite lighting and sight on a thread of this level's own.
+
+        Off by default. With it on, :meth:`update_sight` keeps only what needs
+        the shadow provider -- casting maps and the line of sight -- and hands
+        the rest of the frame to a :class:`SightCompositor`. That composites
+        into back buffers while the caller goes on to draw, and its finished
+        frames are swapped into ``sight`` and ``memory_field`` by the next
+        update, so those are only ever written on the caller's thread and a
+        heavy recomposite costs the draw nothing. What shows trails the
+        composite by a frame, as does eye adaptation.
+
+        The compositor thread never casts a shadow (see :meth:`shadow_map`),
+        so a GL provider is only ever called from the caller's thread; a
+        light whose map is not cached yet shows its last one until the next
+        update casts it.
+        """
+        return self._compositor is not None
+
+    @threaded_sight.setter
+    def threaded_sight(self, enabled):
+        if bool(enabled) == (self._compositor is not None):
+            return
+        if enabled:
+            self._compositor = SightCompositor(self)
+        else:
+            compositor, self._compositor = self._compositor, None
+            compositor.stop()
+
+    def wait_for_sight(self, timeout=None):
+        """Block until the compositor thread has finished the frames handed to
+        it, for at most *timeout* seconds; return False if it timed out.
+
+        The finished frame still shows only from the next update on. Returns
+        at once when :attr:`threaded_sight` is off.
+        """
+        compositor = self._compositor
+        return True if compositor is None else compositor.wait(timeout)
+
+    def _on_compositor(self, call):
+        """Run *call*, which writes compositor state, on the thread that owns
+        it: now, or at the start of the compositor thread's next frame."""
+        compositor = self._compositor
+        if compositor is None:
+            call()
+        else:
+            compositor.defer(call)
+
+    @property
+    def lighting_process(self):
+        """Leave the point lights to a worker process to shadow and sum.
+
+        Off by default. With it on, a :class:`~.lighting_process.LightingProcess`
+        is started for this level: it holds the maze's opacity and this level's
+        :meth:`point_light_params` in shared memory, casts the lights' shadows
+        with its own CPU caster and sums them into a shared illuminance field,
+        which is added into ``illuminance`` as it stands -- no point light's map
+        is then built in this process. A composite is asked for whenever a
+        point light moves or changes, and shows when it arrives, usually a
+        frame or two later. Turning it off stops the process.
+        """
+        return self._lighting_process is not None
+
+    @lighting_process.setter
+    def lighting_process(self, enabled):
+        if bool(enabled) == (self._lighting_process is not None):
+            return
+        if enabled:
+            from .lighting_process import LightingProcess
+            self._lighting_process = LightingProcess(self.maze, self.supersample)
+        else:
+            process, self._lighting_process = self._lighting_process, None
+            process.close()
+        self._basis = None
+        self.invalidate_lighting()
+
+    def _on_cpu(self, light):
+        """True if *light* is composited here rather than by the backend (or
+        the lighting process)."""
+        return not ((self._gpu_point_lights or self._lighting_process is not None)
+                    and isinstance(light, PointLight))
+
+    def _cpu_lights(self):
+        # a snapshot: lights come and go from animation threads
+        return [light for light in list(self.lights) if self._on_cpu(light)]
+
+    def point_light_params(self):
+        """What a GPU light pass needs of this level's point lights.
+
+        A float32 ``(n, 6)`` array, one row per point light standing here:
+        ``x, y`` (its maze cell), ``radius`` (maze cells, rounded up, as its
+        footprint uses), and ``r, g, b`` (its colour scaled by brightness).
+        """
+        rows = []
+        for light in list(self.lights):
+            if not isinstance(light, PointLight):
+                continue
+            place = light.global_place()
+            if place is None or place[0] is not self.maze:
+                continue
+            x, y = place[1]
+            rows.append((x, y, np.ceil(light.radius), *light._scaled_color()))
+        return np.array(rows, dtype='float32').reshape(-1, 6)
+
+    def _point_light_luminance(self, params):
+        """Unshadowed point-light luminance at field resolution, ``(h, w)``.
+
+        The CPU's stand-in for the point lights the GPU sums when
+        :attr:`gpu_point_lights` is on, for eye adaptation and memory only.
+        Each light (a row of *params*, see :meth:`point_light_params`) adds its
+        falloff averaged over each maze cell it reaches, times the luminance of
+        its colour and full shadow-map white.
+        Computed per maze cell, then repeated up to the field.
+        """
+        ms = self.maze.shape[:2]
+        lum = np.zeros(ms, dtype='float32')
+        ss = self.supersample
+        for x, y, r, cr, cg, cb in params:
+            x, y, r = int(x), int(y), int(r)
+            kernel = self._cell_falloffs.get(r)
+            if kernel is None:
+                n = 2 * r + 1
+                kernel = self.falloff_kernel(r).reshape(n, ss, n, ss).mean(axis=(1, 3))
+                self._cell_falloffs[r] = kernel
+            y0, x0 = max(y - r, 0), max(x - r, 0)
+            y1, x1 = min(y + r + 1, ms[0]), min(x + r + 1, ms[1])
+            if y1 <= y0 or x1 <= x0:
+                continue
+            weight = 255.0 * float(np.dot((cr, cg, cb), LUMINANCE_WEIGHTS))
+            lum[y0:y1, x0:x1] += weight * kernel[y0 - (y - r):y1 - (y - r),
+                                                 x0 - (x - r):x1 - (x - r)]
+        return np.repeat(np.repeat(lum, ss, axis=0), ss, axis=1)
+
     def clear_line_of_sight(self):
         """Nothing on this level is in sight; the viewer has gone elsewhere.
 
@@ -147,7 +631,13 @@ class Level:
         with no player here, no torch on this level is being watched, which is
         what stops the flicker thread burning flames nobody can see.
         """
+        self._on_compositor(self._clear_line_of_sight)
+
+    def _clear_line_of_sight(self):
+        self._remember_view()
         self.line_of_sight[:] = 0
+        self._los_version += 1
+        self._mark_sight_dirty()
 
     def add_light(self, light):
         """Register *light* as shining on this level.
@@ -156,37 +646,45 @@ class Level:
         level, or when a map light is pinned here. Besides holding the light in
         ``lights`` for compositing, the level subscribes to the light's
         ``changed`` signal so that a change in the light's colour or brightness
-        becomes stale lighting and a repaint here -- which is what lets a light
-        announce it changed without holding any reference to the scene.
+        becomes a relit composite and a repaint here -- which is what lets a
+        light announce it changed without holding any reference to the scene.
+        A new light is a structural change: the composite is rebuilt.
         """
         self.lights.append(light)
         light.changed.connect(self._light_changed)
+        self.invalidate_lighting()
 
     def remove_light(self, light):
         """Take *light* off this level; its host has moved elsewhere."""
         light.changed.disconnect(self._light_changed)
         self.lights.remove(light)
+        self.invalidate_lighting()
 
-    def _light_changed(self):
-        """A light on this level changed what it emits: recomposite and repaint.
+    def _light_changed(self, light):
+        """*light* on this level changed what it emits: relight it and repaint.
 
         Runs on whichever thread set the light -- notably the torch flicker
-        thread -- so it only nulls a reference (``invalidate_lighting``) and
-        fires an observable, both safe off the main thread, exactly as the old
-        direct calls to invalidate_lighting()/request_redraw() were.
+        thread -- so it only queues the light (under a lock held for one set
+        insert) and fires an observable, both safe off the main thread. The
+        next update swaps that one light's map in the composite rather than
+        rebuilding the sum of every light (see :meth:`_relight`).
         """
-        self.invalidate_lighting()
+        with self._stale_lock:
+            self._stale_lights.add(light)
         self.lighting_changed()
 
     def invalidate_lighting(self):
         """Discard the composited illuminance; it is rebuilt on the next update.
 
-        Called by a light on this level whose emitted light changed (colour,
-        brightness). Nothing needs to be *kept* to make a flickering flame show:
-        the field is linear HDR and the GPU exposure varies slowly, so a rebuilt
-        ``illuminance`` carrying the flame's new brightness modulates the output
-        directly rather than being renormalised away.
+        For structural changes -- a light arriving or leaving, a spell or a
+        heat spot going out. A light that merely changed colour or brightness
+        does not come through here; it is swapped into the existing composite
+        instead (see :meth:`_light_changed`). Nothing needs to be *kept* to make
+        a flickering flame show: the field is linear HDR and the GPU exposure
+        varies slowly, so an ``illuminance`` carrying the flame's new brightness
+        modulates the output directly rather than being renormalised away.
         """
+        self._lighting_generation += 1
         self.illuminance = None
 
     def invalidate_sight(self):
@@ -196,7 +694,7 @@ class Level:
         update rebuilds both for the new viewpoint.
         """
         self._need_los_update = True
-        self.illuminance = None
+        self.invalidate_lighting()
 
     def enter(self):
         """Prepare this level to be shown, dropping every cross-frame cache.
@@ -206,9 +704,339 @@ class Level:
         scratch, matching what a freshly-entered level should look like. The
         albedo map is *not* dropped: it depends only on the fixed maze.
         """
-        self.illuminance = None
+        self.invalidate_lighting()
         self._need_los_update = True
-        self.sight.set_data(np.zeros((*self.memory.shape, 4), dtype='float32'))
+        self._on_compositor(self._blank_sight)
+
+    def _blank_sight(self):
+        self._sight_out[...] = 0
+        self._publish(self.sight)
+        self._mark_sight_dirty()
+
+    def _composite_lighting(self):
+        """Rebuild the HDR illuminance from every light on this level.
+
+        Only this level's lights are consulted, so their maps are all sized to
+        this level -- no light on another level can contribute a
+        differently-shaped array. Records which map each light contributed, so
+        later colour/brightness changes can be swapped in by :meth:`_relight`.
+        """
+        # anything queued so far is covered by this rebuild; a light that
+        # changes while it runs is queued again and swapped next frame, which
+        # is exact either way because the swap removes what was added here
+        with self._stale_lock:
+            self._stale_lights.clear()
+        self._light_version += 1
+        self._mark_sight_dirty()
+        if self._light_basis:
+            self._build_basis()
+            return self._contract_basis()
+        illuminance = np.zeros(self.field_shape, dtype='float32')
+        self._process_added = None
+        light_maps = {}
+        # only lights that reach something in sight are summed
+        lit, culled = self._cull(self._cpu_lights())
+        for light, footprint in self._light_footprints(lit):
+            region = self._footprint_region(illuminance, footprint)
+            if region is None:
+                continue
+            np.add(region, footprint[1], out=region)
+            light_maps[light] = footprint
+        self._light_maps = light_maps
+        self._culled_lights = culled
+        self._cull_version = self._los_version
+        self._n_light_deltas = 0
+        return illuminance
+
+    def _relight(self, illuminance):
+        """Swap the maps of lights that changed since the last frame, in place.
+
+        For each queued light: its previous contribution out, its current map
+        in -- work proportional to the lights that changed, not to every light
+        on the level. Returns the composite to use, which is a full rebuild
+        instead when the swaps since the last one reach
+        :data:`MAX_LIGHT_DELTAS`.
+        """
+        with self._stale_lock:
+            if not self._stale_lights:
+                return illuminance
+            stale, self._stale_lights = self._stale_lights, set()
+        if self._light_basis:
+            return self._relight_basis(illuminance, stale)
+        if self._n_light_deltas + len(stale) > self.MAX_LIGHT_DELTAS:
+            return self._composite_lighting()
+        self._n_light_deltas += len(stale)
+
+        light_maps = self._light_maps
+        lit, culled = self._cull(light for light in stale if self._on_cpu(light))
+        for light in culled:
+            # gone out of reach of anything in sight: taken out, kept aside
+            old = light_maps.pop(light, None)
+            if old is not None:
+                old_region = illuminance[old[0]]
+                np.subtract(old_region, old[1], out=old_region)
+                self._mark_sight_dirty(old[0])
+                self._light_version += 1
+        self._culled_lights |= culled
+        self._culled_lights.difference_update(lit)
+        for light, new in self._light_footprints(lit):
+            old = light_maps.pop(light, None)
+            region = self._footprint_region(illuminance, new)
+            if region is None:
+                # caught mid-way to another level; leaving this one
+                # invalidates it, so the next frame rebuilds without it
+                new = None
+            if new is old:
+                if new is not None:
+                    light_maps[light] = new
+                continue
+            if old is not None:
+                old_region = illuminance[old[0]]
+                np.subtract(old_region, old[1], out=old_region)
+                self._mark_sight_dirty(old[0])
+            if new is not None:
+                np.add(region, new[1], out=region)
+                light_maps[light] = new
+                self._mark_sight_dirty(new[0])
+            self._light_version += 1
+        return illuminance
+
+    def _cull(self, lights):
+        """Split *lights* into a list of those that reach something in sight
+        and a set of those that do not."""
+        box = self._los_box()
+        lit, culled = [], set()
+        for light in lights:
+            if self._in_view(light.reach(self.supersample), box):
+                lit.append(light)
+            else:
+                culled.add(light)
+        return lit, culled
+
+    def _uncull(self, illuminance):
+        """Sum in, in place, the culled lights the line of sight now reaches.
+
+        Called when the line of sight changed since the lights were culled
+        against it. The lights still out of reach stay culled, and the ones
+        summed stay summed even if it has left them: they cost nothing more.
+        """
+        self._cull_version = self._los_version
+        lit, culled = self._cull(self._culled_lights)
+        self._culled_lights = culled
+        self._n_light_deltas += len(lit)
+        for light, footprint in self._light_footprints(lit):
+            region = self._footprint_region(illuminance, footprint)
+            if region is None:
+                continue
+            np.add(region, footprint[1], out=region)
+            self._light_maps[light] = footprint
+            self._mark_sight_dirty(footprint[0])
+            self._light_version += 1
+
+    def _los_box(self):
+        """The bounding box ``(r0, r1, c0, c1)`` of the field cells in sight,
+        or None when none is."""
+        def box():
+            in_sight = self._los_scalar() > 0
+            rows = np.flatnonzero(in_sight.any(axis=1))
+            if len(rows) == 0:
+                return None
+            cols = np.flatnonzero(in_sight.any(axis=0))
+            return (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        return self._derived('los_box', self._los_version, box)
+
+    @staticmethod
+    def _in_view(window, box):
+        """True if the field *window* ``(rows, cols)`` overlaps *box*."""
+        if window is None or box is None:
+            return False
+        rows, cols = window
+        r0, r1, c0, c1 = box
+        return rows.start < r1 and rows.stop > r0 and cols.start < c1 and cols.stop > c0
+
+    def _add_process_lighting(self, illuminance):
+        """Bring the lighting process's share of *illuminance* up to date.
+
+        Hands the process the point lights as they stand, and swaps the field
+        it last finished in for the one *illuminance* holds, in place. If the
+        process has died, warns and turns :attr:`lighting_process` off, so the
+        next update composites the point lights here.
+        """
+        try:
+            latest = self._lighting_process.update(self.point_light_params())
+        except RuntimeError as exc:
+            warnings.warn("%s: lighting %r in-process instead" % (exc, self.name), RuntimeWarning)
+            self.lighting_process = False
+            return
+        added = self._process_added
+        if latest is None or latest is added:
+            return
+        if added is not None:
+            np.subtract(illuminance, added, out=illuminance)
+        np.add(illuminance, latest, out=illuminance)
+        self._process_added = latest
+        self._light_version += 1
+        self._mark_sight_dirty()
+
+    def _light_footprints(self, lights):
+        """``(light, light.light_footprint())`` for each of *lights*, in order.
+
+        Built on the shared pool of :data:`LIGHT_MAP_WORKERS` threads when
+        there are several lights and more than one worker, each handed back as soon
+        as it and those before it are done, so the caller sums one light while
+        the pool still builds the next. The order is kept so a composite
+        rounds the same way every time. A pool thread casts no shadow: each
+        light's map is looked up here, on the caller's thread, before the light
+        is handed over, and a light still without one is built here instead.
+        Numpy lets go of the GIL for the arithmetic, so the maps are built
+        side by side.
+        """
+        ss = self.supersample
+        if len(lights) < 2 or LIGHT_MAP_WORKERS < 2:
+            for light in lights:
+                yield light, light.light_footprint(supersample=ss)
+            return
+        pool = Level._light_map_pool()
+        futures = []
+        for light in lights:
+            cell = light.pending_shadow()
+            if cell is not None:
+                smap = self.shadow_map(cell, wait=False)
+                if smap is None:
+                    futures.append(None)
+                    continue
+                light.set_shadow_map(smap)
+            futures.append(pool.submit(light.light_footprint, supersample=ss))
+        for light, future in zip(lights, futures):
+            if future is None:
+                yield light, light.light_footprint(supersample=ss)
+            else:
+                yield light, future.result()
+
+    @staticmethod
+    def _light_map_pool():
+        with Level._light_pool_lock:
+            if Level._light_pool is None:
+                Level._light_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=LIGHT_MAP_WORKERS, thread_name_prefix='light maps',
+                    initializer=_mark_compositing)
+            return Level._light_pool
+
+    @staticmethod
+    def _footprint_region(field, footprint):
+        """The view of *field* a light footprint covers, or None.
+
+        None for a light that is nowhere, or whose footprint was made against
+        another level's field -- a light caught mid-way between levels, whose
+        window may run off this one or whose map no longer fits it.
+        """
+        if footprint is None:
+            return None
+        window, light_map = footprint
+        region = field[window]
+        rows, cols = window
+        if region.shape[:2] != (rows.stop - rows.start, cols.stop - cols.start):
+            return None
+        if light_map.shape[:2] not in (region.shape[:2], (1, 1)):
+            return None
+        return region
+
+    def _build_basis(self):
+        """Stack the unscaled map of every light on this level into the basis."""
+        h, w = self.memory.shape
+        ss = self.supersample
+        lights, sources = [], []
+        for light in self._cpu_lights():
+            unscaled = light.unscaled_footprint(supersample=ss)
+            if self._footprint_region(self.memory, unscaled) is None:
+                continue
+            lights.append(light)
+            sources.append(unscaled)
+
+        basis = self._basis
+        if basis is None or basis.shape[0] != len(lights):
+            basis = np.empty((len(lights), 3, h, w), dtype='float32')
+        for row, unscaled in enumerate(sources):
+            self._fill_basis_row(basis[row], unscaled)
+        self._basis = basis
+        self._basis_lights = lights
+        self._basis_rows = {light: row for row, light in enumerate(lights)}
+        self._basis_sources = sources
+        if self._basis_out is None:
+            self._basis_out = np.empty((3, h * w), dtype='float32')
+
+    @staticmethod
+    def _fill_basis_row(row, footprint):
+        """Write an unscaled footprint into one ``(3, h, w)`` basis row.
+
+        The rows are dense: a footprint only saves the light the work of
+        computing its map over the whole field, not the stack the memory.
+        """
+        (rows, cols), unscaled = footprint
+        row[:] = 0
+        # broadcasts a single-channel or uniform map (ArrayLight, AmbientLight)
+        row[:, rows, cols] = unscaled.transpose(2, 0, 1)
+
+    def _contract_basis(self, out=None):
+        """The illuminance as the basis contracted with the lights' colours.
+
+        One matrix-vector product per channel over the channel-planar stack,
+        then a single interleave back to the ``(h, w, 3)`` field -- written
+        into *out* when given, so a recolour reuses the existing composite.
+        """
+        h, w = self.memory.shape
+        if out is None:
+            out = np.empty(self.field_shape, dtype='float32')
+        self._process_added = None
+        lights = self._basis_lights
+        if not lights:
+            out[:] = 0
+            return out
+        colors = np.array([light._scaled_color() for light in lights], dtype='float32')
+        flat = self._basis.reshape(len(lights), 3, h * w)
+        planar = self._basis_out
+        for c in range(3):
+            np.dot(colors[:, c], flat[:, c], out=planar[c])
+        out[:] = planar.reshape(3, h, w).transpose(1, 2, 0)
+        return out
+
+    def _relight_basis(self, illuminance, stale):
+        """The :meth:`_relight` of the stacked compositor.
+
+        A light whose unscaled footprint is new (it moved, or was pinned
+        elsewhere) has its row refreshed; everything else is a recolour, and
+        costs nothing before the one contraction.
+        """
+        rows = self._basis_rows
+        for light in stale:
+            if not self._on_cpu(light):
+                continue
+            row = rows.get(light)
+            if row is None:
+                # arrived without going through add_light's rebuild (a race
+                # with the structural change); rebuild rather than miss it
+                self._build_basis()
+                break
+            unscaled = light.unscaled_footprint(supersample=self.supersample)
+            if self._footprint_region(self.memory, unscaled) is None:
+                # leaving this level; its removal rebuilds without it
+                continue
+            if unscaled is not self._basis_sources[row]:
+                self._fill_basis_row(self._basis[row], unscaled)
+                self._basis_sources[row] = unscaled
+        # the contraction rewrites the whole field
+        self._light_version += 1
+        self._mark_sight_dirty()
+        return self._contract_basis(out=illuminance)
+
+    def falloff_kernel(self, radius):
+        """The :func:`~.light.falloff_kernel` for *radius* at this level's
+        supersample, built once and shared by every point light here."""
+        kernel = self._falloff_kernels.get(radius)
+        if kernel is None:
+            kernel = falloff_kernel(radius, self.supersample)
+            self._falloff_kernels[radius] = kernel
+        return kernel
 
     def _build_albedo_lum(self):
         """Per-cell reflectance luminance at field resolution, ``(h, w, 1)``.
@@ -218,7 +1046,7 @@ class Level:
         each block id maps to the luminance of its background colour, the maze's
         block grid indexes that lookup, and the result is nearest-neighbour
         upsampled by ``supersample`` -- the same maze->field scaling an
-        ArrayLight uses (see :meth:`ArrayLight._render_light_map`).
+        ArrayLight uses (see :meth:`ArrayLight._render_unscaled_map`).
         """
         bg = self.maze.blocktypes.data['bg_color'][:, :3]     # (n_blocktypes, 3)
         bt_lum = (bg @ LUMINANCE_WEIGHTS).astype('float32')   # (n_blocktypes,)
@@ -227,9 +1055,9 @@ class Level:
         up = np.repeat(np.repeat(cell_lum, ss, axis=0), ss, axis=1)
         return up[:, :, None]
 
-    def update_sight(self, dt, player):
+    def update_sight(self, dt, player, view=None):
         """Advance this level's sight/memory field by *dt* seconds, writing the
-        result into ``self.sight``.
+        result into ``self.sight`` and ``self.memory_field``.
 
         Called once per rendered frame by the display backend, for the level it
         is currently showing. Everything read here -- the line-of-sight and
@@ -242,97 +1070,485 @@ class Level:
         applies albedo, the Reinhard curve and display gamma under the player's
         eye-adaptation exposure. This method also drives that adaptation, from
         the reflected luminance of the blocks in a window around the player, and
-        maintains the display-space memory overlay it packs into channel [3].
+        records what is seen into memory. Memory fades where it is drawn, from
+        :attr:`clock`, which is all that advances when nothing else changed.
 
         When *player* is not standing on this level the view is fully blocked:
         line of sight is zero, so channels [0:3] are zero and only the memory
         overlay survives. That is what the renderer shows in the brief window
         after it has switched to a new level but before the player has been
         moved onto it -- the level's memory, for free.
+
+        *view*, ``(x0, y0, x1, y1)`` in maze cells, is the part of the level on
+        screen (see ``Scene.viewport``). Only sight within it, and
+        :data:`VIEW_MARGIN` cells around it, is composited; the rest waits,
+        marked dirty, until it is scrolled into view. None composites it all.
         """
+        self.clock += dt
         watched = player is not None and player.level is self
-        h, w = self.memory.shape
+        cell = los = None
 
         if watched:
-            if self._need_los_update:
-                self.line_of_sight = player.line_of_sight().astype('float32', copy=False)
+            cell = x, y = player.location.global_location.slot
+            self._collect_shadows()
+            self._cast_pending_shadows((x, y) if self._need_los_update else None)
+            if self._need_los_update and self.shadow_map((x, y), wait=False) is not None:
+                # (deferred, a map still being cast leaves the last line of
+                # sight standing for a frame)
+                los = player.line_of_sight().astype('float32', copy=False)
                 self._need_los_update = False
+
+        # Everything above needs the shadow provider, and so stays on this
+        # thread; the compositing below does not, and may be run by the
+        # level's compositor thread instead (see threaded_sight), handing back
+        # the adaptation target of the last frame it finished.
+        compositor = self._compositor
+        if compositor is None:
+            L_scene = self._composite_frame(watched, cell, los, view)
+        else:
+            L_scene = compositor.submit(watched, cell, los, view)
+
+        if watched:
+            self._issue_shadow_requests()
+            # Nothing visible (all shadow) -> keep the previous adaptation.
+            if L_scene is not None:
+                player.adaptation.adapt(L_scene, dt)
+
+    def _composite_frame(self, watched, cell, los, view=None):
+        """Composite one frame of sight from the viewer at maze cell *cell*;
+        return its eye-adaptation target, or None.
+
+        *los* is a freshly cast line of sight to take up, or None to keep the
+        last one; *watched* false means the view is fully blocked. *view* is
+        as for :meth:`update_sight`.
+        """
+        L_scene = None
+        if watched:
+            if los is not None:
+                changed = (los != self.line_of_sight).any(axis=2)
+                # what goes out of view is remembered as it was last seen
+                self._remember_view(changed)
+                self._mark_sight_changed(changed)
+                self.line_of_sight = los
+                self._los_version += 1
             line_of_sight = self.line_of_sight
 
-            # Composite this level's HDR illuminance. Only this level's lights
-            # are consulted, so their maps are all sized to this level -- no
-            # light on another level can contribute a differently-shaped array.
-            # Held in a local because an animator/flicker thread may null the
-            # cache at any moment; the worst that costs is one stale frame.
+            # Composite this level's HDR illuminance: rebuilt after a
+            # structural change, otherwise only the lights that changed are
+            # swapped. An animator/flicker thread may invalidate it at any
+            # moment, so the composite is built in a local and kept only if
+            # no invalidation came in meanwhile: this frame may show a light
+            # just removed, and the next rebuilds without it.
+            generation = self._lighting_generation
             illuminance = self.illuminance
-            if illuminance is None:
-                lights = []
-                # snapshot: a spell mob may add or remove lights from its own
-                # animation thread while this composite runs (see spell.py), so
-                # iterate a copy rather than the live list
-                for light in list(self.lights):
-                    light_map = light.lightmap(supersample=self.supersample)
-                    if light_map is None:
-                        continue
-                    lights.append(light_map)
-                if lights:
-                    # ArraySumCache.sum_arrays asserts on an empty list, and a
-                    # level may legitimately hold no light at all
-                    illuminance = self.light_cache.sum_arrays(lights).astype('float32', copy=False)
-                else:
-                    illuminance = np.zeros(self.field_shape, dtype='float32')
+            if illuminance is None or self._illuminance_generation != generation:
+                illuminance = self._composite_lighting()
+            else:
+                illuminance = self._relight(illuminance)
+            if self._cull_version != self._los_version and not self._light_basis:
+                self._uncull(illuminance)
+            if self._lighting_process is not None:
+                self._add_process_lighting(illuminance)
+            if self._lighting_generation == generation:
                 self.illuminance = illuminance
+                self._illuminance_generation = generation
             if self._albedo_lum is None:
                 self._albedo_lum = self._build_albedo_lum()
 
-            # linear HDR reflected-light input for the GPU tone map
-            E_vis = line_of_sight * illuminance
-            los_scalar = line_of_sight.max(axis=2)
-
-            # Reflected luminance per cell: what the eye and memory respond to.
-            lumE = illuminance @ LUMINANCE_WEIGHTS
-            Y_refl = self._albedo_lum[:, :, 0] * lumE
+            lum_extra = self._point_light_lum_field() if self._gpu_point_lights else None
+            self._sight_inputs = (illuminance, lum_extra)
 
             # Drive eye adaptation from the line-of-sight-weighted mean reflected
-            # luminance in a +/-5 maze-cell window around the player. Nothing
-            # visible (all shadow) -> keep the previous adaptation.
-            x, y = player.location.global_location.slot
-            ss = self.supersample
-            y0, y1 = max(0, y * ss - 5 * ss), min(h, y * ss + 5 * ss)
-            x0, x1 = max(0, x * ss - 5 * ss), min(w, x * ss + 5 * ss)
-            win_w = los_scalar[y0:y1, x0:x1]
-            wsum = win_w.sum()
-            if wsum > 0:
-                L_scene = float((Y_refl[y0:y1, x0:x1] * win_w).sum() / wsum)
-                player.adaptation.adapt(L_scene, dt)
-
-            # remember the brightest reflected luminance ever seen at each cell
-            self.memory = np.maximum(self.memory, Y_refl * los_scalar)
+            # luminance in a +/-5 maze-cell window around the player.
+            x, y = cell
+            L_scene = self._derived('scene_luminance', (x, y, self._los_version, self._light_version),
+                                    lambda: self._scene_luminance(x, y, illuminance, lum_extra))
         else:
             # fully blocked: no live view, memory shows in full
-            line_of_sight = 0.0
-            E_vis = 0.0
-            los_scalar = 0.0
-
-        # forget
-        self.memory *= self.MEMORY_DECAY_RATE ** dt
+            line_of_sight = illuminance = lum_extra = None
+
+        if watched != self._sight_watched:
+            # the view opened or closed: every tile's live light changes
+            self._sight_watched = watched
+            self._mark_sight_dirty()
+        self._composite_sight(line_of_sight, illuminance, lum_extra, view)
+        return L_scene
+
+    def _scene_luminance(self, x, y, illuminance, lum_extra):
+        """The adaptation target seen from maze cell ``(x, y)``, or None
+        when nothing around it is in sight."""
+        h, w = self.memory.shape
+        ss = self.supersample
+        y0, y1 = max(0, y * ss - 5 * ss), min(h, y * ss + 5 * ss)
+        x0, x1 = max(0, x * ss - 5 * ss), min(w, x * ss + 5 * ss)
+        win = (slice(y0, y1), slice(x0, x1))
+        win_w = self._los_scalar()[win]
+        wsum = win_w.sum()
+        if wsum <= 0:
+            return None
+        Y_refl = self._reflected_luminance(win, illuminance, lum_extra)
+        return float((Y_refl * win_w).sum() / wsum)
+
+    def _los_scalar(self):
+        """The line of sight collapsed to one channel, ``(h, w)``."""
+        return self._derived('los_scalar', self._los_version,
+                             lambda: self.line_of_sight.max(axis=2))
+
+    def _derived(self, name, key, compute):
+        """The value *name*, recomputed by *compute* only when *key* -- the
+        versions of the inputs it is derived from -- differs from last time."""
+        cached = self._derived_values.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        value = compute()
+        self._derived_values[name] = (key, value)
+        return value
+
+    @property
+    def memory(self):
+        """Remembered luminance, ``(h, w)``: channel [0] of ``memory_field``."""
+        return self.memory_field.data[:, :, 0]
+
+    @property
+    def memory_time(self):
+        """When each cell was last seen, by :attr:`clock`: channel [1] of
+        ``memory_field``."""
+        return self.memory_field.data[:, :, 1]
+
+    def remembered(self):
+        """The remembered reflected luminance of each cell now, ``(h, w)``.
+
+        What was seen, faded by :data:`MEMORY_DECAY_RATE` for every second of
+        :attr:`clock` since -- the formula the GPU evaluates per fragment,
+        here for a caller without one.
+        """
+        return self.memory * self.MEMORY_DECAY_RATE ** (self.clock - self.memory_time)
+
+    def memory_overlay(self):
+        """The display-space memory overlay now, ``(h, w)``: what the GPU draws
+        from :meth:`remembered` where cells are out of sight."""
+        return memory_display(self.remembered()) * self.sight.data[:, :, 3]
+
+    def _composite_sight(self, line_of_sight, illuminance, lum_extra, view=None):
+        """Write ``sight`` tile by tile, only where something changed.
+
+        A tile (:data:`SIGHT_TILE` field cells square) is composited when one
+        of its inputs changed since it last was -- the line of sight, the
+        illuminance or the point-light estimate, each marking the tiles it
+        touched (see :meth:`_mark_sight_dirty`). Memory fades without being
+        rewritten, so a still frame composites nothing. Runs of adjacent tiles
+        in a tile row are composited as one block. The rest of the field is
+        left exactly as it was, and only the box of tiles written is published
+        (see ``FieldLayer.dirty_region``).
+
+        *line_of_sight* None means the view is fully blocked. With a *view*
+        (see :meth:`update_sight`), only the tiles it and its margin overlap
+        are composited; dirty tiles outside it stay dirty.
+        """
+        T = self.SIGHT_TILE
+        if view is None:
+            active = self._dirty_tiles.copy()
+            self._dirty_tiles[:] = False
+        else:
+            ss, m = self.supersample, self.VIEW_MARGIN
+            x0, y0, x1, y1 = view
+            tiles = (slice(max(y0 - m, 0) * ss // T, max(-(-(y1 + m) * ss // T), 0)),
+                     slice(max(x0 - m, 0) * ss // T, max(-(-(x1 + m) * ss // T), 0)))
+            active = np.zeros_like(self._dirty_tiles)
+            active[tiles] = self._dirty_tiles[tiles]
+            self._dirty_tiles[tiles] = False
+        tile_rows = np.flatnonzero(active.any(axis=1))
+        if len(tile_rows) == 0:
+            return
+        c0 = c1 = None
+        for ti in tile_rows:
+            # runs of consecutive active tiles along this tile row
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], active[ti].view(np.int8), [0]))))
+            for a, b in zip(edges[::2], edges[1::2]):
+                window = (slice(ti * T, (ti + 1) * T), slice(a * T, b * T))
+                self._composite_block(window, line_of_sight, illuminance, lum_extra)
+            c0 = edges[0] if c0 is None else min(c0, edges[0])
+            c1 = edges[-1] if c1 is None else max(c1, edges[-1])
+        region = (slice(tile_rows[0] * T, (tile_rows[-1] + 1) * T), slice(c0 * T, c1 * T))
+        self._publish(self.sight, region)
+        if line_of_sight is not None:
+            self._publish(self.memory_field, region)
+
+    def _composite_block(self, window, line_of_sight, illuminance, lum_extra):
+        """Composite the sight of one block of tiles, in place."""
+        out = self._sight_out[window]
+        if line_of_sight is None:
+            out[:, :, :3] = 0
+            out[:, :, 3] = 1
+            return
+        # linear HDR reflected-light input for the GPU tone map
+        np.multiply(line_of_sight[window], illuminance[window], out=out[:, :, :3])
+        los_scalar = self._los_scalar()[window]
+        # [3]: where the memory overlay shows
+        np.subtract(1.0, los_scalar, out=out[:, :, 3])
+        self._remember_seen(window, illuminance, lum_extra, los_scalar)
+
+    def _remember_seen(self, window, illuminance, lum_extra, los_scalar):
+        """Record the reflected luminance seen over *window* now, where it is
+        brighter than what is remembered there."""
+        seen = self._reflected_luminance(window, illuminance, lum_extra, out=self._lum_scratch[window])
+        np.multiply(seen, los_scalar, out=seen)
+        mem = self._memory_out[window][:, :, 0]
+        when = self._memory_out[window][:, :, 1]
+        faded = self._decay_scratch[window]
+        np.subtract(self.clock, when, out=faded)
+        np.power(self.MEMORY_DECAY_RATE, faded, out=faded)
+        np.multiply(faded, mem, out=faded)
+        brighter = np.greater(seen, faded, out=self._mask_scratch[window])
+        np.copyto(mem, seen, where=brighter)
+        np.copyto(when, self.clock, where=brighter)
+
+    def _remember_view(self, changed=None):
+        """Fold the view as last composited into memory, over the bounding box
+        of the ``(h, w)`` mask *changed* (everywhere when None).
+
+        Memory is only written when a tile is composited, so what stays in
+        view is remembered as of when it last changed; this brings the part
+        about to leave view up to now before it goes.
+        """
+        if self._sight_inputs is None or self._albedo_lum is None:
+            return
+        if changed is None:
+            window = (slice(None), slice(None))
+        else:
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows) == 0:
+                return
+            cols = np.flatnonzero(changed.any(axis=0))
+            window = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+        illuminance, lum_extra = self._sight_inputs
+        self._remember_seen(window, illuminance, lum_extra, self._los_scalar()[window])
+        self._publish(self.memory_field, window)
+
+    def _publish(self, field, region=None):
+        """Declare the compositor wrote *field* (only within *region*, a
+        ``(rows, cols)`` pair of slices, when given): bumped now, or with
+        threaded_sight on, when the frame is swapped in."""
+        compositor = self._compositor
+        if compositor is None:
+            field.bump(region=region)
+        else:
+            compositor.written(field, region)
 
-        # Memory overlay: linear memory -> a stable display value under a FIXED
-        # reference exposure (independent of live adaptation, so a remembered
-        # area does not glow when the eye is dark-adapted). Reinhard + gamma.
-        m = self.memory * (0.18 / MEMORY_REF_LUMINANCE)
-        mem_disp = (m / (1.0 + m)) ** (1.0 / 2.2) * MEMORY_STRENGTH
+    def _reflected_luminance(self, window, illuminance, lum_extra, out=None):
+        """Reflected luminance over *window*: what the eye and memory respond to.
 
-        # Pack RGBA: [0:3] linear HDR visible light, [3] memory where not seen.
-        out = np.empty((h, w, 4), dtype='float32')
-        out[:, :, :3] = E_vis
-        out[:, :, 3] = mem_disp * (1.0 - los_scalar)
-        self.sight.set_data(out)
+        Written into *out* (a view the shape of the window) when given.
+        """
+        lumE = np.matmul(illuminance[window], LUMINANCE_WEIGHTS, out=out)
+        if lum_extra is not None:
+            np.add(lumE, lum_extra[window], out=lumE)
+        return np.multiply(self._albedo_lum[window][:, :, 0], lumE, out=lumE)
+
+    def _mark_sight_dirty(self, window=None):
+        """Have the next update recomposite the tiles *window* ``(rows, cols)``
+        touches -- every tile, when it is None."""
+        if window is None:
+            self._dirty_tiles[:] = True
+            return
+        T = self.SIGHT_TILE
+        rows, cols = window
+        r0, c0 = max(rows.start or 0, 0), max(cols.start or 0, 0)
+        r1 = self.memory.shape[0] if rows.stop is None else rows.stop
+        c1 = self.memory.shape[1] if cols.stop is None else cols.stop
+        if r1 > r0 and c1 > c0:
+            self._dirty_tiles[r0 // T:-(-r1 // T), c0 // T:-(-c1 // T)] = True
+
+    def _mark_sight_changed(self, changed):
+        """:meth:`_mark_sight_dirty` for the tiles where the ``(h, w)`` mask
+        *changed* is set."""
+        T = self.SIGHT_TILE
+        h, w = changed.shape
+        changed = np.logical_or.reduceat(changed, np.arange(0, h, T), axis=0)
+        self._dirty_tiles |= np.logical_or.reduceat(changed, np.arange(0, w, T), axis=1)
+
+    def _point_light_lum_field(self):
+        """:meth:`_point_light_luminance`, recomputed only when a point light
+        changed, marking the tiles whose estimate moved."""
+        params = self.point_light_params()
+        cached = self._point_light_lum
+        if cached is not None and np.array_equal(cached[0], params):
+            return cached[1]
+        lum = self._point_light_luminance(params)
+        if cached is None:
+            self._mark_sight_dirty()
+        else:
+            self._mark_sight_changed(lum != cached[1])
+        self._point_light_lum = (params, lum)
+        self._light_version += 1
+        return lum
 
     def __repr__(self):
         return "<Level %r %dx%d>" % ((self.name,) + self.maze.shape)
 
 
+class SightCompositor:
+    """Composites one level's lighting and sight on a background thread.
+
+    See :attr:`Level.threaded_sight`. The thread owns everything the
+    compositor writes -- the illuminance, the line of sight it takes up, the
+    dirty tiles, and a back buffer each of ``sight`` and ``memory``, sized
+    like the fields. Each frame it is handed (by :meth:`submit`, from
+    ``Level.update_sight``) is composited into the back buffers; the finished
+    frame then waits for the next submit, which swaps it in as the fields'
+    data (``FieldLayer.swap``). The swap happens on the submitting thread,
+    between its uploads, so the front buffer it reads is never written under
+    it. Before compositing again, the thread copies what the last frame wrote
+    into the buffers just swapped out, bringing them up to the front.
+
+    The thread composites a frame only once its last one was swapped in, and
+    only the most recent frame submitted: a draw that outpaces it drops the
+    frames in between.
+    """
+
+    def __init__(self, level):
+        self.level = level
+        self._back = {level.sight: level.sight.data.copy(),
+                      level.memory_field: level.memory_field.data.copy()}
+        level._sight_out = self._back[level.sight]
+        level._memory_out = self._back[level.memory_field]
+
+        self._cond = threading.Condition()
+        self._frame = None          # (watched, cell, los, view) waiting to be composited
+        self._calls = []            # run ahead of it; see Level._on_compositor
+        self._finished = None       # (written, L_scene) waiting to be swapped in
+        self._busy = False          # a frame is being composited
+        self._swapped = {}          # what the last swap brought to the front
+        self._written = {}          # field -> region written this frame
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='sight %s' % level.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, watched, cell, los, view=None):
+        """Queue a frame for compositing, swapping in the last one finished.
+
+        Returns the eye-adaptation target of the frame swapped in, or None.
+        A frame still queued is replaced, keeping its line of sight when this
+        one brings none.
+        """
+        with self._cond:
+            finished, self._finished = self._finished, None
+            if finished is not None:
+                self._swap(finished[0])
+            if los is None and self._frame is not None:
+                los = self._frame[2]
+            self._frame = (watched, cell, los, view)
+            self._cond.notify_all()
+        return None if finished is None else finished[1]
+
+    def wait(self, timeout=None):
+        """Block until the thread is idle -- every frame submitted composited,
+        or the last one finished and waiting to be swapped in -- for at most
+        *timeout* seconds. Returns False if it timed out.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._busy and (
+                self._frame is None or self._finished is not None or not self._running), timeout)
+
+    def defer(self, call):
+        """Run *call* on the thread, ahead of the next frame."""
+        with self._cond:
+            self._calls.append(call)
+
+    def written(self, field, region=None):
+        """Record that this frame wrote *field* within *region* (all of it
+        when None); called on the thread, by ``Level._publish``."""
+        last = self._written.get(field, ())
+        if last is None:
+            return
+        if region is not None:
+            rows, cols = region
+            h, w = field.data.shape[:2]
+            rows, cols = slice(*rows.indices(h)[:2]), slice(*cols.indices(w)[:2])
+            if last:
+                rows = slice(min(rows.start, last[0].start), max(rows.stop, last[0].stop))
+                cols = slice(min(cols.start, last[1].start), max(cols.stop, last[1].stop))
+            region = (rows, cols)
+        self._written[field] = region
+
+    def stop(self):
+        """Finish the frame in hand and end the thread, handing compositing
+        back to the caller's thread."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+        level = self.level
+        if self._finished is not None:
+            self._swap(self._finished[0])
+        level._sight_out = level.sight.data
+        level._memory_out = level.memory_field.data
+        for call in self._calls:
+            call()
+        if self._frame is not None and self._frame[2] is not None:
+            # a line of sight cast but never taken up is cast again
+            level._need_los_update = True
+
+    def _swap(self, written):
+        for field, region in written.items():
+            self._back[field] = field.swap(self._back[field], region=region)
+        self.level._sight_out = self._back[self.level.sight]
+        self.level._memory_out = self._back[self.level.memory_field]
+        self._swapped = written
+
+    def _run(self):
+        _mark_compositing()
+        level = self.level
+        while True:
+            with self._cond:
+                while self._running and (self._frame is None or self._finished is not None):
+                    self._cond.wait()
+                if not self._running:
+                    return
+                frame, self._frame = self._frame, None
+                self._busy = True
+                calls, self._calls = self._calls, []
+                swapped, self._swapped = self._swapped, {}
+            # the back buffers are one frame behind the front
+            for field, region in swapped.items():
+                region = slice(None) if region is None else region
+                self._back[field][region] = field.data[region]
+            for call in calls:
+                call()
+            L_scene = level._composite_frame(*frame)
+            with self._cond:
+                written, self._written = self._written, {}
+                self._finished = (written, L_scene)
+                self._busy = False
+                self._cond.notify_all()
+            if written:
+                # a new frame is ready: have the display come and swap it in
+                level.lighting_changed()
+
+
+def memory_display(memory):
+    """Map remembered linear luminance to the display-space memory overlay.
+
+    Under a FIXED reference exposure (independent of live adaptation, so a
+    remembered area does not glow when the eye is dark-adapted): Reinhard,
+    then gamma, capped at :data:`MEMORY_STRENGTH`. The GPU evaluates the same
+    curve in ``TextureMaskFilter``.
+    """
+    m = memory * (0.18 / MEMORY_REF_LUMINANCE)
+    return (m / (1.0 + m)) ** (1.0 / 2.2) * MEMORY_STRENGTH
+
+
+def _mono(img):
+    """One channel of a shadow map as a provider returned it: ``(h, w)`` uint8.
+
+    Providers may hand back ``(h, w)`` or gray ``(h, w, >=3)`` maps; only the
+    first channel is kept, which is all a gray map has to say.
+    """
+    if img.ndim == 3:
+        img = img[:, :, 0]
+    return np.ascontiguousarray(img, dtype=np.uint8)
+
+
 class LevelPortal:
     """A join between two levels, with a :class:`~.portal.PortalEnd` per side.
 
@@ -24,7 +24,7 @@ if __name__ == '__main__':
     hud = build_hud(scene)
     scene.write('Hello?')
     scene.write('Is anybody\n    there?')
-    renderer = VispySceneRenderer(ui, scene)
+    renderer = VispySceneRenderer(ui, scene, deferred_shadows=True)
     ui.attach_scene(scene)
     dm = DungeonMaster(scene)
 
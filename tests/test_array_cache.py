@@ -1,32 +1,40 @@
 import numpy as np
-from carriage_return.array_cache import ArraySumCache
+from carriage_return.array_cache import LRUArrayCache
 
 
-def test_arraysumcache():
-    cache = ArraySumCache()
+def test_lruarraycache_evicts_least_recently_used_past_budget():
+    cache = LRUArrayCache(max_bytes=3 * 100)
+    made = []
 
-    array_list = list(np.random.normal(size=(5, 10, 10)))
+    def make(key):
+        def compute():
+            made.append(key)
+            return np.full(100, key, dtype='ubyte')
+        return compute
 
-    result = cache.sum_arrays(array_list)
-    assert np.allclose(result, sum(array_list))
-    assert cache._n_used_from_cache == 0
-    assert cache._n_stored_in_cache == 0
-    assert cache._n_summed == 5
+    for key in (1, 2, 3):
+        cache.get(key, make(key))
+    assert cache.get(1, make(1))[0] == 1      # hit, and now most recent
+    cache.get(4, make(4))                     # evicts 2, the least recent
+    assert len(cache) == 3 and cache.nbytes == 300
+    cache.get(2, make(2))
 
-    array_list.append(np.random.normal(size=(10, 10)))
+    assert made == [1, 2, 3, 4, 2]
+    assert (cache.hits, cache.misses) == (1, 5)
+    assert not cache.get(2, make(2)).flags.writeable
 
-    result = cache.sum_arrays(array_list)
-    assert np.allclose(result, sum(array_list))
-    assert cache._n_used_from_cache == 0
-    assert cache._n_stored_in_cache == 5
-    assert cache._n_summed == 6
 
-    array_list[5] = np.random.normal(size=(10, 10))
+def test_lruarraycache_computes_the_misses_of_a_batch_together():
+    cache = LRUArrayCache(max_bytes=10 * 100)
+    cache.get('a', lambda: np.zeros(100))
+    batches = []
 
-    result = cache.sum_arrays(array_list)
-    assert np.allclose(result, sum(array_list))
-    assert cache._n_used_from_cache == 5
-    assert cache._n_stored_in_cache == 5
-    assert cache._n_summed == 1
+    def compute_many(keys):
+        batches.append(list(keys))
+        return [np.full(100, ord(k)) for k in keys]
 
+    arrays = cache.get_many(['b', 'a', 'c', 'b'], compute_many)
 
+    assert batches == [['b', 'c']]
+    assert [a[0] for a in arrays] == [ord('b'), 0, ord('c'), ord('b')]
+    assert (cache.hits, cache.misses) == (1, 3)
@@ -0,0 +1,32 @@
+"""The glyph atlas's signed distance fields, computed in numpy.
+
+Only the distance helpers are exercised here — no fonts, no GL context.
+"""
+import numpy as np
+
+from carriage_return.backends.vispy.graphics import _distance_to, _signed_distance
+
+
+def test_distance_to_is_exact_up_to_the_limit():
+    rng = np.random.default_rng(0)
+    features = rng.random((40, 30)) < 0.02
+    ys, xs = np.nonzero(features)
+    y, x = np.mgrid[:40, :30]
+    exact = np.sqrt(((y[..., None] - ys) ** 2 + (x[..., None] - xs) ** 2).min(axis=-1))
+
+    assert np.allclose(_distance_to(features, 6), np.minimum(exact, 6))
+
+
+def test_signed_distance_of_a_square():
+    inside = np.zeros((9, 10), dtype=bool)
+    inside[3:6, 3:7] = True
+
+    dist = _signed_distance(inside, 2)
+
+    # the edge runs midway between pixels: half a pixel either side of it
+    assert (dist[inside] > 0).all() and (dist[~inside] < 0).all()
+    assert dist[3, 4] == 0.5 and dist[4, 4] == 1.5 and dist[2, 4] == -0.5
+    assert np.isclose(dist[2, 2], 0.5 - np.sqrt(2))
+    # clipped at the limit, and the border of the image counts as outside
+    assert dist[0, 0] == -2
+    assert _signed_distance(np.ones((3, 4), dtype=bool), 2)[1, 1] == 1.5
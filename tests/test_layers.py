@@ -1,7 +1,7 @@
 import numpy as np
 import pytest
 
-from carriage_return.layers import FieldLayer, GlyphRegistry, SpriteLayer
+from carriage_return.layers import SPRITE_DTYPE, FieldLayer, GlyphRegistry, SpriteLayer
 
 
 # ---------------------------------------------------------------- GlyphRegistry
@@ -150,6 +150,103 @@ def test_set_shape_repacks_and_reapplies_following_slots():
     assert a._position is None
 
 
+def test_removed_sprites_are_reused_in_place():
+    """Freeing a slot hides its rows for the next allocation to take; the
+    arrays and every other slot stay put."""
+    layer = SpriteLayer()
+    a = layer.add_sprites((3,))
+    b = layer.add_sprites((2,))
+    c = layer.add_sprites((4,))
+    b.position = (1, 1, 1)
+    c.position = (2, 2, 2)
+    arrays = layer.position
+    sv = layer.structure_version
+
+    layer.remove_sprites(b)
+    assert layer.position is arrays and layer.structure_version == sv
+    assert np.isnan(layer.position[3:5]).all()
+    assert np.all(c.position == 2)
+
+    d = layer.add_sprites((1,))
+    e = layer.add_sprites((1,))
+    assert (d.indices, e.indices) == ((3, 4), (4, 5))
+    assert np.isnan(d.position).all()          # new sprites start hidden
+    assert layer.position is arrays and layer.structure_version == sv
+
+    # adjacent free ranges merge, so a larger slot fits where they were
+    layer.remove_sprites(d)
+    layer.remove_sprites(a)
+    layer.remove_sprites(e)
+    assert layer.add_sprites((5,)).indices == (0, 5)
+
+
+def test_sprite_layer_capacity_doubles_and_shrinks():
+    layer = SpriteLayer()
+    slots = [layer.add_sprites((1,)) for i in range(5)]
+    assert layer.capacity == 8                 # 1, 2, 4, 8
+    assert len(layer) == 5                     # the sprites, not the rows
+    assert slots[-1].indices == (4, 5)
+    assert layer.add_sprites((3,)).indices == (5, 8)
+
+    # freed down to a quarter of the capacity: the free tail is given back
+    big = layer.add_sprites((24,))
+    assert layer.capacity == 32
+    sv = layer.structure_version
+    layer.remove_sprites(big)
+    assert layer.capacity == 8 and layer.structure_version > sv
+
+
+def test_sprite_layer_fields_view_one_record_array():
+    """A layer's attributes are fields of one interleaved array, which a
+    backend can upload as it is: writes land in it and reallocation moves
+    them with it."""
+    layer = SpriteLayer()
+    s = layer.add_sprites((2, 2))
+    s.position = (1, 2, 3)
+    s.glyph = [[4, 5], [6, 7]]
+    s.fgcolor = (1, 0, 0, 1)
+    assert layer.data.dtype == SPRITE_DTYPE and layer.data.flags.c_contiguous
+    assert np.all(layer.data['position'] == (1, 2, 3))
+    assert layer.data['glyph'].tolist() == [4, 5, 6, 7]
+    assert np.all(layer.data['fgcolor'] == (1, 0, 0, 1))
+
+    layer.add_sprites((9,))
+    assert np.shares_memory(s.position, layer.data)
+    assert layer.data['glyph'][:4].tolist() == [4, 5, 6, 7]
+    assert np.isnan(layer.data['position'][4:]).all()
+
+
+def test_sprite_layer_dirty_ranges():
+    """Writes are remembered by attribute and rows, merged per attribute."""
+    layer = SpriteLayer()
+    slots = [layer.add_sprites((2,)) for i in range(4)]
+    v0 = layer.version
+    assert layer.dirty_ranges('position', v0) == []
+    assert layer.dirty_ranges('position', None) == [(0, 8)]
+
+    slots[3].position = (1, 1, 1)
+    slots[0].position = (2, 2, 2)
+    slots[1].glyph = 5
+    slots[1].position = (3, 3, 3)
+    assert layer.dirty_ranges('position', v0) == [(0, 4), (6, 8)]
+    assert layer.dirty_ranges('glyph', v0) == [(2, 4)]
+    assert layer.dirty_ranges('fgcolor', v0) == []
+    assert layer.dirty_ranges('position', layer.version - 1) == [(2, 4)]
+
+    v1 = layer.version
+    layer.remove_sprites(slots[2])              # hides its rows
+    assert layer.dirty_ranges('position', v1) == [(4, 6)]
+    assert layer.dirty_ranges('glyph', v1) == []
+
+    # a reallocation, or a reader too far behind, gets the whole layer
+    layer.add_sprites((9,))
+    assert layer.dirty_ranges('glyph', v1) == [(0, layer.capacity)]
+    v2 = layer.version
+    for i in range(layer.DIRTY_HISTORY + 1):
+        slots[0].glyph = i
+    assert layer.dirty_ranges('glyph', v2) == [(0, layer.capacity)]
+
+
 def test_slot_views_alias_layer_arrays():
     layer = SpriteLayer()
     s = layer.add_sprites((2, 2))
@@ -181,6 +278,46 @@ def test_field_layer_set_data_and_bump():
     assert f.version == v + 1
 
 
+def test_field_layer_dirty_regions():
+    f = FieldLayer('sight', shape=(10, 12, 4))
+    v0 = f.version
+    assert f.dirty_region(v0) is None
+    assert f.dirty_region(None) == (slice(0, 10), slice(0, 12))
+
+    data = f.data.copy()
+    data[2:4, 5, 0] = 1.0
+    region = (slice(2, 4), slice(5, 6))
+    f.set_data(data, region=region)
+    assert np.array_equal(f.data, data)
+    assert f.dirty_region(v0) == region
+
+    f.bump(region=(slice(7, 9), slice(1, 3)))
+    # a reader one write behind sees the last box, two behind their union
+    assert f.dirty_region(f.version - 1) == (slice(7, 9), slice(1, 3))
+    assert f.dirty_region(v0) == (slice(2, 9), slice(1, 6))
+
+    f.bump()  # no region: everything
+    assert f.dirty_region(f.version - 1) == (slice(0, 10), slice(0, 12))
+    for _ in range(FieldLayer.DIRTY_HISTORY):
+        f.bump(region=(slice(0, 1), slice(0, 1)))
+    assert f.dirty_region(f.version - 1) == (slice(0, 1), slice(0, 1))
+    # further behind than the history reaches: everything
+    assert f.dirty_region(v0) == (slice(0, 10), slice(0, 12))
+
+
+def test_field_layer_swap():
+    f = FieldLayer('sight', shape=(10, 12, 4))
+    front = f.data
+    back = front.copy()
+    back[3, 4] = 1.0
+    v = f.version
+    assert f.swap(back, region=(slice(3, 4), slice(4, 5))) is front
+    assert f.data is back
+    assert f.dirty_region(v) == (slice(3, 4), slice(4, 5))
+    with pytest.raises(ValueError):
+        f.swap(np.zeros((10, 12, 3), dtype='float32'))
+
+
 def test_field_layer_from_data():
     src = np.ones((2, 2), dtype='float64')
     f = FieldLayer('opacity', data=src)
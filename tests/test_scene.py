@@ -57,11 +57,13 @@ def test_update_sight(scene):
 def test_memory_decay_is_time_based(scene):
     scene.update_sight(1/60.)
 
-    # update_sight now re-accumulates max(memory, current_lit) BEFORE decaying,
-    # so to isolate pure decay we dominate the accumulation: set memory far
-    # above any lit value, so the max() keeps it and only the decay acts.
+    # memory is stored as (luminance, time seen) and fades by the level clock;
+    # set it far above any lit value, so seeing the cells again keeps it and
+    # only the decay acts.
+    level = scene.level
     scene.memory[:] = 1e6
-    mem = scene.memory.copy()
+    level.memory_time[:] = level.clock
+    mem = level.remembered()
 
     # one 2-second step decays the same as two 1-second steps
     scene_mem_a = mem * scene.MEMORY_DECAY_RATE ** 2.0
@@ -69,7 +71,7 @@ def test_memory_decay_is_time_based(scene):
     assert np.allclose(scene_mem_a, scene_mem_b)
 
     scene.update_sight(2.0)
-    assert np.allclose(scene.memory, scene_mem_a)
+    assert np.allclose(level.remembered(), scene_mem_a)
 
 
 def test_write_message(scene):
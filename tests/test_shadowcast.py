@@ -0,0 +1,199 @@
+"""The numpy CPU shadow caster: the visibility provider with no GL behind it.
+
+Headless throughout, except the equivalence check against the GL
+``ShadowRenderer``, which needs an OpenGL context and skips without one.
+"""
+import functools
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from carriage_return.blocktypes import BlockTypes
+from carriage_return.maze import Maze
+from carriage_return.shadowcast import CpuShadowCaster
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def walled_room(shape=(12, 20)):
+    """Open path inside a one-cell wall border."""
+    bt = BlockTypes()
+    blocks = np.full(shape, bt.id_of('path'), dtype='int')
+    blocks[0, :] = blocks[-1, :] = bt.id_of('wall')
+    blocks[:, 0] = blocks[:, -1] = bt.id_of('wall')
+    return Maze(blocks, bt)
+
+
+def test_render_follows_the_provider_contract():
+    maze = walled_room()
+    caster = CpuShadowCaster(maze, supersample=4)
+    img = caster.render((5, 5), read=True)
+
+    assert img.shape == (12 * 4, 20 * 4)
+    assert img.dtype == np.uint8
+    assert set(np.unique(img)) <= {0, 255}
+    # GL parity: nothing is read back unless asked for
+    assert caster.render((5, 5), read=False) is None
+
+
+def test_an_open_room_is_lit_wall_to_wall():
+    maze = walled_room()
+    ss = 4
+    img = CpuShadowCaster(maze, supersample=ss).render((5, 5))
+    # every field cell strictly inside the border's cells is in the open
+    assert (img[ss:-ss, ss:-ss] == 255).all()
+
+
+def test_a_wall_shadows_what_lies_behind_it():
+    maze = walled_room((12, 20))
+    wall = maze.blocktypes.id_of('wall')
+    maze.blocks[3:9, 10] = wall            # a wall across the middle, x == 10
+    maze.invalidate_appearance()
+    ss = 4
+    img = CpuShadowCaster(maze, supersample=ss).render((5, 6))
+
+    def lit(x, y):
+        return img[y * ss + ss // 2, x * ss + ss // 2] == 255
+
+    assert lit(8, 6)                       # between the viewer and the wall
+    assert not lit(14, 6)                  # straight behind it
+    assert not lit(17, 5)
+    assert lit(13, 11)                     # past the wall's end, in the open
+
+
+def test_light_and_sight_composite_without_gl():
+    """A whole level lights and sees through the CPU provider."""
+    from carriage_return.light import PointLight
+    from carriage_return.scene import Scene
+    from carriage_return.player import Player
+
+    os.chdir(PROJECT_ROOT)  # level1.png is loaded from cwd
+    scene = Scene()
+    maze = walled_room()
+    scene.set_level(maze)
+    scene.level.visibility = CpuShadowCaster(maze, supersample=scene.supersample)
+    player = Player(scene)
+    player.location.update(maze, (5, 5))
+    maze.add_light(PointLight(maze, color=(1, 1, 1)), pos=(8, 8))
+
+    scene.update_sight(1 / 60.)
+
+    assert scene.line_of_sight.max() == 1.0
+    assert scene.sight.data[..., :3].max() > 0
+
+
+@functools.lru_cache(maxsize=None)
+def _gl_canvas_probe():
+    """None if a GL canvas can be made here, else why not.
+
+    Probed once, in a subprocess: Qt with no display to open aborts the whole
+    process rather than raising, which no ``except`` here could catch.
+    """
+    from vispy.app import _default_app
+    app = _default_app.default_app
+    use = '' if app is None else 'vispy.use(app=%r); ' % app.backend_name
+    code = ('import vispy, vispy.scene; ' + use +
+            'vispy.scene.SceneCanvas(show=False, size=(8, 8)).set_current()')
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    if proc.returncode == 0:
+        return None
+    lines = proc.stderr.strip().splitlines()
+    return lines[-1] if lines else 'exit status %d' % proc.returncode
+
+
+def _gl_shadow_renderer(maze, supersample):
+    """A GL ShadowRenderer for *maze*, or skip when there is no GL context."""
+    pytest.importorskip('vispy')
+    failure = _gl_canvas_probe()
+    if failure is not None:
+        pytest.skip("no usable OpenGL context: %s" % failure)
+    try:
+        import vispy.scene
+        from carriage_return.backends.vispy.graphics import ShadowRenderer
+        canvas = vispy.scene.SceneCanvas(show=False, size=(64, 64))
+        canvas.set_current()
+        renderer = ShadowRenderer(maze, canvas, supersample=supersample)
+        renderer.render((1, 1), read=True)
+    except Exception as exc:
+        pytest.skip("no usable OpenGL context: %s" % exc)
+    return renderer
+
+
+@pytest.mark.parametrize('pos', [(7, 7), (9, 7), (5, 5), (40, 8)])
+def test_matches_the_gl_shadow_renderer_on_level1(pos):
+    os.chdir(PROJECT_ROOT)
+    maze = Maze.load_image('level1.png')
+    ss = 4
+    gl = _gl_shadow_renderer(maze, ss).render(pos, read=True)
+    cpu = CpuShadowCaster(maze, supersample=ss).render(pos, read=True)
+
+    assert cpu.shape == gl.shape
+    # the two rasterise the same shadow volumes; they may only disagree on
+    # field cells a shadow edge passes through
+    disagree = (cpu > 127) != (gl > 127)
+    assert disagree.mean() < 0.005
+
+
+def test_the_gl_renderer_batches_to_the_same_maps():
+    os.chdir(PROJECT_ROOT)
+    maze = Maze.load_image('level1.png')
+    renderer = _gl_shadow_renderer(maze, 4)
+    positions = [(7, 7), (9, 7), (5, 5)]
+
+    batch = renderer.render_many(positions, read=True)
+
+    for pos, img in zip(positions, batch):
+        assert np.array_equal(img, renderer.render(pos, read=True))
+
+    deferred = renderer.render_deferred(positions)
+    for img, expected in zip(deferred.result(), batch):
+        assert np.array_equal(img, expected)
+
+    free = len(renderer._free_fbos)
+    renderer.render_deferred(positions).release()   # given up unread
+    assert len(renderer._free_fbos) == free
+
+
+def test_the_gl_light_accumulator_matches_the_cpu_composite():
+    from carriage_return.light import PointLight
+    from carriage_return.world import Level
+
+    os.chdir(PROJECT_ROOT)
+    maze = Maze.load_image('level1.png')
+    level = Level('dungeon', maze)
+    renderer = _gl_shadow_renderer(maze, level.supersample)
+    from vispy.gloo.wrappers import read_pixels
+    from carriage_return.backends.vispy.graphics import LightAccumulator
+
+    level.visibility = renderer
+    for pos in ((7, 7), (9, 12)):
+        maze.add_light(PointLight(maze, color=(1, 0.8, 0.2), radius=6), pos=pos)
+    viewer = (7, 8)
+    expected = (level.shadow_map(viewer)[..., None] / 255.0) * sum(
+        light.lightmap(level.supersample) for light in level.lights)
+
+    acc = LightAccumulator(renderer, level.supersample)
+    acc.render(viewer, level.point_light_params())
+    h, w = acc.size
+    with acc.fbo:
+        got = read_pixels((0, 0, w, h), alpha=False, out_type='float')[::-1]
+
+    # the two only differ along shadow edges, where GL samples the shadow
+    # texture between texels
+    close = np.isclose(got, expected, rtol=1e-3, atol=1e-4).all(axis=2)
+    assert close.mean() > 0.99
+
+    # a flicker changes only colours: every shadow is already cast
+    casts = []
+    cast = renderer._cast
+    renderer._cast = lambda pos: (casts.append(pos), cast(pos))
+    params = level.point_light_params()
+    params[:, 3:] *= 0.5
+    acc.render(viewer, params)
+    assert casts == []
+    with acc.fbo:
+        dimmed = read_pixels((0, 0, w, h), alpha=False, out_type='float')[::-1]
+    assert np.allclose(dimmed, got / 2, rtol=1e-3, atol=1e-4)
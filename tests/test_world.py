@@ -1,4 +1,6 @@
 """Levels, portals, and travelling between them."""
+import threading
+
 import numpy as np
 import pytest
 
@@ -39,6 +41,72 @@ class FakeVisibility:
         return np.full(self.scene.field_shape[:2] + (4,), 255, dtype='ubyte')
 
 
+class CountingVisibility(FakeVisibility):
+    """FakeVisibility that records every cell it is asked to cast from."""
+    def __init__(self, scene):
+        FakeVisibility.__init__(self, scene)
+        self.casts = []
+
+    def render(self, pos, read=True):
+        self.casts.append(tuple(pos))
+        return FakeVisibility.render(self, pos, read)
+
+
+class ThreadVisibility(FakeVisibility):
+    """FakeVisibility that records every thread it is asked to cast on."""
+    def __init__(self, scene):
+        FakeVisibility.__init__(self, scene)
+        self.threads = set()
+
+    def render(self, pos, read=True):
+        self.threads.add(threading.current_thread())
+        return FakeVisibility.render(self, pos, read)
+
+
+class BatchingVisibility(CountingVisibility):
+    """CountingVisibility that also casts in batches, like the GL renderer."""
+    def __init__(self, scene):
+        CountingVisibility.__init__(self, scene)
+        self.batches = []
+
+    def render_many(self, positions, read=True):
+        self.batches.append(list(positions))
+        return [FakeVisibility.render(self, pos, read) for pos in positions]
+
+
+class DeferredVisibility(BatchingVisibility):
+    """BatchingVisibility that can also start a cast and finish it later."""
+    class Handle:
+        def __init__(self, maps):
+            self.maps = maps
+            self.released = False
+
+        def result(self):
+            return self.maps
+
+        def release(self):
+            self.released = True
+
+    def render_deferred(self, positions):
+        return self.Handle(self.render_many(positions))
+
+
+class NearVisibility(DeferredVisibility):
+    """DeferredVisibility that sees only within REACH maze cells of the viewer."""
+    REACH = 3
+
+    def render_many(self, positions, read=True):
+        self.batches.append(list(positions))
+        ss = self.scene.supersample
+        maps = []
+        for x, y in positions:
+            smap = np.zeros(self.scene.field_shape[:2], dtype='ubyte')
+            r = self.REACH
+            smap[max(y - r, 0) * ss:(y + r + 1) * ss, max(x - r, 0) * ss:(x + r + 1) * ss] = 255
+            maps.append(smap)
+        return maps
+
+
 def _auto_visibility(scene):
     """Inject a FakeVisibility onto every level the scene shows, as the real
     renderer does on level_changed -- so a test that travels between levels
@@ -48,6 +116,26 @@ def _auto_visibility(scene):
     scene.level.visibility = FakeVisibility(scene)
 
 
+def _one_level(name, shape, player_at=(5, 5), light_at=None):
+    """A scene showing one bare level of *shape* with a player at *player_at*
+    and, given *light_at*, a white point light there.
+
+    Returns ``(scene, level, player)``.
+    """
+    world = World()
+    world.add_level(Level(name, Maze.filled(shape, world.blocktypes, 'path', obj_name=name)))
+    scene = Scene()
+    scene.set_world(world)
+    level = world.levels[name]
+    level.visibility = FakeVisibility(scene)
+    player = Player(scene)
+    player.location.update(level.maze, player_at)
+    if light_at is not None:
+        from carriage_return.light import PointLight
+        level.maze.add_light(PointLight(level.maze, color=(1, 1, 1)), pos=light_at)
+    return scene, level, player
+
+
 @pytest.fixture
 def played_world():
     """A scene running _flat_world(), with a player on the upper level."""
@@ -274,7 +362,8 @@ def test_a_light_on_another_level_does_not_light_this_one(played_world):
     scene.update_sight(1 / 60.)
 
     assert lower.lights == []
-    assert not scene.sight.data.any()
+    assert not scene.sight.data[..., :3].any()
+    assert not lower.memory_overlay().any()
 
 
 def test_leaving_a_level_clears_its_line_of_sight(played_world):
@@ -333,6 +422,160 @@ def test_compositing_a_level_the_player_has_left_uses_its_own_shape():
     assert big.sight.data[..., 3].any()        # its own remembered field shows
 
 
+def test_sight_is_composited_only_where_something_changed(played_world):
+    """Tiles with nothing new in them and nothing remembered are skipped."""
+    scene, world, player, dm = played_world
+    lower = world.levels['lower']          # the player is upstairs: view blocked
+    lower.update_sight(1 / 60., player)    # the first pass covers every tile
+    v = lower.sight.version
+
+    lower.update_sight(1 / 60., player)
+    assert lower.sight.version == v        # nothing seen, nothing remembered
+
+    T = lower.SIGHT_TILE
+    lower._mark_sight_dirty((slice(T + 3, T + 4), slice(5, 6)))
+    lower.update_sight(1 / 60., player)
+    assert lower.sight.dirty_region(v) == (slice(T, 40), slice(0, T))
+
+
+def test_sight_is_composited_only_around_the_view():
+    """Given the cells on screen, only tiles near them are composited; the
+    rest stay dirty until the view reaches them."""
+    scene, big, player = _one_level('big', (96, 96))
+    T, ss, m = big.SIGHT_TILE, big.supersample, big.VIEW_MARGIN
+
+    v = big.sight.version
+    big.update_sight(1 / 60., player, view=(0, 0, 10, 12))
+    rows, cols = big.sight.dirty_region(v)
+    assert rows.stop == -(-(12 + m) * ss // T) * T
+    assert cols.stop == -(-(10 + m) * ss // T) * T
+    assert big._dirty_tiles[-1, -1]        # off screen: still to do
+
+    v = big.sight.version
+    big.update_sight(1 / 60., player, view=(80, 80, 96, 96))
+    rows, cols = big.sight.dirty_region(v)
+    assert rows.stop == cols.stop == 96 * ss
+    assert not big._dirty_tiles[-1, -1]
+
+    scene.viewport.set_rect((0, 0, 10, 12))    # what the scene passes on
+    big._mark_sight_dirty()
+    v = big.sight.version
+    scene.update_sight(1 / 60.)
+    assert big.sight.dirty_region(v)[0].stop <= 96 * ss // 2
+
+
+def test_a_still_frame_reuses_what_it_derived(played_world):
+    """Values derived from the line of sight and the light are cached under
+    their inputs' versions: only a move or a relight recomputes them."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    light = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(4, 4))
+    scene.update_sight(1 / 60.)
+    los_scalar = upper._los_scalar()
+    target = upper._derived_values['scene_luminance']
+
+    scene.update_sight(1 / 60.)
+    assert upper._los_scalar() is los_scalar
+    assert upper._derived_values['scene_luminance'] is target
+
+    light.brightness = 0.5
+    scene.update_sight(1 / 60.)
+    assert upper._los_scalar() is los_scalar
+    assert upper._derived_values['scene_luminance'][1] < target[1]
+
+    player.location.update(upper.maze, (2, 1))
+    scene.update_sight(1 / 60.)
+    assert upper._los_scalar() is not los_scalar
+
+
+def test_compositing_allocates_no_field_sized_temporaries():
+    """The compositor works in the level's scratch fields: recompositing
+    every tile of a large level allocates only bookkeeping, and a still frame
+    next to nothing."""
+    import tracemalloc
+
+    scene, big, player = _one_level('big', (96, 96), light_at=(9, 9))
+    scene.update_sight(1 / 60.)
+
+    def peak_bytes(frame):
+        tracemalloc.start()
+        try:
+            frame()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    field_bytes = big.memory.nbytes
+    assert peak_bytes(lambda: scene.update_sight(1 / 60.)) < 4096
+    big._mark_sight_dirty()
+    assert peak_bytes(lambda: scene.update_sight(1 / 60.)) < field_bytes / 8
+
+
+def test_sight_can_be_composited_on_a_thread_of_its_own():
+    """With threaded_sight on, a frame is composited into back buffers and
+    swapped in by the next update: the same sight, one frame later."""
+    scene_a, a, _ = _one_level('lit', (20, 20), light_at=(9, 9))
+    scene_b, b, _ = _one_level('lit', (20, 20), light_at=(9, 9))
+    scene_a.update_sight(0.0)
+    b.threaded_sight = True
+    try:
+        scene_b.update_sight(0.0)
+        assert b.wait_for_sight()
+        assert not b.sight.data.any()      # finished, but not swapped in yet
+        scene_b.update_sight(0.0)
+        assert np.array_equal(b.sight.data, a.sight.data)
+        assert np.array_equal(b.memory_field.data, a.memory_field.data)
+        # state the thread owns is written on it, here when it stops
+        b.clear_line_of_sight()
+    finally:
+        b.threaded_sight = False
+    assert not b.line_of_sight.any()
+
+
+def test_compositing_threads_never_cast_shadows():
+    """Off the thread that updates the level, a map that is not cached is
+    not cast: the provider may be bound to that thread's GL context."""
+    scene, level, player = _one_level('lit', (20, 20))
+    level.visibility = provider = ThreadVisibility(scene)
+    found = []
+
+    level.threaded_sight = True
+    try:
+        level._on_compositor(lambda: found.append(level.shadow_map((3, 3), wait=False)))
+        scene.update_sight(0.0)
+        assert level.wait_for_sight()
+    finally:
+        level.threaded_sight = False
+    found.append(Level._light_map_pool().submit(level.shadow_map, (4, 4), wait=False).result())
+
+    assert found == [None, None]
+    assert provider.threads == {threading.current_thread()}
+    assert level.shadow_map((3, 3), wait=False) is not None    # here, it is cast
+
+
+def test_memory_fades_without_being_rewritten(played_world):
+    """A still frame writes neither field; memory fades by the clock alone."""
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    scene.update_sight(1 / 60.)
+    upper.memory[:] = 0.5
+    upper.memory_time[:] = upper.clock
+    upper.memory_field.bump()
+    versions = (upper.sight.version, upper.memory_field.version)
+
+    scene.update_sight(1.0)
+
+    assert (upper.sight.version, upper.memory_field.version) == versions
+    assert np.allclose(upper.remembered(), 0.5 * upper.MEMORY_DECAY_RATE)
+    # out of sight, the overlay shows it; in sight, it does not
+    assert not upper.memory_overlay().any()
+    upper.clear_line_of_sight()
+    upper.update_sight(0.0, player=None)
+    assert upper.memory_overlay().min() > 0
+
+
 def test_a_level_keeps_its_own_memory(played_world):
     """Memory is a fact about a level, so it survives going away and back."""
     scene, world, player, dm = played_world
@@ -370,6 +613,424 @@ def test_an_unlit_level_renders_dark_rather_than_failing(played_world):
     assert not scene.sight.data.any()
 
 
+def test_a_brightness_change_swaps_one_light_in_place(played_world):
+    """A flicker tick relights only the light that changed, not every light."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    a = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(2, 2))
+    b = upper.maze.add_light(PointLight(upper.maze, color=(2, 1, 0)), pos=(7, 7))
+    scene.update_sight(1 / 60.)
+    composite = upper.illuminance
+
+    a.brightness = 3.0
+    scene.update_sight(1 / 60.)
+
+    # same array, updated in place, by one light's delta
+    assert upper.illuminance is composite
+    assert upper._n_light_deltas == 1
+    expected = a.lightmap(upper.supersample) + b.lightmap(upper.supersample)
+    assert np.allclose(upper.illuminance, expected, rtol=1e-5)
+
+
+def test_adding_or_removing_a_light_rebuilds_the_composite(played_world):
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    a = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(2, 2))
+    scene.update_sight(1 / 60.)
+    composite = upper.illuminance
+
+    b = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(7, 7))
+    assert upper.illuminance is None
+    scene.update_sight(1 / 60.)
+    assert upper.illuminance is not composite
+    assert np.allclose(upper.illuminance, a.lightmap(upper.supersample)
+                       + b.lightmap(upper.supersample))
+
+    b.destroy()
+    assert upper.illuminance is None
+    scene.update_sight(1 / 60.)
+    assert np.allclose(upper.illuminance, a.lightmap(upper.supersample))
+
+
+def test_a_light_removed_mid_frame_is_not_kept_in_the_composite(played_world, monkeypatch):
+    """A light leaving while a frame relights (from another thread, as a
+    spell's may) costs at most that frame: the next one rebuilds without it."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    a = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(2, 2))
+    b = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(7, 7))
+    scene.update_sight(1 / 60.)
+
+    relight = upper._relight
+    def relight_while_b_leaves(illuminance):
+        b.destroy()
+        return relight(illuminance)
+    monkeypatch.setattr(upper, '_relight', relight_while_b_leaves)
+    a.brightness = 2.0
+    scene.update_sight(1 / 60.)
+    monkeypatch.undo()
+
+    scene.update_sight(1 / 60.)
+    assert np.allclose(upper.illuminance, a.lightmap(upper.supersample))
+
+
+def test_light_maps_cover_only_their_footprint(played_world):
+    """A light is composited over the window it reaches, and is zero beyond."""
+    from carriage_return.light import AmbientLight, ArrayLight, PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    maze = upper.maze
+    ss = upper.supersample
+
+    torch = maze.add_light(PointLight(maze, color=(1, 1, 1), radius=2), pos=(3, 4))
+    (rows, cols), light_map = torch.light_footprint(ss)
+    assert (rows.start, rows.stop) == (2 * ss, 7 * ss)
+    assert (cols.start, cols.stop) == (1 * ss, 6 * ss)
+    assert light_map.shape == (5 * ss, 5 * ss, 3)
+    full = torch.lightmap(ss)
+    assert full.shape == upper.field_shape
+    assert not full[:rows.start].any() and not full[:, cols.stop:].any()
+
+    spot = np.zeros(maze.shape, dtype='float32')
+    spot[6:8, 2] = 1.0
+    patch = maze.add_light(ArrayLight(maze, spot, color=(1, 1, 1)), pos=(0, 0))
+    (rows, cols), light_map = patch.light_footprint(ss)
+    assert (rows.start, rows.stop, cols.start, cols.stop) == (6 * ss, 8 * ss, 2 * ss, 3 * ss)
+
+    fill = maze.add_light(AmbientLight(maze, color=(0.1, 0.2, 0.3)), pos=(0, 0))
+    window, light_map = fill.light_footprint(ss)
+    assert light_map.size == 3          # one colour, broadcast over the field
+
+    scene.update_sight(1 / 60.)
+    expected = torch.lightmap(ss) + patch.lightmap(ss) + fill.lightmap(ss)
+    assert np.allclose(upper.illuminance, expected, rtol=1e-5)
+
+
+def test_point_lights_slice_the_level_falloff_kernel(played_world):
+    """The shared kernel gives the light the 1/(d^2 + 0.5) it always had,
+    including where its window is clipped by the edge of the maze."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    maze = upper.maze
+    ss = upper.supersample
+    light = maze.add_light(PointLight(maze, color=(1, 1, 1), radius=3), pos=(1, 8))
+
+    (rows, cols), unscaled = light.unscaled_footprint(ss)
+    ys, xs = np.mgrid[rows, cols]
+    dist2 = (ys - (8 + 0.5) * ss) ** 2 + (xs - (1 + 0.5) * ss) ** 2 + 0.5
+    shadow = light.shadow_map((1, 8))[rows, cols]
+    assert np.allclose(unscaled, (shadow / dist2)[:, :, None], rtol=1e-5)
+    assert upper.falloff_kernel(3) is upper.falloff_kernel(3)
+
+
+def test_shadow_maps_are_cast_once_per_cell(played_world):
+    """Walking back over cells, and a torch carried on the viewer's own cell,
+    reuse the level's cached shadow maps instead of casting again."""
+    from carriage_return.item import Torch
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = counting = CountingVisibility(scene)
+    player.take(Torch(location=(upper.maze, (1, 1)), scene=scene))
+
+    for x in (1, 2, 3, 2, 1):
+        player.location.update(upper.maze, (x, 1))
+        scene.update_sight(1 / 60.)
+
+    assert sorted(counting.casts) == [(1, 1), (2, 1), (3, 1)]
+    assert upper.shadow_cache.misses == 3
+    assert upper.shadow_cache.hits > 0
+
+
+def test_shadow_maps_are_cached_as_one_channel(played_world):
+    """An RGBA map from the provider is kept as (h, w) uint8; the line of
+    sight and a point light's footprint are what a three-channel map gave."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = FakeVisibility(scene)
+    light = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1), radius=3), pos=(2, 2))
+    scene.update_sight(1 / 60.)
+
+    smap = upper.shadow_map((1, 1))
+    assert smap.shape == upper.field_shape[:2]
+    assert smap.dtype == np.uint8
+    assert upper.shadow_cache.nbytes == len(upper.shadow_cache) * smap.nbytes
+    assert np.all(upper.line_of_sight == 1.0)
+    assert upper.line_of_sight.shape == upper.field_shape
+    window, unscaled = light.unscaled_footprint(upper.supersample)
+    assert unscaled.shape[2] == 1
+
+
+def test_the_shadows_a_frame_needs_are_cast_in_one_batch(played_world):
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = provider = BatchingVisibility(scene)
+    for pos in ((2, 2), (7, 7), (5, 3)):
+        upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=pos)
+
+    scene.update_sight(1 / 60.)
+
+    assert provider.casts == []
+    assert sorted(provider.batches[0]) == [(1, 1), (2, 2), (5, 3), (7, 7)]
+    assert len(provider.batches) == 1
+
+
+def test_deferred_shadows_arrive_a_frame_later(played_world):
+    """Deferred, a frame asks for the maps it lacks and carries on with what it
+    has; the next frame collects them without casting anything itself."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = provider = DeferredVisibility(scene)
+    upper.deferred_shadows = True
+    light = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1)), pos=(5, 5))
+
+    scene.update_sight(1 / 60.)
+    assert provider.batches == [[(1, 1), (5, 5)]]
+    assert not upper.line_of_sight.any()
+    assert not upper.illuminance.any()
+
+    scene.update_sight(1 / 60.)
+    assert len(provider.batches) == 1 and provider.casts == []
+    assert upper.line_of_sight.all()
+    assert np.allclose(upper.illuminance, light.lightmap(upper.supersample), rtol=1e-5)
+
+    # moved, the light shines from its new cell under its old shadow until
+    # the new one is cast
+    light.pin(upper.maze, (6, 5))
+    light.changed()
+    scene.update_sight(1 / 60.)
+    assert provider.batches[-1] == [(6, 5)]
+    assert upper.illuminance.any()
+
+
+def test_a_new_provider_releases_the_casts_in_flight(played_world):
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = DeferredVisibility(scene)
+    upper.deferred_shadows = True
+    scene.update_sight(1 / 60.)
+    [(_, handle)] = upper._shadows_in_flight
+
+    upper.visibility = DeferredVisibility(scene)
+
+    assert handle.released and upper._shadows_in_flight == []
+
+
+def test_gpu_point_lights_leave_only_their_parameters(played_world):
+    """With the point lights summed by the backend, the level composites the
+    rest, publishes what the GPU needs, and still remembers what it saw."""
+    from carriage_return.light import AmbientLight, PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = provider = CountingVisibility(scene)
+    upper.gpu_point_lights = True
+    maze = upper.maze
+    torch = maze.add_light(PointLight(maze, color=(1, 0.5, 0.25), radius=3), pos=(4, 2))
+    fill = maze.add_light(AmbientLight(maze, color=(0.1, 0.1, 0.1)), pos=(0, 0))
+
+    scene.update_sight(1 / 60.)
+
+    assert provider.casts == [(1, 1)]          # the viewer's, none for the torch
+    assert np.allclose(upper.illuminance, fill.lightmap(upper.supersample))
+    assert np.allclose(upper.point_light_params(), [[4, 2, 3, 1, 0.5, 0.25]])
+    ss = upper.supersample
+    near, far = upper.memory[2 * ss + 1, 4 * ss + 1], upper.memory[2 * ss + 1, 8 * ss + 1]
+    assert near > far > 0
+
+    torch.brightness = 2.0
+    scene.update_sight(1 / 60.)
+    assert np.allclose(upper.point_light_params()[0, 3:], [2, 1, 0.5])
+    assert np.allclose(upper.illuminance, fill.lightmap(upper.supersample))
+
+
+def test_lights_out_of_reach_of_sight_are_not_summed(played_world):
+    """A light whose reach misses everything in sight is left out of the
+    composite, flickers for free, and is summed in once sight reaches it."""
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = NearVisibility(scene)
+    upper.deferred_shadows = True
+    ss = upper.supersample
+    near = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1), radius=1), pos=(2, 1))
+    far = upper.maze.add_light(PointLight(upper.maze, color=(1, 1, 1), radius=1), pos=(8, 8))
+    scene.update_sight(1 / 60.)
+    scene.update_sight(1 / 60.)
+    assert far in upper._culled_lights and far not in upper._light_maps
+    assert np.allclose(upper.illuminance, near.lightmap(ss))
+
+    far.brightness = 2.0
+    scene.update_sight(1 / 60.)
+    assert far not in upper._light_maps
+    assert np.allclose(upper.illuminance, near.lightmap(ss))
+
+    player.location.update(upper.maze, (6, 6))
+    scene.update_sight(1 / 60.)            # rebuilt under the sight still standing
+    assert far not in upper._light_maps
+    scene.update_sight(1 / 60.)            # the new sight reaches it: summed in place
+    assert far in upper._light_maps
+    assert np.allclose(upper.illuminance, near.lightmap(ss) + far.lightmap(ss))
+
+
+def test_light_maps_built_on_the_pool_sum_the_same(played_world, monkeypatch):
+    """Maps built side by side are summed in the lights' order, so the
+    composite is the serial one exactly."""
+    import carriage_return.world as world_module
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    lights = [upper.maze.add_light(PointLight(upper.maze, color=(1, 0.5, i)), pos=(1 + i, 1 + i % 3))
+              for i in range(6)]
+    scene.update_sight(1 / 60.)
+    serial = upper.illuminance.copy()
+
+    monkeypatch.setattr(world_module, 'LIGHT_MAP_WORKERS', 4)
+    for light in lights:
+        light.pin(upper.maze, light.global_place()[1])    # stale, as on entry
+    upper.invalidate_lighting()
+    scene.update_sight(1 / 60.)
+    assert np.array_equal(upper.illuminance, serial)
+
+    for light in lights:
+        light.brightness = 2.0
+    scene.update_sight(1 / 60.)
+    assert np.allclose(upper.illuminance, 2 * serial, rtol=1e-5)
+
+
+def test_light_maps_on_the_pool_cast_no_shadows(played_world, monkeypatch):
+    """Each light holds the map cast for it this frame: one the cache has
+    since evicted is not recast on a pool thread."""
+    import carriage_return.world as world_module
+    from carriage_return.light import PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.visibility = provider = ThreadVisibility(scene)
+    upper.shadow_cache.max_bytes = 1        # every map evicted as soon as kept
+    monkeypatch.setattr(world_module, 'LIGHT_MAP_WORKERS', 4)
+    lights = [upper.maze.add_light(PointLight(upper.maze, color=(1, 0.5, i)), pos=(1 + i, 1 + i % 3))
+              for i in range(6)]
+
+    scene.update_sight(1 / 60.)
+
+    assert provider.threads == {threading.current_thread()}
+    assert np.allclose(upper.illuminance, sum(light.lightmap(upper.supersample) for light in lights))
+
+    # moved after the frame's casts: its map is found on this thread
+    lights[0].pin(upper.maze, (7, 2))
+    list(upper._light_footprints(lights))
+    assert lights[0].pending_shadow() is None
+    assert provider.threads == {threading.current_thread()}
+
+
+def test_point_lights_can_be_lit_in_a_process_of_their_own():
+    """With lighting_process on, a worker process shadows and sums the point
+    lights, and the level adds its field into the illuminance as it stands."""
+    from carriage_return.light import AmbientLight, PointLight
+
+    scene, level, player = _one_level('lit', (12, 12), player_at=(2, 2))
+    maze = level.maze
+    lights = [maze.add_light(PointLight(maze, color=(1, 0.5, 0.25)), pos=(4, 4)),
+              maze.add_light(PointLight(maze, color=(0, 1, 2), radius=3), pos=(8, 6)),
+              maze.add_light(AmbientLight(maze, color=(0.1, 0.1, 0.1)), pos=(0, 0))]
+
+    def expected():
+        return sum(light.lightmap(level.supersample) for light in lights)
+
+    level.lighting_process = True
+    try:
+        def settle():
+            for _ in range(3):
+                scene.update_sight(1 / 60.)
+                level._lighting_process.wait()
+
+        settle()
+        assert np.allclose(level.illuminance, expected(), rtol=1e-5, atol=1e-6)
+        assert set(level._light_maps) == {lights[2]}    # no point light built here
+
+        lights[0].brightness = 2.0
+        settle()
+        assert np.allclose(level.illuminance, expected(), rtol=1e-5, atol=1e-5)
+    finally:
+        level.lighting_process = False
+    assert level.illuminance is None
+
+
+def test_a_dead_lighting_process_falls_back_to_lighting_here():
+    from carriage_return.light import PointLight
+
+    scene, level, player = _one_level('lit', (12, 12), player_at=(2, 2))
+    light = level.maze.add_light(PointLight(level.maze, color=(1, 0.5, 0.25)), pos=(4, 4))
+    level.lighting_process = True
+    process = level._lighting_process._process
+    process.kill()
+    process.join()
+
+    with pytest.warns(RuntimeWarning, match='lighting process'):
+        scene.update_sight(1 / 60.)
+    assert not level.lighting_process
+    scene.update_sight(1 / 60.)
+    assert np.allclose(level.illuminance, light.lightmap(level.supersample), rtol=1e-5)
+
+
+def test_the_light_basis_composites_the_same_sum(played_world):
+    """The stacked compositor agrees with the sum of maps, and a recolour does
+    not rebuild the stack while a move refreshes only the mover's row."""
+    from carriage_return.light import AmbientLight, ArrayLight, PointLight
+
+    scene, world, player, dm = played_world
+    upper = world.levels['upper']
+    upper.light_basis = True
+    maze = upper.maze
+    spot = np.zeros(maze.shape, dtype='float32')
+    spot[4, 4] = 1.0
+    lights = [
+        maze.add_light(PointLight(maze, color=(1, 1, 1)), pos=(2, 2)),
+        maze.add_light(PointLight(maze, color=(2, 1, 0)), pos=(7, 7)),
+        maze.add_light(ArrayLight(maze, spot, color=(3, 2, 1)), pos=(0, 0)),
+        maze.add_light(AmbientLight(maze, color=(0.1, 0.2, 0.3)), pos=(0, 0)),
+    ]
+
+    def expected():
+        return sum(light.lightmap(upper.supersample) for light in lights)
+
+    scene.update_sight(1 / 60.)
+    assert np.allclose(upper.illuminance, expected(), rtol=1e-5)
+    basis = upper._basis
+    assert basis.shape[0] == len(lights)
+
+    lights[0].brightness = 3.0
+    scene.update_sight(1 / 60.)
+    assert upper._basis is basis
+    assert np.allclose(upper.illuminance, expected(), rtol=1e-5)
+
+    untouched = basis[0].copy()
+    lights[1].pin(maze, (5, 2))
+    lights[1].changed()
+    scene.update_sight(1 / 60.)
+    assert upper._basis is basis
+    assert np.array_equal(basis[0], untouched)
+    assert np.allclose(upper.illuminance, expected(), rtol=1e-5)
+
+
 # -- the shipped levels -------------------------------------------------------
 
 def test_home_is_a_walled_room_with_a_hole():